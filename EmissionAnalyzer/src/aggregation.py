@@ -0,0 +1,310 @@
+import math
+import logging
+from collections import deque
+
+log = logging.getLogger(__name__)
+
+# Every numeric pollutant column the emulator sends with each row
+DEFAULT_METRICS = [
+    "vehicle_CO2",
+    "vehicle_CO",
+    "vehicle_HC",
+    "vehicle_NOx",
+    "vehicle_PMx",
+    "vehicle_fuel",
+    "vehicle_noise",
+]
+
+DEFAULT_WINDOWS = [
+    {"name": "all", "type": "running"},
+    {"name": "sliding_60s", "type": "sliding", "size-seconds": 60},
+    {"name": "tumbling_300s", "type": "tumbling", "size-seconds": 300},
+]
+
+TIME_FIELD = "timestep_time"
+
+# A timestep this far behind a window's newest one means the trace started
+# over (e.g. the emulator's next send cycle), so the window is cleared
+DEFAULT_RESTART_GAP_S = 60.0
+
+
+# ==========================================================
+# WINDOW TYPES
+# ==========================================================
+# Each window keeps min/max/sum/count for one metric of one vehicle and
+# exposes the same add()/stats() interface, so new window types can be
+# plugged in through register_window_type(). add() returns False when it
+# rejected a sample as too old for the window; windows bounded in time also
+# have advance(t), which closes them as if time t had been reached without a
+# new sample (e.g. for a vehicle that went quiet). BYTES (plus SAMPLE_BYTES per
+# retained sample) is the approximate size of one instance, measured with
+# sys.getsizeof on CPython 3.11; it sizes the state store's memory limit.
+
+class RunningWindow:
+    """Aggregates over the whole stream since the vehicle was first seen."""
+
+    __slots__ = ("min", "max", "sum", "count")
+
+    BYTES = 140
+
+    def __init__(self, spec):
+        self.min = math.inf
+        self.max = -math.inf
+        self.sum = 0.0
+        self.count = 0
+
+    def add(self, t, v):
+        if v < self.min:
+            self.min = v
+        if v > self.max:
+            self.max = v
+        self.sum += v
+        self.count += 1
+        return True
+
+    def stats(self):
+        return _stats(self.min, self.max, self.sum, self.count)
+
+
+class TumblingWindow(RunningWindow):
+    """Aggregates over fixed, non-overlapping [start, start + size) buckets of timestep_time.
+
+    Samples of an already closed bucket are rejected, unless they are more
+    than restart-gap-seconds behind the current bucket, which restarts it.
+    """
+
+    __slots__ = ("size", "restart_gap", "start")
+
+    BYTES = 240
+
+    def __init__(self, spec):
+        super().__init__(spec)
+        self.size = float(spec["size-seconds"])
+        self.restart_gap = float(spec.get("restart-gap-seconds", DEFAULT_RESTART_GAP_S))
+        self.start = None
+
+    def add(self, t, v):
+        start = math.floor(t / self.size) * self.size
+        if self.start is None or start > self.start or t < self.start - self.restart_gap:
+            # A newer bucket began (or the trace started over); the previous one is closed
+            RunningWindow.__init__(self, None)
+            self.start = start
+        elif start < self.start:
+            return False
+        return RunningWindow.add(self, t, v)
+
+    def advance(self, t):
+        start = math.floor(t / self.size) * self.size
+        if self.start is not None and start > self.start:
+            RunningWindow.__init__(self, None)
+            self.start = start
+
+    def stats(self):
+        s = RunningWindow.stats(self)
+        s["window_start"] = self.start
+        return s
+
+
+class SlidingWindow:
+    """Aggregates over the trailing size-seconds of timestep_time.
+
+    Max and min come from monotonic deques, so every add() is O(1) amortized
+    no matter how many samples the window holds. Samples arriving with an
+    older timestep than the newest one seen are treated as arriving "now"
+    when they still fall inside the window and rejected when they do not. A
+    jump back of more than restart-gap-seconds clears the window.
+    """
+
+    __slots__ = ("size", "restart_gap", "samples", "max_q", "min_q", "sum", "latest")
+
+    # Three empty deques, plus a (t, v) tuple and its share of the deque blocks per sample
+    BYTES = 2500
+    SAMPLE_BYTES = 115
+
+    def __init__(self, spec):
+        self.size = float(spec["size-seconds"])
+        self.restart_gap = float(spec.get("restart-gap-seconds", DEFAULT_RESTART_GAP_S))
+        self._reset()
+
+    def _reset(self):
+        self.samples = deque()
+        self.max_q = deque()
+        self.min_q = deque()
+        self.sum = 0.0
+        self.latest = -math.inf
+
+    def add(self, t, v):
+        if t < self.latest:
+            if t < self.latest - self.restart_gap:
+                # The trace started over
+                self._reset()
+            elif t <= self.latest - self.size:
+                return False
+            else:
+                t = self.latest
+        self.latest = t
+
+        self.samples.append((t, v))
+        self.sum += v
+        while self.max_q and self.max_q[-1][1] <= v:
+            self.max_q.pop()
+        self.max_q.append((t, v))
+        while self.min_q and self.min_q[-1][1] >= v:
+            self.min_q.pop()
+        self.min_q.append((t, v))
+
+        self._expire(t - self.size)
+        return True
+
+    def advance(self, t):
+        # Only expires; the newest sample time stays, so the vehicle's own later rows are not late
+        if t > self.latest:
+            self._expire(t - self.size)
+
+    def _expire(self, cutoff):
+        samples = self.samples
+        while samples and samples[0][0] <= cutoff:
+            _, old = samples.popleft()
+            self.sum -= old
+        while self.max_q and self.max_q[0][0] <= cutoff:
+            self.max_q.popleft()
+        while self.min_q and self.min_q[0][0] <= cutoff:
+            self.min_q.popleft()
+
+    def stats(self):
+        count = len(self.samples)
+        if not count:
+            return _stats(math.inf, -math.inf, 0.0, 0)
+        return _stats(self.min_q[0][1], self.max_q[0][1], self.sum, count)
+
+
+def _stats(lo, hi, total, count):
+    if not count:
+        return {"min": None, "max": None, "sum": 0.0, "mean": None, "count": 0}
+    return {"min": lo, "max": hi, "sum": total, "mean": total / count, "count": count}
+
+
+WINDOW_TYPES = {
+    "running": RunningWindow,
+    "tumbling": TumblingWindow,
+    "sliding": SlidingWindow,
+}
+
+
+def register_window_type(name, cls):
+    """Makes a custom window class available to the "type" field of window specs."""
+    WINDOW_TYPES[name] = cls
+
+
+# ==========================================================
+# ENGINE
+# ==========================================================
+class AggregationEngine:
+    """Per-vehicle min/max/sum/mean/count for a set of metrics over a set of windows.
+
+    restart_gap_s applies to windows whose spec does not set its own
+    "restart-gap-seconds". Samples a window rejected as too old are counted
+    in late_samples.
+    """
+
+    def __init__(self, metrics=None, windows=None, restart_gap_s=DEFAULT_RESTART_GAP_S):
+        self.metrics = list(metrics or DEFAULT_METRICS)
+        self.windows = [
+            dict({"restart-gap-seconds": restart_gap_s}, **spec) for spec in (windows or DEFAULT_WINDOWS)
+        ]
+        for spec in self.windows:
+            if spec.get("type") not in WINDOW_TYPES:
+                raise ValueError(f"Unknown window type '{spec.get('type')}' in window '{spec.get('name')}'")
+        self.window_names = [spec["name"] for spec in self.windows]
+        # vehicle_id -> list (one per metric) of lists (one per window)
+        self.state = {}
+        self.late_samples = 0
+
+    @classmethod
+    def from_config(cls, cfg):
+        """Builds an engine from the 'aggregation' section of the analyzer configuration."""
+        return cls(cfg.get("metrics"), cfg.get("windows"), cfg.get("restart-gap-seconds", DEFAULT_RESTART_GAP_S))
+
+    def __len__(self):
+        return len(self.state)
+
+    def _new_vehicle(self):
+        return [
+            [WINDOW_TYPES[spec["type"]](spec) for spec in self.windows]
+            for _ in self.metrics
+        ]
+
+    def update(self, vehicle_id, payload):
+        """Feeds one telemetry row into every metric and window of a vehicle.
+
+        Returns the list of metrics that carried a usable value.
+        """
+        try:
+            t = float(payload.get(TIME_FIELD, 0.0))
+        except (TypeError, ValueError):
+            t = 0.0
+
+        vehicle = self.state.get(vehicle_id)
+        if vehicle is None:
+            vehicle = self.state[vehicle_id] = self._new_vehicle()
+
+        updated = []
+        for metric, windows in zip(self.metrics, vehicle):
+            raw = payload.get(metric)
+            if raw is None:
+                continue
+            try:
+                v = float(raw)
+            except (TypeError, ValueError):
+                continue
+            if v != v:  # NaN
+                continue
+            for w in windows:
+                if w.add(t, v) is False:
+                    self.late_samples += 1
+            updated.append(metric)
+        return updated
+
+    def snapshot(self, vehicle_id):
+        """Returns {metric: {window_name: stats}} for one vehicle, or None if unseen."""
+        vehicle = self.state.get(vehicle_id)
+        if vehicle is None:
+            return None
+        return {
+            metric: {name: w.stats() for name, w in zip(self.window_names, windows)}
+            for metric, windows in zip(self.metrics, vehicle)
+        }
+
+    def value(self, vehicle_id, metric, window_name, stat):
+        """One statistic of one window (e.g. "vehicle_CO2", "sliding_60s", "max"), or None."""
+        vehicle = self.state.get(vehicle_id)
+        if vehicle is None:
+            return None
+        try:
+            windows = vehicle[self.metrics.index(metric)]
+            return windows[self.window_names.index(window_name)].stats()[stat]
+        except (ValueError, KeyError):
+            return None
+
+    def advance(self, vehicle_id, metric, window_name, t):
+        """Moves one window of one vehicle forward to timestep t, if the window type supports it."""
+        vehicle = self.state.get(vehicle_id)
+        if vehicle is None:
+            return
+        window = vehicle[self.metrics.index(metric)][self.window_names.index(window_name)]
+        advance = getattr(window, "advance", None)
+        if advance is not None:
+            advance(t)
+
+    def bytes_per_vehicle(self, rows_per_s=1.0):
+        """Approximate size of one vehicle's windows when it sends rows_per_s rows per second."""
+        per_metric = 64
+        for spec in self.windows:
+            cls = WINDOW_TYPES[spec["type"]]
+            per_metric += getattr(cls, "BYTES", RunningWindow.BYTES)
+            if hasattr(cls, "SAMPLE_BYTES"):
+                per_metric += int(cls.SAMPLE_BYTES * float(spec["size-seconds"]) * rows_per_s)
+        return 64 + per_metric * len(self.metrics)
+
+    def forget(self, vehicle_id):
+        self.state.pop(vehicle_id, None)
@@ -0,0 +1,78 @@
+from telemetry_codec import is_batch
+
+VEHICLE_KEY = "vehicle_id"
+CO2_KEY = "vehicle_CO2"
+# Older payloads used a bare 'CO2' column
+CO2_FALLBACK_KEYS = ("CO2",)
+
+
+def project(message, fields, fallbacks=None):
+    """Yields one tuple of the requested fields per row, without building row dicts.
+
+    message may be a row dict, a columnar batch or a list of either. fallbacks
+    maps a field to alternative names tried when it is absent. Missing fields
+    come back as None.
+    """
+    fallbacks = fallbacks or {}
+    if isinstance(message, list):
+        for item in message:
+            yield from project(item, fields, fallbacks)
+    elif is_batch(message):
+        columns = message["columns"]
+        idx = []
+        for f in fields:
+            names = (f,) + tuple(fallbacks.get(f, ()))
+            idx.append(next((columns.index(n) for n in names if n in columns), None))
+        for values in message["rows"]:
+            yield tuple(values[i] if i is not None else None for i in idx)
+    elif isinstance(message, dict):
+        out = []
+        for f in fields:
+            v = message.get(f)
+            if v is None:
+                for alt in fallbacks.get(f, ()):
+                    v = message.get(alt)
+                    if v is not None:
+                        break
+            out.append(v)
+        yield tuple(out)
+
+
+def max_by_vehicle(message, vehicle_key=VEHICLE_KEY, value_key=CO2_KEY, fallback_keys=CO2_FALLBACK_KEYS):
+    """Group-by max of value_key per vehicle over a whole batch in one pass.
+
+    Returns ({vehicle_id: max}, number of rows skipped for a missing id or value).
+    """
+    maxima = {}
+    skipped = 0
+    get = maxima.get
+    for vehicle_id, raw in project(message, (vehicle_key, value_key), {value_key: fallback_keys}):
+        if vehicle_id is None or raw is None:
+            skipped += 1
+            continue
+        try:
+            value = float(raw)
+        except (TypeError, ValueError):
+            skipped += 1
+            continue
+        if value != value:
+            skipped += 1
+            continue
+        vehicle_id = str(vehicle_id)
+        current = get(vehicle_id)
+        if current is None or value > current:
+            maxima[vehicle_id] = value
+    return maxima, skipped
+
+
+def merge_max(store, metric, maxima):
+    """Merges batch maxima into a VehicleStateStore; returns [(vehicle_id, new max)] that changed.
+
+    A vehicle seen for the first time always counts as changed.
+    """
+    changed = []
+    for vehicle_id, value in maxima.items():
+        _, updated = store.update_max(vehicle_id, metric, value)
+        if updated:
+            changed.append((vehicle_id, value))
+    return changed
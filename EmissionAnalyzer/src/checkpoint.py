@@ -0,0 +1,206 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque
+
+log = logging.getLogger(__name__)
+
+SNAPSHOT_FILE = "snapshot.json"
+LOG_FILE_FORMAT = "updates.{}.log"
+
+
+class StateCheckpointer:
+    """Durable key -> value state backed by a snapshot plus an append-only update log.
+
+    record() only appends to an in-memory queue. A writer thread appends the
+    queued updates to updates.<generation>.log and mirrors them into its own
+    copy of the state. Once the log holds max_log_records updates (or
+    snapshot_interval_s passed with updates pending) the mirror is written to
+    snapshot.json atomically, a new log generation is started and the old log
+    is deleted. Recovery therefore reads one snapshot and replays at most
+    max_log_records updates.
+    """
+
+    def __init__(self, directory, flush_interval_s=1.0, snapshot_interval_s=60.0,
+                 max_log_records=100000, fsync=True):
+        self.directory = directory
+        self.flush_interval_s = float(flush_interval_s)
+        self.snapshot_interval_s = float(snapshot_interval_s)
+        self.max_log_records = int(max_log_records)
+        self.fsync = fsync
+
+        self._queue = deque()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self._state = {}
+        self._generation = 0
+        self._log = None
+        self._log_records = 0
+        self._last_snapshot = time.monotonic()
+
+        self.snapshots_written = 0
+        self.records_logged = 0
+
+    @classmethod
+    def from_config(cls, cfg):
+        """Builds a checkpointer from the 'checkpoint' section of the analyzer configuration."""
+        directory = os.environ.get("EMISSION_STATE_DIR") or cfg.get("directory", "state")
+        return cls(
+            directory,
+            flush_interval_s=cfg.get("flush-interval-seconds", 1.0),
+            snapshot_interval_s=cfg.get("snapshot-interval-seconds", 60.0),
+            max_log_records=cfg.get("max-log-records", 100000),
+            fsync=cfg.get("fsync", True),
+        )
+
+    # ------------------------------------------------------------------
+    # Recovery
+    # ------------------------------------------------------------------
+    def load(self):
+        """Restores the latest snapshot plus its log tail. Call once, before start()."""
+        os.makedirs(self.directory, exist_ok=True)
+        state = {}
+        generation = 0
+
+        snapshot_path = os.path.join(self.directory, SNAPSHOT_FILE)
+        if os.path.exists(snapshot_path):
+            try:
+                with open(snapshot_path) as f:
+                    snap = json.load(f)
+                state = snap["state"]
+                generation = int(snap["generation"])
+            except (OSError, ValueError, KeyError) as e:
+                log.error(f"Ignoring unreadable snapshot {snapshot_path}: {e}")
+
+        replayed = 0
+        log_path = os.path.join(self.directory, LOG_FILE_FORMAT.format(generation))
+        if os.path.exists(log_path):
+            with open(log_path) as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        # A torn final line from a crash mid-write
+                        break
+                    if rec["v"] is None:
+                        state.pop(rec["k"], None)
+                    else:
+                        state[rec["k"]] = rec["v"]
+                    replayed += 1
+
+        # Logs of older generations are already folded into the snapshot
+        for name in os.listdir(self.directory):
+            if name.startswith("updates.") and name != os.path.basename(log_path):
+                os.remove(os.path.join(self.directory, name))
+
+        self._state = dict(state)
+        self._generation = generation
+        self._log_records = replayed
+        log.info(f"Recovered {len(state)} keys from {self.directory} (generation {generation}, {replayed} log records replayed)")
+        return state
+
+    # ------------------------------------------------------------------
+    # Hot path
+    # ------------------------------------------------------------------
+    def record(self, key, value):
+        """Queues an update for durable storage. Never touches the disk."""
+        self._queue.append((key, value))
+
+    def discard(self, key):
+        """Queues removal of a key (e.g. an evicted vehicle)."""
+        self._queue.append((key, None))
+
+    def get(self, key, default=None):
+        """Last written value of a key (updates still queued are not included)."""
+        return self._state.get(key, default)
+
+    def depth(self):
+        return len(self._queue)
+
+    # ------------------------------------------------------------------
+    # Writer thread
+    # ------------------------------------------------------------------
+    def start(self):
+        if self._thread is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._open_log()
+            self._thread = threading.Thread(target=self._run, name="state-checkpointer", daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self):
+        """Writes out everything queued and takes a final snapshot."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._log is not None:
+            self._write_log()
+            self._snapshot()
+            self._log.close()
+            self._log = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval_s)
+            self._wake.clear()
+            try:
+                self._write_log()
+                if self._log_records >= self.max_log_records or (
+                        self._log_records and time.monotonic() - self._last_snapshot >= self.snapshot_interval_s):
+                    self._snapshot()
+            except OSError as e:
+                log.error(f"State checkpoint failed: {e}")
+
+    def _open_log(self):
+        path = os.path.join(self.directory, LOG_FILE_FORMAT.format(self._generation))
+        self._log = open(path, "a")
+
+    def _write_log(self):
+        if not self._queue:
+            return
+        lines = []
+        queue = self._queue
+        state = self._state
+        while queue:
+            key, value = queue.popleft()
+            if value is None:
+                state.pop(key, None)
+            else:
+                state[key] = value
+            lines.append(json.dumps({"k": key, "v": value}))
+        self._log.write("\n".join(lines) + "\n")
+        self._log.flush()
+        if self.fsync:
+            os.fsync(self._log.fileno())
+        self._log_records += len(lines)
+        self.records_logged += len(lines)
+
+    def _snapshot(self):
+        old_generation = self._generation
+        self._generation += 1
+
+        tmp_path = os.path.join(self.directory, SNAPSHOT_FILE + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"generation": self._generation, "state": self._state}, f)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        os.replace(tmp_path, os.path.join(self.directory, SNAPSHOT_FILE))
+
+        # The new snapshot covers everything in the old log; start a fresh one
+        self._log.close()
+        self._open_log()
+        try:
+            os.remove(os.path.join(self.directory, LOG_FILE_FORMAT.format(old_generation)))
+        except FileNotFoundError:
+            pass
+
+        self._log_records = 0
+        self._last_snapshot = time.monotonic()
+        self.snapshots_written += 1
@@ -0,0 +1,205 @@
+import time
+import heapq
+import itertools
+import threading
+
+TIME_FIELD = "timestep_time"
+
+
+class SequenceWindow:
+    """Remembers which of the last `size` sequence numbers of one stream were seen.
+
+    Bit i of `bits` is set when highest - i arrived. Anything at or below
+    highest - size is too old to tell and is reported as stale. A new boot
+    nonce means the sender restarted its counter, so the window starts over.
+    """
+
+    __slots__ = ("boot", "highest", "bits")
+
+    def __init__(self, boot):
+        self.boot = boot
+        self.highest = None
+        self.bits = 0
+
+    def check(self, boot, seq, size):
+        """Returns "new", "duplicate" or "stale", and records seq when it is new."""
+        if boot != self.boot or self.highest is None:
+            self.boot = boot
+            self.highest = seq
+            self.bits = 1
+            return "new"
+        if seq > self.highest:
+            shift = seq - self.highest
+            self.bits = ((self.bits << shift) | 1) & ((1 << size) - 1) if shift < size else 1
+            self.highest = seq
+            return "new"
+        offset = self.highest - seq
+        if offset >= size:
+            return "stale"
+        mask = 1 << offset
+        if self.bits & mask:
+            return "duplicate"
+        self.bits |= mask
+        return "new"
+
+
+class OrderingStage:
+    """Drops redelivered messages and puts each vehicle's rows back in timestep order.
+
+    Dedupe: every message carries the sender's boot nonce and per-device seq
+    (see lab4_emulator_client.py). A per-vehicle SequenceWindow of `window`
+    bits (window / 8 bytes) flags repeats. Messages without a seq pass through.
+
+    Reorder: with reorder_window_s > 0, a vehicle's rows wait in a heap keyed on
+    timestep_time until the newest timestep is reorder_window_s ahead, the
+    heap holds max_buffered_rows, or the oldest row waited max_hold_s of wall
+    time (expired() finds those). Rows older than the last released one are
+    late. They are processed anyway or dropped, depending on late_policy,
+    unless the timestep jumped back by more than restart_gap_s, which means
+    the trace started over.
+
+    A vehicle's state is only touched by the worker owning its shard; the lock
+    only guards the set of vehicles with held rows.
+    """
+
+    def __init__(self, window=1024, reorder_window_s=0.0, max_buffered_rows=64, max_hold_s=5.0,
+                 late_policy="process", restart_gap_s=60.0):
+        if late_policy not in ("process", "drop"):
+            raise ValueError(f"Unknown late policy '{late_policy}'")
+        self.window = int(window)
+        self.reorder_window_s = float(reorder_window_s)
+        self.max_buffered_rows = int(max_buffered_rows)
+        self.max_hold_s = float(max_hold_s)
+        self.late_policy = late_policy
+        self.restart_gap_s = float(restart_gap_s)
+
+        # vehicle_id -> SequenceWindow
+        self.sequences = {}
+        # vehicle_id -> heap of (timestep, arrival counter, row)
+        self.held = {}
+        # vehicle_id -> timestep of the last released row
+        self.released = {}
+        # vehicle_id -> wall time its oldest held row arrived
+        self._held_since = {}
+        self._held_lock = threading.Lock()
+        self._arrivals = itertools.count()
+
+        self.duplicates = 0
+        self.stale = 0
+        self.late_rows = 0
+        self.dropped_late_rows = 0
+
+    @classmethod
+    def from_config(cls, cfg):
+        """Builds the stage from the 'ordering' section of the analyzer configuration."""
+        return cls(
+            window=cfg.get("dedupe-window", 1024),
+            reorder_window_s=cfg.get("reorder-window-seconds", 0.0),
+            max_buffered_rows=cfg.get("max-buffered-rows", 64),
+            max_hold_s=cfg.get("max-hold-seconds", 5.0),
+            late_policy=cfg.get("late-policy", "process"),
+            restart_gap_s=cfg.get("restart-gap-seconds", 60.0),
+        )
+
+    def accept(self, vehicle_id, boot, seq):
+        """False if this (boot, seq) of the vehicle was already seen or is too old to tell."""
+        if seq is None:
+            return True
+        state = self.sequences.get(vehicle_id)
+        if state is None:
+            state = self.sequences[vehicle_id] = SequenceWindow(boot)
+        verdict = state.check(boot, seq, self.window)
+        if verdict == "duplicate":
+            self.duplicates += 1
+            return False
+        if verdict == "stale":
+            self.stale += 1
+            return False
+        return True
+
+    def order(self, vehicle_id, rows, now=None):
+        """Feeds a vehicle's rows in and returns those ready for processing, in timestep order."""
+        if self.reorder_window_s <= 0:
+            return self._release(vehicle_id, rows)
+        heap = self.held.setdefault(vehicle_id, [])
+        # Rows without a timestep cannot be placed, so they are not held
+        untimed = []
+        for row in rows:
+            t = _timestep(row)
+            if t is None:
+                untimed.append(row)
+            else:
+                heapq.heappush(heap, (t, next(self._arrivals), row))
+
+        ready = []
+        if heap:
+            newest = max(entry[0] for entry in heap)
+            while heap and (heap[0][0] <= newest - self.reorder_window_s or len(heap) > self.max_buffered_rows):
+                ready.append(heapq.heappop(heap)[2])
+
+        with self._held_lock:
+            if heap:
+                self._held_since.setdefault(vehicle_id, time.monotonic() if now is None else now)
+            else:
+                self._held_since.pop(vehicle_id, None)
+                self.held.pop(vehicle_id, None)
+        return self._release(vehicle_id, ready) + untimed
+
+    def _release(self, vehicle_id, rows):
+        last = self.released.get(vehicle_id)
+        out = []
+        for row in rows:
+            t = _timestep(row)
+            if t is not None:
+                if last is not None and t < last:
+                    if t < last - self.restart_gap_s:
+                        # The trace started over (e.g. the next emulator send cycle)
+                        last = t
+                    else:
+                        self.late_rows += 1
+                        if self.late_policy == "drop":
+                            self.dropped_late_rows += 1
+                            continue
+                else:
+                    last = t
+            out.append(row)
+        if last is not None:
+            self.released[vehicle_id] = last
+        return out
+
+    def expired(self, now=None):
+        """Vehicles whose oldest held row has waited longer than max_hold_s."""
+        now = time.monotonic() if now is None else now
+        with self._held_lock:
+            return [vid for vid, since in self._held_since.items() if now - since >= self.max_hold_s]
+
+    def drain(self, vehicle_id):
+        """Releases every row held for a vehicle, in timestep order."""
+        heap = self.held.pop(vehicle_id, None) or []
+        with self._held_lock:
+            self._held_since.pop(vehicle_id, None)
+        return self._release(vehicle_id, [heapq.heappop(heap)[2] for _ in range(len(heap))])
+
+    def held_vehicles(self):
+        with self._held_lock:
+            return list(self._held_since)
+
+    def held_rows(self):
+        return sum(len(heap) for heap in list(self.held.values()))
+
+    def forget(self, vehicle_id):
+        self.sequences.pop(vehicle_id, None)
+        self.held.pop(vehicle_id, None)
+        self.released.pop(vehicle_id, None)
+        with self._held_lock:
+            self._held_since.pop(vehicle_id, None)
+
+
+def _timestep(row):
+    if not isinstance(row, dict):
+        return None
+    try:
+        t = float(row[TIME_FIELD])
+    except (KeyError, TypeError, ValueError):
+        return None
+    return None if t != t else t
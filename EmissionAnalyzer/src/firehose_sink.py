@@ -0,0 +1,214 @@
+import json
+import time
+import logging
+import threading
+from collections import deque
+
+log = logging.getLogger(__name__)
+
+# Hard limits imposed by the Firehose PutRecordBatch API
+FIREHOSE_MAX_BATCH_RECORDS = 500
+FIREHOSE_MAX_BATCH_BYTES = 4 * 1024 * 1024
+FIREHOSE_MAX_RECORD_BYTES = 1000 * 1024
+
+OVERFLOW_POLICIES = ("drop_oldest", "drop_newest", "block")
+
+
+class FirehoseSink:
+    """Buffers result records and ships them to Firehose from a background thread.
+
+    put() encodes the record and appends it to an in-memory buffer; a flusher
+    thread drains it with put_record_batch once the buffer holds
+    max_batch_records or max_batch_bytes of encoded records, or its oldest
+    record is max_age_s old, whichever comes first.
+    """
+
+    def __init__(self, client, stream_name,
+                 max_batch_records=FIREHOSE_MAX_BATCH_RECORDS,
+                 max_batch_bytes=FIREHOSE_MAX_BATCH_BYTES,
+                 max_age_s=1.0,
+                 max_buffered=10000,
+                 overflow_policy="drop_oldest",
+                 max_retries=3,
+                 retry_backoff_s=0.2):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy '{overflow_policy}', expected one of {OVERFLOW_POLICIES}")
+
+        self.client = client
+        self.stream_name = stream_name
+        self.max_batch_records = min(int(max_batch_records), FIREHOSE_MAX_BATCH_RECORDS)
+        self.max_batch_bytes = min(int(max_batch_bytes), FIREHOSE_MAX_BATCH_BYTES)
+        self.max_age_s = float(max_age_s)
+        self.max_buffered = int(max_buffered)
+        self.overflow_policy = overflow_policy
+        self.max_retries = int(max_retries)
+        self.retry_backoff_s = float(retry_backoff_s)
+
+        # (time added, encoded record) pairs, and the records' total size
+        self._buffer = deque()
+        self._buffered_bytes = 0
+        self._oldest_ts = None
+        self._cond = threading.Condition()
+        self._closing = False
+        self._thread = None
+
+        # Simple counters, read without locking by whoever reports on them
+        self.records_sent = 0
+        self.records_failed = 0
+        self.records_dropped = 0
+        self.batches_sent = 0
+
+    @classmethod
+    def from_config(cls, client, stream_name, cfg):
+        """Builds a sink from the 'firehose' section of the analyzer configuration."""
+        return cls(
+            client,
+            cfg.get("stream-name", stream_name),
+            max_batch_records=cfg.get("max-batch-records", FIREHOSE_MAX_BATCH_RECORDS),
+            max_batch_bytes=cfg.get("max-batch-bytes", FIREHOSE_MAX_BATCH_BYTES),
+            max_age_s=cfg.get("max-age-seconds", 1.0),
+            max_buffered=cfg.get("max-buffered-records", 10000),
+            overflow_policy=cfg.get("overflow-policy", "drop_oldest"),
+            max_retries=cfg.get("max-retries", 3),
+            retry_backoff_s=cfg.get("retry-backoff-seconds", 0.2),
+        )
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="firehose-sink", daemon=True)
+            self._thread.start()
+        return self
+
+    def depth(self):
+        return len(self._buffer)
+
+    def put(self, record):
+        """Queues a record (a JSON-serializable dict). Returns False if it was dropped."""
+        data = (json.dumps(record) + "\n").encode("utf-8")
+        if len(data) > FIREHOSE_MAX_RECORD_BYTES:
+            self.records_dropped += 1
+            log.error(f"Dropping oversized Firehose record ({len(data)} bytes)")
+            return False
+        with self._cond:
+            if self._closing:
+                self.records_dropped += 1
+                return False
+
+            if len(self._buffer) >= self.max_buffered:
+                if self.overflow_policy == "drop_newest":
+                    self.records_dropped += 1
+                    return False
+                if self.overflow_policy == "drop_oldest":
+                    self._buffered_bytes -= len(self._buffer.popleft()[1])
+                    self._oldest_ts = self._buffer[0][0] if self._buffer else None
+                    self.records_dropped += 1
+                else:
+                    while len(self._buffer) >= self.max_buffered and not self._closing:
+                        self._cond.wait()
+                    if self._closing:
+                        self.records_dropped += 1
+                        return False
+
+            now = time.monotonic()
+            if not self._buffer:
+                self._oldest_ts = now
+            self._buffer.append((now, data))
+            self._buffered_bytes += len(data)
+            if len(self._buffer) >= self.max_batch_records or self._buffered_bytes >= self.max_batch_bytes:
+                self._cond.notify_all()
+        return True
+
+    def close(self, timeout=10.0):
+        """Stops accepting records and flushes whatever is still buffered."""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        else:
+            self._drain()
+
+    # ------------------------------------------------------------------
+    # Flusher
+    # ------------------------------------------------------------------
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closing and not self._batch_due():
+                    if self._buffer:
+                        remaining = self.max_age_s - (time.monotonic() - self._oldest_ts)
+                        self._cond.wait(max(remaining, 0.001))
+                    else:
+                        self._cond.wait()
+                if self._closing:
+                    break
+            self._flush_once()
+        self._drain()
+
+    def _batch_due(self):
+        if not self._buffer:
+            return False
+        if len(self._buffer) >= self.max_batch_records or self._buffered_bytes >= self.max_batch_bytes:
+            return True
+        return time.monotonic() - self._oldest_ts >= self.max_age_s
+
+    def _drain(self):
+        while self._buffer:
+            self._flush_once()
+
+    def _take_batch(self):
+        """Pops up to one API call's worth of encoded records off the buffer."""
+        batch = []
+        batch_bytes = 0
+        with self._cond:
+            while self._buffer and len(batch) < self.max_batch_records:
+                data = self._buffer[0][1]
+                if batch and batch_bytes + len(data) > self.max_batch_bytes:
+                    break
+                self._buffer.popleft()
+                batch.append({"Data": data})
+                batch_bytes += len(data)
+            self._buffered_bytes -= batch_bytes
+            # Records left behind keep their own age, so none waits past max_age_s twice
+            self._oldest_ts = self._buffer[0][0] if self._buffer else None
+            # Wake any producer blocked on a full buffer
+            self._cond.notify_all()
+        return batch
+
+    def _flush_once(self):
+        batch = self._take_batch()
+        if batch:
+            self._send(batch)
+
+    def _send(self, records):
+        attempt = 0
+        while records:
+            try:
+                response = self.client.put_record_batch(
+                    DeliveryStreamName=self.stream_name,
+                    Records=records
+                )
+            except Exception as e:
+                response = None
+                log.error(f"Firehose put_record_batch failed (Check IAM/network): {e}")
+
+            if response is not None:
+                self.batches_sent += 1
+                if response.get("FailedPutCount", 0) == 0:
+                    self.records_sent += len(records)
+                    return
+                # Keep only the records Firehose rejected
+                failed = [
+                    rec for rec, res in zip(records, response.get("RequestResponses", []))
+                    if res.get("ErrorCode")
+                ]
+                self.records_sent += len(records) - len(failed)
+                records = failed
+
+            attempt += 1
+            if attempt > self.max_retries:
+                self.records_failed += len(records)
+                log.error(f"Giving up on {len(records)} Firehose records after {self.max_retries} retries")
+                return
+            time.sleep(self.retry_backoff_s * (2 ** (attempt - 1)))
@@ -0,0 +1,337 @@
+import math
+import logging
+import threading
+from array import array
+
+try:
+    import numpy as np
+except ImportError:  # the sparse mode needs nothing beyond the standard library
+    np = None
+
+log = logging.getLogger(__name__)
+
+X_FIELD = "vehicle_x"
+Y_FIELD = "vehicle_y"
+LANE_FIELD = "vehicle_lane"
+
+# Per-cell/lane layout of delta snapshots
+CELL_FIELDS = ["sum", "max", "samples", "vehicles"]
+
+# Cell that points off the dense grid are binned into; flush() counts it in out_of_bounds
+OUTSIDE = (-1, -1)
+# Sparse cell indices are buffered in array('q')
+_MAX_INDEX = float(2 ** 62)
+
+
+class SpatialHeatmap:
+    """Bins one emission metric into a square grid over vehicle_x/vehicle_y and into lanes.
+
+    Every cell and lane keeps the sum and max of the metric, the number of
+    samples, and the number of vehicles currently in it. process_row() only
+    records what changed in append-only buffers; flush() applies them in one
+    vectorized pass (np.add.at / np.maximum.at on the dense grid) and returns
+    just the cells and lanes touched since the previous flush.
+
+    mode "dense" keeps width x height NumPy arrays; points outside the grid are
+    counted in out_of_bounds. mode "sparse" keeps a dict of the cells actually
+    visited, with no bounds, and is used when NumPy is not installed.
+    """
+
+    def __init__(self, metric="vehicle_CO2", cell_size=200.0, origin=(0.0, 0.0),
+                 width=256, height=256, mode="dense"):
+        if mode not in ("dense", "sparse"):
+            raise ValueError(f"Unknown heatmap mode '{mode}'")
+        if mode == "dense" and np is None:
+            log.warning("NumPy is not installed, using the sparse heatmap")
+            mode = "sparse"
+        self.metric = metric
+        self.cell_size = float(cell_size)
+        self.origin = (float(origin[0]), float(origin[1]))
+        self.width = int(width)
+        self.height = int(height)
+        self.mode = mode
+
+        if mode == "dense":
+            cells = self.width * self.height
+            self.sums = np.zeros(cells, dtype=np.float64)
+            self.maxima = np.full(cells, -np.inf, dtype=np.float64)
+            self.samples = np.zeros(cells, dtype=np.int64)
+            self.vehicles = np.zeros(cells, dtype=np.int32)
+        else:
+            # (ix, iy) -> [sum, max, samples, vehicles]
+            self.cells = {}
+        # lane -> [sum, max, samples, vehicles]
+        self.lanes = {}
+
+        # vehicle_id -> (ix, iy, lane) it was last seen in; written by the vehicle's own worker
+        self._where = {}
+        self._lock = threading.Lock()
+        self._reset_buffers()
+        self.out_of_bounds = 0
+
+    @classmethod
+    def from_config(cls, cfg):
+        """Builds a heatmap from the 'heatmap' section of the analyzer configuration."""
+        return cls(
+            metric=cfg.get("metric", "vehicle_CO2"),
+            cell_size=cfg.get("cell-size", 200.0),
+            origin=cfg.get("origin", (0.0, 0.0)),
+            width=cfg.get("width", 256),
+            height=cfg.get("height", 256),
+            mode=cfg.get("mode", "dense"),
+        )
+
+    def _reset_buffers(self):
+        # Samples: cell coordinates, value and lane of every row
+        self._ix = array("q")
+        self._iy = array("q")
+        self._values = array("d")
+        self._sample_lanes = []
+        # Occupancy changes: vehicles entering (+1) and leaving (-1) cells and lanes
+        self._moves = []
+
+    def cell_of(self, x, y):
+        """Cell of a point; OUTSIDE when it is off the dense grid, None when a sparse index would overflow.
+
+        The bounds are checked on the floats, so huge or infinite
+        coordinates never reach int().
+        """
+        fx = (x - self.origin[0]) / self.cell_size
+        fy = (y - self.origin[1]) / self.cell_size
+        if self.mode == "dense":
+            if not (0.0 <= fx < self.width and 0.0 <= fy < self.height):
+                return OUTSIDE
+        elif not (-_MAX_INDEX < fx < _MAX_INDEX and -_MAX_INDEX < fy < _MAX_INDEX):
+            return None
+        return int(math.floor(fx)), int(math.floor(fy))
+
+    def process_row(self, vehicle_id, payload):
+        """Records one telemetry row; returns False when it had no usable position or value."""
+        try:
+            x = float(payload[X_FIELD])
+            y = float(payload[Y_FIELD])
+            v = float(payload.get(self.metric, 0.0))
+        except (KeyError, TypeError, ValueError):
+            return False
+        if not (math.isfinite(x) and math.isfinite(y) and math.isfinite(v)):
+            return False
+        cell = self.cell_of(x, y)
+        if cell is None:
+            return False
+        ix, iy = cell
+        lane = payload.get(LANE_FIELD)
+
+        where = (ix, iy, lane)
+        previous = self._where.get(vehicle_id)
+        with self._lock:
+            self._ix.append(ix)
+            self._iy.append(iy)
+            self._values.append(v)
+            self._sample_lanes.append(lane)
+            if previous != where:
+                if previous is not None:
+                    self._moves.append((previous, -1))
+                self._moves.append((where, 1))
+        if previous != where:
+            self._where[vehicle_id] = where
+        return True
+
+    def forget(self, vehicle_id):
+        """Takes an evicted vehicle out of the occupancy counts."""
+        previous = self._where.pop(vehicle_id, None)
+        if previous is not None:
+            with self._lock:
+                self._moves.append((previous, -1))
+
+    def flush(self):
+        """Applies the buffered rows and returns the delta since the last flush.
+
+        The result is {"cells": [[ix, iy, sum, max, samples, vehicles], ...],
+        "lanes": {lane: [sum, max, samples, vehicles]}} holding only what changed.
+        """
+        with self._lock:
+            ix, iy, values = self._ix, self._iy, self._values
+            sample_lanes, moves = self._sample_lanes, self._moves
+            self._reset_buffers()
+
+        if self.mode == "dense":
+            cells = self._flush_dense(ix, iy, values, moves)
+        else:
+            cells = self._flush_sparse(ix, iy, values, moves)
+        lanes = self._flush_lanes(sample_lanes, values, moves)
+        return {"cells": cells, "lanes": lanes}
+
+    def _flush_dense(self, ix, iy, values, moves):
+        if not values and not moves:
+            return []
+        xs = np.frombuffer(ix, dtype=np.int64) if ix else np.empty(0, dtype=np.int64)
+        ys = np.frombuffer(iy, dtype=np.int64) if iy else np.empty(0, dtype=np.int64)
+        vs = np.frombuffer(values, dtype=np.float64) if values else np.empty(0, dtype=np.float64)
+        inside = (xs >= 0) & (xs < self.width) & (ys >= 0) & (ys < self.height)
+        self.out_of_bounds += int(len(xs) - np.count_nonzero(inside))
+        flat = ys[inside] * self.width + xs[inside]
+        vs = vs[inside]
+        np.add.at(self.sums, flat, vs)
+        np.maximum.at(self.maxima, flat, vs)
+        np.add.at(self.samples, flat, 1)
+
+        touched = [flat]
+        if moves:
+            mx = np.array([m[0][0] for m in moves], dtype=np.int64)
+            my = np.array([m[0][1] for m in moves], dtype=np.int64)
+            delta = np.array([m[1] for m in moves], dtype=np.int32)
+            inside = (mx >= 0) & (mx < self.width) & (my >= 0) & (my < self.height)
+            occupied = my[inside] * self.width + mx[inside]
+            np.add.at(self.vehicles, occupied, delta[inside])
+            touched.append(occupied)
+
+        changed = np.unique(np.concatenate(touched))
+        maxima = self.maxima[changed]
+        return [
+            [c % self.width, c // self.width, s, (m if m != -math.inf else None), n, k]
+            for c, s, m, n, k in zip(
+                changed.tolist(), self.sums[changed].tolist(), maxima.tolist(),
+                self.samples[changed].tolist(), self.vehicles[changed].tolist(),
+            )
+        ]
+
+    def _flush_sparse(self, ix, iy, values, moves):
+        changed = set()
+        cells = self.cells
+        for key, v in zip(zip(ix, iy), values):
+            cell = cells.get(key)
+            if cell is None:
+                cell = cells[key] = [0.0, -math.inf, 0, 0]
+            cell[0] += v
+            if v > cell[1]:
+                cell[1] = v
+            cell[2] += 1
+            changed.add(key)
+        for (cx, cy, _), delta in moves:
+            key = (cx, cy)
+            cell = cells.get(key)
+            if cell is None:
+                cell = cells[key] = [0.0, -math.inf, 0, 0]
+            cell[3] += delta
+            changed.add(key)
+        return [
+            [key[0], key[1], cells[key][0], _max_or_none(cells[key][1]), cells[key][2], cells[key][3]]
+            for key in sorted(changed)
+        ]
+
+    def _flush_lanes(self, sample_lanes, values, moves):
+        changed = set()
+        lanes = self.lanes
+        for lane, v in zip(sample_lanes, values):
+            if lane is None:
+                continue
+            bucket = lanes.get(lane)
+            if bucket is None:
+                bucket = lanes[lane] = [0.0, -math.inf, 0, 0]
+            bucket[0] += v
+            if v > bucket[1]:
+                bucket[1] = v
+            bucket[2] += 1
+            changed.add(lane)
+        for (_, _, lane), delta in moves:
+            if lane is None:
+                continue
+            bucket = lanes.get(lane)
+            if bucket is None:
+                bucket = lanes[lane] = [0.0, -math.inf, 0, 0]
+            bucket[3] += delta
+            changed.add(lane)
+        return {
+            lane: [lanes[lane][0], _max_or_none(lanes[lane][1]), lanes[lane][2], lanes[lane][3]]
+            for lane in changed
+        }
+
+    def snapshot(self):
+        """Every non-empty cell and lane, in the same layout as flush() (pending rows are applied first)."""
+        self.flush()
+        if self.mode == "dense":
+            used = np.flatnonzero((self.samples > 0) | (self.vehicles != 0))
+            cells = [
+                [c % self.width, c // self.width, s, _max_or_none(m), n, k]
+                for c, s, m, n, k in zip(
+                    used.tolist(), self.sums[used].tolist(), self.maxima[used].tolist(),
+                    self.samples[used].tolist(), self.vehicles[used].tolist(),
+                )
+            ]
+        else:
+            cells = [[key[0], key[1], c[0], _max_or_none(c[1]), c[2], c[3]] for key, c in sorted(self.cells.items())]
+        lanes = {lane: [b[0], _max_or_none(b[1]), b[2], b[3]] for lane, b in self.lanes.items()}
+        return {"cells": cells, "lanes": lanes}
+
+    def memory_bytes(self):
+        if self.mode == "dense":
+            return int(self.sums.nbytes + self.maxima.nbytes + self.samples.nbytes + self.vehicles.nbytes)
+        # Rough: dict slot, tuple key and a four-item list per cell
+        return len(self.cells) * 200
+
+
+def _max_or_none(m):
+    return None if m == -math.inf else m
+
+
+def merge_snapshots(snapshots):
+    """Combines snapshot() results of disjoint vehicle sets (e.g. from several processes)."""
+    cells = {}
+    lanes = {}
+    for snap in snapshots:
+        for ix, iy, total, peak, samples, vehicles in snap["cells"]:
+            _merge_bucket(cells, (ix, iy), [total, peak, samples, vehicles])
+        for lane, bucket in snap["lanes"].items():
+            _merge_bucket(lanes, lane, bucket)
+    return {
+        "cells": [[key[0], key[1]] + bucket for key, bucket in sorted(cells.items())],
+        "lanes": lanes,
+    }
+
+
+def _merge_bucket(into, key, bucket):
+    mine = into.get(key)
+    if mine is None:
+        into[key] = list(bucket)
+        return
+    mine[0] += bucket[0]
+    if bucket[1] is not None and (mine[1] is None or bucket[1] > mine[1]):
+        mine[1] = bucket[1]
+    mine[2] += bucket[2]
+    mine[3] += bucket[3]
+
+
+class HeatmapReporter:
+    """Every interval_s, flushes the heatmap and hands the non-empty delta to publish_fn."""
+
+    def __init__(self, heatmap, publish_fn, interval_s=5.0):
+        self.heatmap = heatmap
+        self.publish_fn = publish_fn
+        self.interval_s = float(interval_s)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None and self.interval_s > 0:
+            self._thread = threading.Thread(target=self._run, name="heatmap-reporter", daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.report()
+
+    def _run(self):
+        while not self._stop.wait(self.interval_s):
+            self.report()
+
+    def report(self):
+        try:
+            delta = self.heatmap.flush()
+            if delta["cells"] or delta["lanes"]:
+                self.publish_fn(delta)
+        except Exception as e:
+            log.error(f"Heatmap snapshot failed: {e}", exc_info=True)
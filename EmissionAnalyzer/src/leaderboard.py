@@ -0,0 +1,236 @@
+import math
+import bisect
+import threading
+
+DEFAULT_K = 10
+
+DEFAULT_BOARDS = [
+    {"name": "max_co2", "metric": "vehicle_CO2", "window": "all", "stat": "max"},
+    {"name": "max_co2_60s", "metric": "vehicle_CO2", "window": "sliding_60s", "stat": "max"},
+]
+
+
+# Target entries per bucket of a _SortedEntries; buckets split at twice this
+BUCKET_LOAD = 512
+
+
+class _SortedEntries:
+    """Sorted list of (-score, vehicle_id) entries, stored as a list of sorted buckets.
+
+    A bisect over the buckets' last entries finds the bucket, so adding or
+    removing an entry costs O(log N) comparisons plus a memmove within one
+    bucket of at most 2 * BUCKET_LOAD entries, whatever the fleet size. A
+    bucket that grows past that is split and one that shrinks below half
+    of BUCKET_LOAD is merged into its neighbour.
+    """
+
+    def __init__(self, load=BUCKET_LOAD):
+        self.load = int(load)
+        self._buckets = []
+        self._maxes = []
+
+    def add(self, entry):
+        buckets, maxes = self._buckets, self._maxes
+        if not buckets:
+            buckets.append([entry])
+            maxes.append(entry)
+            return
+        i = bisect.bisect_left(maxes, entry)
+        if i == len(maxes):
+            i -= 1
+        bucket = buckets[i]
+        bisect.insort(bucket, entry)
+        maxes[i] = bucket[-1]
+        self._split(i)
+
+    def remove(self, entry):
+        buckets, maxes = self._buckets, self._maxes
+        i = bisect.bisect_left(maxes, entry)
+        bucket = buckets[i]
+        del bucket[bisect.bisect_left(bucket, entry)]
+        if len(bucket) >= self.load // 2:
+            maxes[i] = bucket[-1]
+            return
+        if len(buckets) == 1:
+            if not bucket:
+                del buckets[0], maxes[0]
+            else:
+                maxes[0] = bucket[-1]
+            return
+        # Fold the small bucket into a neighbour, splitting the result again if it got too big
+        j = i + 1 if i + 1 < len(buckets) else i - 1
+        lo, hi = min(i, j), max(i, j)
+        buckets[lo].extend(buckets[hi])
+        maxes[lo] = buckets[lo][-1]
+        del buckets[hi], maxes[hi]
+        self._split(lo)
+
+    def _split(self, i):
+        bucket = self._buckets[i]
+        if len(bucket) > 2 * self.load:
+            self._buckets.insert(i + 1, bucket[self.load:])
+            del bucket[self.load:]
+            self._maxes[i] = bucket[-1]
+            self._maxes.insert(i + 1, self._buckets[i + 1][-1])
+
+    def head(self, k):
+        """The first k entries."""
+        out = []
+        for bucket in self._buckets:
+            if len(out) >= k:
+                break
+            out.extend(bucket[:k - len(out)])
+        return out
+
+    def index(self, entry):
+        """Position of an entry that is present; O(N / BUCKET_LOAD)."""
+        i = bisect.bisect_left(self._maxes, entry)
+        before = sum(len(bucket) for bucket in self._buckets[:i])
+        return before + bisect.bisect_left(self._buckets[i], entry)
+
+
+class Leaderboard:
+    """Vehicles ranked by one score, kept sorted as scores change.
+
+    Entries are (-score, vehicle_id) in a bucketed sorted list next to a
+    vehicle_id -> score dict, so a score that rises or falls (a sliding
+    window dropping its peak, a tumbling window restarting) is moved in
+    O(log N) plus a memmove within one bucket, and the top k is read from
+    the first buckets without touching the rest of the fleet.
+    """
+
+    def __init__(self, name, k=DEFAULT_K):
+        self.name = name
+        self.k = int(k)
+        self._entries = _SortedEntries()
+        self._scores = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._scores)
+
+    def update(self, vehicle_id, score):
+        with self._lock:
+            old = self._scores.get(vehicle_id)
+            if old == score:
+                return
+            if old is not None:
+                self._entries.remove((-old, vehicle_id))
+            if score is None:
+                del self._scores[vehicle_id]
+                return
+            self._scores[vehicle_id] = score
+            self._entries.add((-score, vehicle_id))
+
+    def forget(self, vehicle_id):
+        self.update(vehicle_id, None)
+
+    def top(self, k=None):
+        """Returns [{"rank", "vehicle_id", "value"}] for the k (default self.k) highest scores."""
+        k = self.k if k is None else int(k)
+        with self._lock:
+            head = self._entries.head(k)
+        return [
+            {"rank": rank, "vehicle_id": vehicle_id, "value": -neg}
+            for rank, (neg, vehicle_id) in enumerate(head, 1)
+        ]
+
+    def vehicles(self):
+        with self._lock:
+            return list(self._scores)
+
+    def rank(self, vehicle_id):
+        """1-based rank of a vehicle, or None if it has no score."""
+        with self._lock:
+            score = self._scores.get(vehicle_id)
+            if score is None:
+                return None
+            return self._entries.index((-score, vehicle_id)) + 1
+
+
+class LeaderboardSet:
+    """Leaderboards over statistics of the AggregationEngine's windows.
+
+    Each board spec names a metric, a window and a stat of that window
+    ("max", "mean", "sum", ...). update() re-reads the stat after every row,
+    so decreases from expiring windows are reflected immediately. Windows of
+    vehicles that stopped sending only move on through expire(): idle()
+    lists the ranked vehicles without a row since the previous call, together
+    with the newest timestep the fleet reported meanwhile, and expire()
+    advances their windows to it and re-reads their scores.
+    """
+
+    def __init__(self, aggregator, boards=None, k=DEFAULT_K):
+        self.aggregator = aggregator
+        self.specs = list(boards or DEFAULT_BOARDS)
+        self.boards = {}
+        for spec in self.specs:
+            if spec.get("metric") not in aggregator.metrics:
+                raise ValueError(f"Leaderboard '{spec.get('name')}' uses unaggregated metric '{spec.get('metric')}'")
+            if spec.get("window") not in aggregator.window_names:
+                raise ValueError(f"Leaderboard '{spec.get('name')}' uses unknown window '{spec.get('window')}'")
+            self.boards[spec["name"]] = Leaderboard(spec["name"], spec.get("k", k))
+        # Boards over windows that can expire
+        self.windowed = [spec for spec in self.specs if spec["window"] != "all"]
+        # Vehicles updated, and the newest timestep seen, since the last idle()
+        self._touched = set()
+        self._clock = -math.inf
+
+    @classmethod
+    def from_config(cls, aggregator, cfg):
+        """Builds the leaderboards from the 'leaderboard' section of the analyzer configuration."""
+        return cls(aggregator, cfg.get("boards"), cfg.get("k", DEFAULT_K))
+
+    def update(self, vehicle_id, metrics, t=None):
+        """Refreshes the boards of the metrics a row (of timestep t) just updated."""
+        self._touched.add(vehicle_id)
+        if t is not None and t > self._clock:
+            self._clock = t
+        for spec in self.specs:
+            if spec["metric"] in metrics:
+                score = self.aggregator.value(vehicle_id, spec["metric"], spec["window"], spec.get("stat", "max"))
+                self.boards[spec["name"]].update(vehicle_id, score)
+
+    def idle(self):
+        """Returns (fleet timestep, vehicles on windowed boards that sent nothing since the last call)."""
+        touched, self._touched = self._touched, set()
+        clock, self._clock = self._clock, -math.inf
+        if clock == -math.inf:
+            return clock, []
+        ranked = set()
+        for spec in self.windowed:
+            ranked.update(self.boards[spec["name"]].vehicles())
+        # One C call under the GIL, while workers may still add to the old set
+        ranked.difference_update(touched)
+        return clock, list(ranked)
+
+    def expire(self, vehicle_ids, t):
+        """Advances the windowed boards' windows of the given vehicles to timestep t and re-ranks them."""
+        for vehicle_id in vehicle_ids:
+            for spec in self.windowed:
+                self.aggregator.advance(vehicle_id, spec["metric"], spec["window"], t)
+                score = self.aggregator.value(vehicle_id, spec["metric"], spec["window"], spec.get("stat", "max"))
+                self.boards[spec["name"]].update(vehicle_id, score)
+
+    def forget(self, vehicle_id):
+        for board in self.boards.values():
+            board.forget(vehicle_id)
+
+    def query(self, request):
+        """Answers a leaderboard request: {"board": name, "k": n, "vehicle_id": optional}.
+
+        Without "board", every board is returned. k is clamped to 1..the
+        board's configured k, so a response never grows with the fleet.
+        """
+        names = [request["board"]] if request.get("board") else list(self.boards)
+        result = {}
+        for name in names:
+            board = self.boards.get(name)
+            if board is None:
+                raise ValueError(f"Unknown leaderboard '{name}'")
+            k = board.k if request.get("k") is None else min(max(int(request["k"]), 1), board.k)
+            entry = {"top": board.top(k), "vehicles": len(board)}
+            if request.get("vehicle_id") is not None:
+                entry["rank"] = board.rank(str(request["vehicle_id"]))
+            result[name] = entry
+        return result
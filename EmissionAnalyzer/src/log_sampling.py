@@ -0,0 +1,76 @@
+import json
+import zlib
+import logging
+import itertools
+
+SAMPLE_MODES = ("global", "vehicle")
+
+
+class _Lazy:
+    """Defers JSON formatting of a log record until a handler actually emits it."""
+
+    __slots__ = ("fields",)
+
+    def __init__(self, fields):
+        self.fields = fields
+
+    def __str__(self):
+        return json.dumps(self.fields, default=str)
+
+
+class MessageLogger:
+    """One structured, sampled log record per processed message.
+
+    Per-message records go out at message_level, and only for a sample of
+    messages: every Nth message (mode "global"), or all messages of every Nth
+    vehicle by id hash (mode "vehicle"), plus every message of the vehicles
+    listed in always_vehicles. When message_level is disabled nothing is
+    sampled or formatted. State changes and errors bypass sampling.
+    """
+
+    def __init__(self, logger, message_level=logging.DEBUG, sample_every_n=1,
+                 sample_mode="global", always_vehicles=()):
+        if sample_mode not in SAMPLE_MODES:
+            raise ValueError(f"Unknown sample mode '{sample_mode}', expected one of {SAMPLE_MODES}")
+        self.logger = logger
+        self.message_level = message_level
+        self.sample_every_n = max(1, int(sample_every_n))
+        self.sample_mode = sample_mode
+        self.always_vehicles = frozenset(always_vehicles)
+        self._seq = itertools.count()
+
+    @classmethod
+    def from_config(cls, logger, cfg):
+        """Builds a message logger from the 'logging' section of the analyzer configuration."""
+        return cls(
+            logger,
+            message_level=logging.getLevelName(cfg.get("message-level", "DEBUG")),
+            sample_every_n=cfg.get("sample-every-n", 1),
+            sample_mode=cfg.get("sample-mode", "global"),
+            always_vehicles=cfg.get("vehicles", ()),
+        )
+
+    def sampled(self, vehicle_id):
+        """Whether this message's per-message record should be emitted."""
+        if not self.logger.isEnabledFor(self.message_level):
+            return False
+        if vehicle_id in self.always_vehicles or self.sample_every_n == 1:
+            return True
+        if self.sample_mode == "vehicle":
+            return zlib.crc32(vehicle_id.encode("utf-8")) % self.sample_every_n == 0
+        return next(self._seq) % self.sample_every_n == 0
+
+    def message(self, event, **fields):
+        """Emits a per-message record; callers check sampled() first."""
+        fields["event"] = event
+        self.logger.log(self.message_level, "%s", _Lazy(fields))
+
+    def state(self, event, **fields):
+        """Emits a state-change record at INFO, regardless of sampling."""
+        if self.logger.isEnabledFor(logging.INFO):
+            fields["event"] = event
+            self.logger.info("%s", _Lazy(fields))
+
+    def error(self, event, exc_info=False, **fields):
+        fields["event"] = event
+        self.logger.error("%s", _Lazy(fields), exc_info=exc_info)
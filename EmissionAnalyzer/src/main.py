@@ -2,64 +2,368 @@ import json
 import sys
 import time
 import logging
-import boto3
 import os
-from awsgreengrasspubsubsdk.pubsub_client import AwsGreengrassPubSubSdkClient
-from awsgreengrasspubsubsdk.message_formatter import PubSubMessageFormatter
+import signal
+import itertools
+import functools
+import weakref
+from firehose_sink import FirehoseSink
+from aggregation import AggregationEngine
+from result_coalescer import ResultCoalescer
+from checkpoint import StateCheckpointer
+from state_store import VehicleStateStore
+from worker_pool import ShardedWorkerPool
+from telemetry_codec import decode_rows, split_by_vehicle
+from metrics import MetricsRegistry, MetricsReporter, start_http_server
+from log_sampling import MessageLogger
+from sketches import QuantileTracker, QuantileReporter
+from leaderboard import LeaderboardSet
+from heatmap import SpatialHeatmap, HeatmapReporter, CELL_FIELDS
+from dedupe import OrderingStage
 
-logging.basicConfig(level=logging.INFO)
+config = json.loads(sys.argv[1]) if len(sys.argv) > 1 else {}
+# Analyzer tuning knobs (recipe AnalyzerConfig), passed as the second argument
+ANALYZER_CONFIG = json.loads(sys.argv[2]) if len(sys.argv) > 2 else {}
+LOGGING_CONFIG = ANALYZER_CONFIG.get("logging", {})
+
+logging.basicConfig(level=LOGGING_CONFIG.get("level", "INFO"))
 log = logging.getLogger(__name__)
+# Sampled, lazily formatted per-message records; state changes and errors are always logged
+MESSAGE_LOG = MessageLogger.from_config(log, LOGGING_CONFIG)
 
 print("EmissionAnalyzer starting...", flush=True)
 
-config = json.loads(sys.argv[1]) if len(sys.argv) > 1 else {}
-
 BASE_TOPIC = config.get("base-pubsub-topic", "com.iotea.EmissionAnalyzer")
 MQTT_SUB_TOPICS = config.get("mqtt-subscribe-topics", [])
 
 log.info(f"Base PubSub topic: {BASE_TOPIC}")
 log.info(f"MQTT subscription topics: {MQTT_SUB_TOPICS}")
 
-# Track maximum CO₂ values
-MAX_CO2_STATE = {}
+# Hot-path instrumentation (per-thread counters and fixed-bucket histograms)
+METRICS = MetricsRegistry()
+MESSAGES_RECEIVED = METRICS.counter("messages_received_total", "Telemetry messages delivered by the SDK")
+ROWS_PROCESSED = METRICS.counter("rows_processed_total", "Telemetry rows processed")
+PROCESSING_ERRORS = METRICS.counter("processing_errors_total", "Rows that failed processing")
+DECODE_SECONDS = METRICS.histogram("decode_seconds", "Time to decode a message into rows")
+AGGREGATE_SECONDS = METRICS.histogram("aggregate_seconds", "Time to update aggregates and running max of a row")
+PUBLISH_SECONDS = METRICS.histogram("publish_seconds", "Time spent in one result publish call")
+
+# Drops QoS 1 redeliveries by (boot, seq) and optionally restores timestep order per vehicle
+ORDERING_CONFIG = ANALYZER_CONFIG.get("ordering", {})
+ORDERING = None
+if ORDERING_CONFIG.get("enabled", True):
+    ORDERING = OrderingStage.from_config(ORDERING_CONFIG)
+
+# Windowed per-vehicle statistics for every configured pollutant column
+AGGREGATION_CONFIG = ANALYZER_CONFIG.get("aggregation", {})
+AGGREGATOR = AggregationEngine.from_config(AGGREGATION_CONFIG)
+
+# Worst emitters per window statistic, kept sorted as rows arrive and answered on request
+LEADERBOARD_CONFIG = ANALYZER_CONFIG.get("leaderboard", {})
+LEADERBOARDS = LeaderboardSet.from_config(AGGREGATOR, LEADERBOARD_CONFIG)
+LEADERBOARD_REQUEST_TOPIC = LEADERBOARD_CONFIG.get("request-topic", "vehicle/leaderboard/request")
+LEADERBOARD_RESPONSE_TOPIC = LEADERBOARD_CONFIG.get("response-topic", "vehicle/leaderboard/response")
+# A request's own reply-topic must start with this prefix; null disables reply topics
+LEADERBOARD_REPLY_PREFIX = LEADERBOARD_CONFIG.get("reply-topic-prefix", "vehicle/leaderboard/")
+# Windows of vehicles silent for this many seconds (main loop ticks; 0 disables) are expired
+# against the fleet's newest timestep
+LEADERBOARD_EXPIRE_INTERVAL_S = int(LEADERBOARD_CONFIG.get("expire-interval-seconds", 5))
+
+# Streaming p50/p90/p99 per vehicle and fleet-wide, in a few KB per vehicle and metric
+QUANTILES_CONFIG = ANALYZER_CONFIG.get("quantiles", {})
+QUANTILES = None
+if QUANTILES_CONFIG.get("enabled", True):
+    QUANTILES = QuantileTracker.from_config(QUANTILES_CONFIG, ["vehicle_CO2"])
+QUANTILES_TOPIC_FORMAT = QUANTILES_CONFIG.get("publish-topic-format", "vehicle/results/{}/quantiles")
+FLEET_QUANTILES_TOPIC = QUANTILES_CONFIG.get("fleet-topic", "vehicle/results/fleet/quantiles")
+
+# Emissions binned by grid cell and lane, published as periodic deltas of the changed cells
+HEATMAP_CONFIG = ANALYZER_CONFIG.get("heatmap", {})
+HEATMAP = None
+if HEATMAP_CONFIG.get("enabled", True):
+    HEATMAP = SpatialHeatmap.from_config(HEATMAP_CONFIG)
+HEATMAP_TOPIC = HEATMAP_CONFIG.get("publish-topic", "vehicle/results/heatmap")
+LANES_TOPIC = HEATMAP_CONFIG.get("lane-topic", "vehicle/results/lanes")
+# Keeps each delta message well under the 128 KB MQTT payload limit
+HEATMAP_MAX_ITEMS = HEATMAP_CONFIG.get("max-cells-per-message", 1000)
+
+CHECKPOINT_CONFIG = ANALYZER_CONFIG.get("checkpoint", {})
+CHECKPOINTER = None
+
+# Live EmissionHandlers, so evictions also reach their per-topic result state
+HANDLERS = weakref.WeakSet()
+
+def on_vehicle_evicted(vehicle_id):
+    """Has the evicted vehicle's own worker drop its other state, like every other write to it."""
+    pool = next((handler.pool for handler in list(HANDLERS) if handler.pool is not None), None)
+    if pool is None:
+        return drop_vehicle_state(vehicle_id)
+    if not pool.submit(vehicle_id, "ipc_mqtt", None, None, 200, None, _ForgetVehicle(vehicle_id)):
+        log.error(f"Worker queue full, could not drop the state of evicted vehicle {vehicle_id}")
+
+def drop_vehicle_state(vehicle_id):
+    """Drops everything else we hold for a vehicle the state store forgot."""
+    if vehicle_id in MAX_CO2_STATE:
+        # A row queued before this cleanup brought the vehicle back; its state is live again
+        return
+    for handler in list(HANDLERS):
+        handler.forget_vehicle(vehicle_id)
+    AGGREGATOR.forget(vehicle_id)
+    LEADERBOARDS.forget(vehicle_id)
+    if ORDERING is not None:
+        ORDERING.forget(vehicle_id)
+    if QUANTILES is not None:
+        QUANTILES.forget(vehicle_id)
+    if HEATMAP is not None:
+        HEATMAP.forget(vehicle_id)
+    # The checkpoint keeps the vehicle's max; restore_vehicle() brings it back
+
+def restore_vehicle(vehicle_id):
+    """Seeds a vehicle the state store does not hold with its checkpointed max."""
+    if CHECKPOINTER:
+        value = CHECKPOINTER.get(vehicle_id)
+        if value is not None:
+            return {MAX_CO2_METRIC: value}
+    return None
+
+# Ordering windows, coalescer and result_seq entries, heatmap position and leaderboard entries
+OTHER_BYTES_PER_VEHICLE = 2048
+
+def vehicle_footprint(state_config):
+    """Approximate bytes every other component holds per tracked vehicle, for max-memory-bytes."""
+    total = AGGREGATOR.bytes_per_vehicle(state_config.get("rows-per-second-per-vehicle", 1.0))
+    if QUANTILES is not None:
+        total += QUANTILES.bytes_per_vehicle()
+    return total + OTHER_BYTES_PER_VEHICLE
+
+# Track maximum CO₂ values in a bounded store that evicts idle vehicles
+MAX_CO2_METRIC = "max_CO2"
+STATE_CONFIG = ANALYZER_CONFIG.get("state", {})
+MAX_CO2_STATE = VehicleStateStore.from_config(
+    [MAX_CO2_METRIC], STATE_CONFIG, on_evict=on_vehicle_evicted, on_miss=restore_vehicle,
+    extra_bytes_per_vehicle=vehicle_footprint(STATE_CONFIG),
+)
+log.info(f"State store holds up to {MAX_CO2_STATE.capacity} vehicles (~{MAX_CO2_STATE.bytes_per_vehicle} bytes each)")
+
+# Restore the maxima from the last checkpoint so redeploys keep history
+if CHECKPOINT_CONFIG.get("enabled", True):
+    try:
+        CHECKPOINTER = StateCheckpointer.from_config(CHECKPOINT_CONFIG)
+        MAX_CO2_STATE.load(MAX_CO2_METRIC, CHECKPOINTER.load())
+        CHECKPOINTER.start()
+    except OSError as e:
+        log.error(f"State checkpointing disabled, could not use state directory: {e}")
+        CHECKPOINTER = None
+
+MAX_CO2_TOPIC_FORMAT = "vehicle/results/{}/max_co2"
+# Topic for the per-vehicle aggregate snapshot; unset/null disables publishing it
+AGGREGATES_TOPIC_FORMAT = AGGREGATION_CONFIG.get("publish-topic-format")
 FIREHOSE_CLIENT = None
+FIREHOSE_SINK = None
 FIREHOSE_STREAM_NAME = "lab4"
 
 def initialize_firehose_client():
-    """Initializes the Boto3 Firehose client using Greengrass environment variables."""
-    global FIREHOSE_CLIENT
+    """Initializes the Boto3 Firehose client and the batching sink in front of it."""
+    global FIREHOSE_CLIENT, FIREHOSE_SINK
     
     # Greengrass provides the region via the environment variable AWS_REGION
     aws_region = os.environ.get("AWS_REGION", "us-east-2")
     
     try:
+        import boto3
         FIREHOSE_CLIENT = boto3.client('firehose', region_name=aws_region)
-        log.info(f"Firehose client initialized for region {aws_region}. Stream Name: {FIREHOSE_STREAM_NAME}")
+        FIREHOSE_SINK = FirehoseSink.from_config(
+            FIREHOSE_CLIENT, FIREHOSE_STREAM_NAME, ANALYZER_CONFIG.get("firehose", {})
+        ).start()
+        log.info(f"Firehose client initialized for region {aws_region}. Stream Name: {FIREHOSE_SINK.stream_name}")
     except Exception as e:
         log.error(f"Failed to initialize Boto3 Firehose client: {e}")
 
 # ==========================================================
 # HANDLER CLASS
 # ==========================================================
+class _ReleaseHeld:
+    """Queued to a vehicle's worker in place of a message to release its held rows."""
+
+    __slots__ = ("vehicle_id",)
+
+    def __init__(self, vehicle_id):
+        self.vehicle_id = vehicle_id
+
+
+class _ForgetVehicle:
+    """Queued to a vehicle's worker to drop the state of a vehicle the state store evicted."""
+
+    __slots__ = ("vehicle_id",)
+
+    def __init__(self, vehicle_id):
+        self.vehicle_id = vehicle_id
+
+
+class _ExpireWindows:
+    """Queued to a shard's worker to expire the leaderboard windows of its idle vehicles."""
+
+    __slots__ = ("vehicle_ids", "t")
+
+    def __init__(self, vehicle_ids, t):
+        self.vehicle_ids = vehicle_ids
+        self.t = t
+
+
 class EmissionHandler:
-    def __init__(self, client):
+    def __init__(self, client, formatter):
         self.client = client
-        self.formatter = PubSubMessageFormatter()
-
-    # The SDK invokes this callback
+        self.formatter = formatter
+        # Rate-limits result publishes per result topic (i.e. per vehicle and result kind)
+        self.results = ResultCoalescer.from_config(self._send_result, ANALYZER_CONFIG.get("publish", {}))
+        # Processing runs on worker threads sharded by vehicle; num-workers 0 keeps it on the SDK thread
+        workers_config = ANALYZER_CONFIG.get("workers", {})
+        self.pool = None
+        if workers_config.get("num-workers", 4) > 0:
+            self.pool = ShardedWorkerPool.from_config(self.process_message, workers_config)
+        # topic -> counter stamped into each result as result_seq, so receivers can spot lost results
+        self._result_seq = {}
+        # Publishes the quantiles of recently updated vehicles and of the fleet every interval
+        self.quantile_reporter = None
+        if QUANTILES is not None:
+            self.quantile_reporter = QuantileReporter(
+                QUANTILES, self.publish_quantiles, QUANTILES_CONFIG.get("report-interval-seconds", 10.0)
+            )
+        self.heatmap_reporter = None
+        if HEATMAP is not None:
+            self.heatmap_reporter = HeatmapReporter(
+                HEATMAP, self.publish_heatmap, HEATMAP_CONFIG.get("snapshot-interval-seconds", 5.0)
+            )
+        HANDLERS.add(self)
+
+    def forget_vehicle(self, vehicle_id):
+        """Drops the coalescing state and result_seq counters of an evicted vehicle's result topics."""
+        topics = [MAX_CO2_TOPIC_FORMAT.format(vehicle_id), QUANTILES_TOPIC_FORMAT.format(vehicle_id)]
+        if AGGREGATES_TOPIC_FORMAT:
+            topics.append(AGGREGATES_TOPIC_FORMAT.format(vehicle_id))
+        for topic in topics:
+            self.results.forget(topic)
+            self._result_seq.pop(topic, None)
+
+    def _send_result(self, item, sequenced=True):
+        protocol, topic, formatted = item
+        if callable(formatted):
+            # Built only now, for the update that survived coalescing
+            formatted = formatted()
+        if sequenced and isinstance(formatted, dict) and isinstance(formatted.get("message"), dict):
+            # Copied, since the result dict is shared with the Firehose record
+            result_seq = next(self._result_seq.setdefault(topic, itertools.count(1)))
+            formatted = dict(formatted, message=dict(formatted["message"], result_seq=result_seq))
+        with PUBLISH_SECONDS.time():
+            self.client.publish_message(
+                protocol=protocol,
+                topic=topic,
+                message=formatted
+            )
+
+    # The SDK invokes this callback; keep it to a cheap enqueue
     def on_message(self, protocol, topic, message_id, status, route, message):
+        if topic == LEADERBOARD_REQUEST_TOPIC:
+            # O(K) slice of presorted boards, cheap enough for the SDK thread
+            return self.answer_leaderboard(protocol, message_id, message)
+        MESSAGES_RECEIVED.inc()
+        if self.pool is None:
+            return self.process_message(protocol, topic, message_id, status, route, message)
+
+        # A columnar batch is split per vehicle so each piece lands on that vehicle's shard;
+        # non-dict payloads and malformed batches still go through process_message so they get reported
+        try:
+            for vehicle_id, part in split_by_vehicle(message):
+                if not self.pool.submit(vehicle_id, protocol, topic, message_id, status, route, part):
+                    log.error(f"Worker queue full, dropped message {message_id} for {vehicle_id}")
+        except Exception as e:
+            # Nothing may escape into the SDK's callback
+            self.report_error(protocol, topic, message_id, e)
+
+    def process_message(self, protocol, topic, message_id, status, route, message):
+        if isinstance(message, _ReleaseHeld):
+            for payload in ORDERING.drain(message.vehicle_id):
+                self.process_row(protocol, topic, message_id, status, route, payload)
+            return
+        if isinstance(message, _ExpireWindows):
+            LEADERBOARDS.expire(message.vehicle_ids, message.t)
+            return
+        if isinstance(message, _ForgetVehicle):
+            drop_vehicle_state(message.vehicle_id)
+            return
+        # A message carries one row, or many in the columnar batch layout
+        try:
+            with DECODE_SECONDS.time():
+                rows = decode_rows(message)
+        except ValueError as e:
+            return self.report_error(protocol, topic, message_id, e)
+        ROWS_PROCESSED.inc(len(rows))
+        if ORDERING is not None:
+            rows = self.order_rows(message, rows)
+        # The emulator's send stamp (seq, sent_at) is echoed in results for round-trip tracking
+        echo = None
+        if isinstance(message, dict) and "sent_at" in message:
+            echo = {"seq": message.get("seq"), "sent_at": message["sent_at"]}
+        for payload in rows:
+            self.process_row(protocol, topic, message_id, status, route, payload, echo)
+
+    def order_rows(self, message, rows):
+        """Drops the rows of redelivered messages and passes the rest through the reorder buffer."""
+        boot = seq = None
+        if isinstance(message, dict):
+            boot, seq = message.get("boot"), message.get("seq")
+        by_vehicle = {}
+        for row in rows:
+            vehicle_id = str(row.get("vehicle_id", "unknown")) if isinstance(row, dict) else "unknown"
+            by_vehicle.setdefault(vehicle_id, []).append(row)
+        ready = []
+        for vehicle_id, vehicle_rows in by_vehicle.items():
+            if not ORDERING.accept(vehicle_id, boot, seq):
+                if MESSAGE_LOG.sampled(vehicle_id):
+                    MESSAGE_LOG.message("duplicate", vehicle_id=vehicle_id, boot=boot, seq=seq, rows=len(vehicle_rows))
+                continue
+            ready.extend(ORDERING.order(vehicle_id, vehicle_rows))
+        return ready
+
+    def release_held(self, vehicles=None):
+        """Releases the rows held longer than max-hold-seconds (or of the given vehicles).
+
+        With workers the release is queued behind the vehicle's pending messages
+        on its own shard; inline it runs on the calling thread.
+        """
+        if ORDERING is None:
+            return
+        for vehicle_id in (ORDERING.expired() if vehicles is None else vehicles):
+            if self.pool is None:
+                self.process_message("ipc_mqtt", None, None, 200, None, _ReleaseHeld(vehicle_id))
+            elif not self.pool.submit(vehicle_id, "ipc_mqtt", None, None, 200, None, _ReleaseHeld(vehicle_id)):
+                log.error(f"Worker queue full, could not release held rows of {vehicle_id}")
+
+    def expire_leaderboards(self):
+        """Expires the windows of ranked vehicles that sent nothing since the last call.
+
+        Each shard's idle vehicles are expired by that shard's worker, behind
+        its pending messages; inline it runs on the calling thread.
+        """
+        t, vehicles = LEADERBOARDS.idle()
+        if not vehicles:
+            return
+        if self.pool is None:
+            LEADERBOARDS.expire(vehicles, t)
+            return
+        by_shard = {}
+        for vehicle_id in vehicles:
+            by_shard.setdefault(self.pool.shard(vehicle_id), []).append(vehicle_id)
+        for group in by_shard.values():
+            if not self.pool.submit(group[0], "ipc_mqtt", None, None, 200, None, _ExpireWindows(group, t)):
+                log.error(f"Worker queue full, could not expire leaderboard windows of {len(group)} vehicles")
+
+    def process_row(self, protocol, topic, message_id, status, route, message, echo=None):
         try:
-            # --- START LOGGING ---
-            log.info("--- START: Processing Incoming Message ---")
-            log.info(f"PROTOCOL: {protocol}, TOPIC: {topic}, MESSAGE_ID: {message_id}")
-
             if not isinstance(message, dict):
-                log.error(f"FATAL ERROR: Payload is not a dictionary, type is {type(message)}.")
                 raise ValueError(f"Payload is not a dictionary: {message}")
-                    
-            payload = message
 
-            log.info(f"Received message payload: {payload}")
+            payload = message
 
             # Extract values
             vehicle_id = str(payload.get("vehicle_id", "unknown"))
@@ -68,48 +372,55 @@ class EmissionHandler:
                 co2_val = float(payload.get("vehicle_CO2", 0))
             except (TypeError, ValueError):
                 co2_val = 0.0
-                log.error(f"Could not convert 'vehicle_CO2' value ({payload.get('vehicle_CO2')}) to float. Using 0.0.")
-            
-            log.info(f"Extracted values: Vehicle ID='{vehicle_id}', CO₂ Value={co2_val}")
+                MESSAGE_LOG.error("bad_co2", vehicle_id=vehicle_id, message_id=message_id, value=payload.get("vehicle_CO2"))
 
             if vehicle_id == "unknown":
-                log.error("Missing vehicle_id. Skipping processing flow.")
+                MESSAGE_LOG.error("missing_vehicle_id", message_id=message_id, topic=topic)
                 return
 
+            # --- WINDOWED AGGREGATES (all metrics, one pass over the payload) ---
+            started = time.perf_counter()
+            aggregated = AGGREGATOR.update(vehicle_id, payload)
+            LEADERBOARDS.update(vehicle_id, aggregated, _timestep(payload))
+            if QUANTILES is not None:
+                QUANTILES.update(vehicle_id, payload)
+
             # --- COMPARISON LOGIC ---
-            prev = MAX_CO2_STATE.get(vehicle_id, -1.0)
-            
-            # Log the comparison state before the if statement
-            log.info(f"COMPARE: Current Max State for {vehicle_id} is {prev}. Incoming CO₂ is {co2_val}.")
-            
-            if co2_val > prev:
+            # Compare-and-set in one step; a vehicle's first reading is always a new max
+            prev, updated = MAX_CO2_STATE.update_max(vehicle_id, MAX_CO2_METRIC, co2_val)
+            if HEATMAP is not None:
+                # Last, and on its own: a bad position must not leave the row half-applied
+                try:
+                    HEATMAP.process_row(vehicle_id, payload)
+                except Exception as e:
+                    MESSAGE_LOG.error("heatmap_failed", exc_info=True, vehicle_id=vehicle_id, message_id=message_id, error=str(e))
+            AGGREGATE_SECONDS.observe(time.perf_counter() - started)
+
+            if aggregated and AGGREGATES_TOPIC_FORMAT:
+                self.publish_aggregates(protocol, message_id, vehicle_id, echo)
+            if prev is None:
+                prev = -1.0
+
+            sent = None
+            if updated:
                 # --- PUBLISH BRANCH START ---
-                log.info(f"CONDITION MET: New max CO₂ found! {co2_val} > {prev}")
-                
-                MAX_CO2_STATE[vehicle_id] = co2_val
-                log.info(f"STATE UPDATED: {vehicle_id} max set to {co2_val}")
+                if CHECKPOINTER:
+                    CHECKPOINTER.record(vehicle_id, co2_val)
 
-                publish_topic = f"vehicle/results/{vehicle_id}/max_co2"
+                publish_topic = MAX_CO2_TOPIC_FORMAT.format(vehicle_id)
 
                 result = {
                     "vehicle_id": vehicle_id,
                     "max_CO2": co2_val,
                     "timestamp": int(time.time())
                 }
+                if echo:
+                    result.update(echo)
 
-                log.info(f"Outgoing payload prepared: {result}")
-
-                if FIREHOSE_CLIENT:
-                    try:
-                        # Firehose requires the data to be a string and encoded as bytes, often with a newline delimiter
-                        record_data = json.dumps(result) + '\n' 
-                        FIREHOSE_CLIENT.put_record(
-                            DeliveryStreamName=FIREHOSE_STREAM_NAME,
-                            Record={'Data': record_data.encode('utf-8')}
-                        )
-                        log.info(f"Successfully sent max CO₂ data to Firehose stream {FIREHOSE_STREAM_NAME}.")
-                    except Exception as fe:
-                        log.error(f"Firehose publish failed (Check IAM/network): {fe}")
+                if FIREHOSE_SINK:
+                    # Only a buffer append here; the sink batches and ships records in the background
+                    if not FIREHOSE_SINK.put(result):
+                        MESSAGE_LOG.error("firehose_buffer_full", vehicle_id=vehicle_id)
 
                 # Wrap outgoing message per SDK spec
                 formatted = self.formatter.get_message(
@@ -118,70 +429,286 @@ class EmissionHandler:
                     message=result
                 )
 
-                log.info(f"Sending to topic: {publish_topic}")
-                
-                # Publish using proper signature:
-                self.client.publish_message(
-                    protocol=protocol,
-                    topic=publish_topic,
-                    message=formatted
-                )
+                # Sent now, or coalesced and sent when this vehicle's publish interval ends
+                sent = self.results.offer(publish_topic, co2_val, (protocol, publish_topic, formatted))
 
-                log.info(f"Published NEW MAX CO₂ for {vehicle_id}: {formatted}")
+                MESSAGE_LOG.state("new_max_co2", vehicle_id=vehicle_id, max_CO2=co2_val, previous=prev,
+                                  topic=publish_topic, published=sent)
                 # --- PUBLISH BRANCH END ---
 
-            else:
-                log.info(f"CONDITION SKIPPED: CO₂ {co2_val} is not greater than existing max {prev} for vehicle {vehicle_id}")
-                log.debug(
-                    f"CO₂ {co2_val} <= existing max {prev} for vehicle {vehicle_id}"
-                )
-            
-            log.info("--- END: Message Processing Complete ---")
+            if MESSAGE_LOG.sampled(vehicle_id):
+                MESSAGE_LOG.message("row", protocol=protocol, topic=topic, message_id=message_id,
+                                    vehicle_id=vehicle_id, co2=co2_val, max_co2=max(prev, co2_val),
+                                    new_max=updated, published=sent)
             
         except Exception as e:
-            err = f"Error processing message: {e}"
-            log.error(err, exc_info=True)
-            # Publish error through SDK
-            self.client.publish_error(protocol, err)
-
-
-# ==========================================================
-# CLIENT INITIALIZATION
-# ==========================================================
-default_handler = EmissionHandler(None)
-
-client = AwsGreengrassPubSubSdkClient(
-    BASE_TOPIC,
-    default_handler.on_message
-)
-
-default_handler.client = client
-
-# Register handler for routing
-client.register_message_handler(default_handler)
-
-# Activate IPC + MQTT Pub/Sub
-client.activate_ipc_pubsub()
-client.activate_mqtt_pubsub()
+            self.report_error(protocol, topic, message_id, e)
+
+    def report_error(self, protocol, topic, message_id, e):
+        PROCESSING_ERRORS.inc()
+        err = f"Error processing message: {e}"
+        MESSAGE_LOG.error("processing_error", exc_info=True, message_id=message_id, topic=topic, error=str(e))
+        # Publish error through SDK
+        self.client.publish_error(protocol, err)
+
+    def publish_aggregates(self, protocol, message_id, vehicle_id, echo=None):
+        """Offers the vehicle's aggregates; the snapshot is taken when the result is actually sent."""
+        topic = AGGREGATES_TOPIC_FORMAT.format(vehicle_id)
+        build = functools.partial(self._format_aggregates, message_id, vehicle_id, echo)
+        self.results.offer(topic, None, (protocol, topic, build))
+
+    def _format_aggregates(self, message_id, vehicle_id, echo):
+        result = {
+            "vehicle_id": vehicle_id,
+            "aggregates": AGGREGATOR.snapshot(vehicle_id),
+            "timestamp": int(time.time())
+        }
+        if echo:
+            result.update(echo)
+        return self.formatter.get_message(
+            message_id=message_id,
+            route="EmissionAnalyzer.aggregates_response",
+            message=result
+        )
+
+    def answer_leaderboard(self, protocol, message_id, request):
+        """Responds to a request such as {"board": "max_co2", "k": 5} on the response topic.
+
+        A request may name its own "reply-topic" under reply-topic-prefix; an
+        error (including a refused reply topic) is returned in the response.
+        """
+        request = request if isinstance(request, dict) else {}
+        result = {"timestamp": int(time.time())}
+        if "request_id" in request:
+            result["request_id"] = request["request_id"]
+        topic = LEADERBOARD_RESPONSE_TOPIC
+        reply_topic = request.get("reply-topic")
+        if reply_topic:
+            if _allowed_reply_topic(reply_topic):
+                topic = reply_topic
+            else:
+                result["error"] = f"reply-topic '{reply_topic}' is not allowed, it must start with '{LEADERBOARD_REPLY_PREFIX}'"
+        if "error" not in result:
+            try:
+                result["leaderboards"] = LEADERBOARDS.query(request)
+            except (ValueError, TypeError) as e:
+                result["error"] = str(e)
+        formatted = self.formatter.get_message(
+            message_id=message_id,
+            route="EmissionAnalyzer.leaderboard_response",
+            message=result
+        )
+        # Requester-chosen reply topics get no result_seq counter, so they cannot grow _result_seq
+        self._send_result((protocol, topic, formatted), sequenced=topic == LEADERBOARD_RESPONSE_TOPIC)
+
+    def publish_heatmap(self, delta):
+        """Publishes the cells and lanes that changed since the last snapshot, in chunks."""
+        cells = delta["cells"]
+        parts = -(-len(cells) // HEATMAP_MAX_ITEMS)
+        for part in range(parts):
+            result = {
+                "metric": HEATMAP.metric,
+                "cell-size": HEATMAP.cell_size,
+                "origin": list(HEATMAP.origin),
+                "fields": ["ix", "iy"] + CELL_FIELDS,
+                "cells": cells[part * HEATMAP_MAX_ITEMS:(part + 1) * HEATMAP_MAX_ITEMS],
+                "part": part + 1,
+                "parts": parts,
+                "timestamp": int(time.time()),
+            }
+            formatted = self.formatter.get_message(route="EmissionAnalyzer.heatmap_response", message=result)
+            self._send_result(("ipc_mqtt", HEATMAP_TOPIC, formatted))
+
+        lanes = list(delta["lanes"].items())
+        parts = -(-len(lanes) // HEATMAP_MAX_ITEMS)
+        for part in range(parts):
+            result = {
+                "metric": HEATMAP.metric,
+                "fields": CELL_FIELDS,
+                "lanes": dict(lanes[part * HEATMAP_MAX_ITEMS:(part + 1) * HEATMAP_MAX_ITEMS]),
+                "part": part + 1,
+                "parts": parts,
+                "timestamp": int(time.time()),
+            }
+            formatted = self.formatter.get_message(route="EmissionAnalyzer.lanes_response", message=result)
+            self._send_result(("ipc_mqtt", LANES_TOPIC, formatted))
+
+    def publish_quantiles(self, vehicle_id, quantiles):
+        """Publishes one vehicle's quantiles, or the fleet's when vehicle_id is None."""
+        result = {"quantiles": quantiles, "timestamp": int(time.time())}
+        if vehicle_id is None:
+            topic = FLEET_QUANTILES_TOPIC
+            result["vehicles"] = len(QUANTILES)
+        else:
+            topic = QUANTILES_TOPIC_FORMAT.format(vehicle_id)
+            result["vehicle_id"] = vehicle_id
+        formatted = self.formatter.get_message(
+            route="EmissionAnalyzer.quantiles_response",
+            message=result
+        )
+        self._send_result(("ipc_mqtt", topic, formatted))
+
+
+def _allowed_reply_topic(topic):
+    # Never the request topic itself, which would answer our own responses forever
+    return (isinstance(topic, str) and bool(LEADERBOARD_REPLY_PREFIX) and topic != LEADERBOARD_REQUEST_TOPIC
+            and topic.startswith(LEADERBOARD_REPLY_PREFIX) and not any(c in topic for c in "+#"))
+
+
+def _timestep(payload):
+    try:
+        return float(payload["timestep_time"])
+    except (KeyError, TypeError, ValueError):
+        return None
 
-initialize_firehose_client()
 
 # ==========================================================
-# SUBSCRIPTIONS
+# METRICS
 # ==========================================================
-for t in MQTT_SUB_TOPICS:
-    log.info(f"Subscribing to {t} via ipc_mqtt")
-    client.subscribe_to_topic("ipc_mqtt", t)
-
-log.info("All subscriptions active.")
-log.info("Running main loop...")
-
+def register_metrics(handler):
+    """Exposes queue depths, state size and the components' own counters."""
+    pool = handler.pool
+    results = handler.results
+    METRICS.gauge("worker_queue_depth", lambda: sum(pool.queue_depths()) if pool else 0, "Messages waiting for a worker")
+    METRICS.counter_callback("worker_dropped_total", lambda: pool.dropped if pool else 0, "Messages dropped on full worker queues")
+    METRICS.gauge("results_pending", results.pending, "Coalesced results waiting for their interval")
+    METRICS.counter_callback("results_published_total", lambda: results.published, "Result publishes")
+    METRICS.counter_callback("results_publish_failed_total", lambda: results.failed, "Failed result publishes")
+    METRICS.gauge("vehicles_tracked", lambda: len(MAX_CO2_STATE), "Vehicles in the state store")
+    METRICS.gauge("state_memory_bytes", MAX_CO2_STATE.memory_bytes, "Approximate size of all per-vehicle state")
+    METRICS.counter_callback("state_evictions_total", lambda: MAX_CO2_STATE.evictions, "Vehicles evicted from the state store")
+    METRICS.gauge("quantile_memory_bytes", lambda: QUANTILES.memory_bytes() if QUANTILES is not None else 0, "Approximate size of the per-vehicle quantile sketches")
+    METRICS.gauge("heatmap_memory_bytes", lambda: HEATMAP.memory_bytes() if HEATMAP is not None else 0, "Approximate size of the heatmap grid")
+    METRICS.counter_callback("heatmap_out_of_bounds_total", lambda: HEATMAP.out_of_bounds if HEATMAP is not None else 0, "Rows outside the dense heatmap grid")
+    METRICS.counter_callback("duplicate_messages_total", lambda: ORDERING.duplicates if ORDERING is not None else 0, "Redelivered messages dropped")
+    METRICS.counter_callback("stale_messages_total", lambda: ORDERING.stale if ORDERING is not None else 0, "Messages older than the dedupe window, dropped")
+    METRICS.counter_callback("aggregation_late_samples_total", lambda: AGGREGATOR.late_samples, "Samples too old for a window, left out of it")
+    METRICS.counter_callback("late_rows_total", lambda: ORDERING.late_rows if ORDERING is not None else 0, "Rows older than one already processed")
+    METRICS.gauge("reorder_held_rows", lambda: ORDERING.held_rows() if ORDERING is not None else 0, "Rows waiting in the reorder buffer")
+    METRICS.gauge("checkpoint_queue_depth", lambda: CHECKPOINTER.depth() if CHECKPOINTER else 0, "Updates waiting to be checkpointed")
+    METRICS.gauge("firehose_buffer_depth", lambda: FIREHOSE_SINK.depth() if FIREHOSE_SINK else 0, "Records waiting for Firehose")
+    METRICS.counter_callback("firehose_records_sent_total", lambda: FIREHOSE_SINK.records_sent if FIREHOSE_SINK else 0, "Records accepted by Firehose")
+    METRICS.counter_callback("firehose_records_failed_total", lambda: FIREHOSE_SINK.records_failed if FIREHOSE_SINK else 0, "Records Firehose rejected after retries")
+    METRICS.counter_callback("firehose_records_dropped_total", lambda: FIREHOSE_SINK.records_dropped if FIREHOSE_SINK else 0, "Records dropped on a full Firehose buffer")
+
+
+def start_metrics(client, handler):
+    """Starts the metrics endpoint and periodic reporter configured in AnalyzerConfig.metrics."""
+    register_metrics(handler)
+    metrics_config = ANALYZER_CONFIG.get("metrics", {})
+    if metrics_config.get("http-port"):
+        try:
+            start_http_server(METRICS, metrics_config["http-port"], metrics_config.get("http-host", "127.0.0.1"))
+            log.info(f"Metrics served on port {metrics_config['http-port']}")
+        except OSError as e:
+            log.error(f"Could not start metrics endpoint: {e}")
+
+    def publish_metrics(stats):
+        client.publish_message(
+            protocol="ipc",
+            topic=metrics_config["ipc-topic"],
+            message=handler.formatter.get_message(route="EmissionAnalyzer.metrics", message=stats)
+        )
+
+    return MetricsReporter(
+        METRICS,
+        interval_s=metrics_config.get("report-interval-seconds", 10.0),
+        stats_file=metrics_config.get("stats-file"),
+        publish_fn=publish_metrics if metrics_config.get("ipc-topic") else None,
+    ).start()
+
+
+POOL_STATS_INTERVAL_S = 60
+
+
+def run():
+    # Imported here so the handler can be driven without the Greengrass SDK
+    # (see benchmark.py in the repository root)
+    from awsgreengrasspubsubsdk.pubsub_client import AwsGreengrassPubSubSdkClient
+    from awsgreengrasspubsubsdk.message_formatter import PubSubMessageFormatter
+
+    # ==========================================================
+    # CLIENT INITIALIZATION
+    # ==========================================================
+    default_handler = EmissionHandler(None, PubSubMessageFormatter())
+
+    client = AwsGreengrassPubSubSdkClient(
+        BASE_TOPIC,
+        default_handler.on_message
+    )
+
+    default_handler.client = client
+
+    # Register handler for routing
+    client.register_message_handler(default_handler)
+    default_handler.results.start()
+    if default_handler.pool:
+        default_handler.pool.start()
+    if default_handler.quantile_reporter:
+        default_handler.quantile_reporter.start()
+    if default_handler.heatmap_reporter:
+        default_handler.heatmap_reporter.start()
+
+    # Activate IPC + MQTT Pub/Sub
+    client.activate_ipc_pubsub()
+    client.activate_mqtt_pubsub()
+
+    initialize_firehose_client()
+    metrics_reporter = start_metrics(client, default_handler)
+
+    # ==========================================================
+    # SUBSCRIPTIONS
+    # ==========================================================
+    for t in MQTT_SUB_TOPICS:
+        log.info(f"Subscribing to {t} via ipc_mqtt")
+        client.subscribe_to_topic("ipc_mqtt", t)
+    if LEADERBOARD_REQUEST_TOPIC and LEADERBOARD_REQUEST_TOPIC not in MQTT_SUB_TOPICS:
+        log.info(f"Serving leaderboard requests on {LEADERBOARD_REQUEST_TOPIC}")
+        client.subscribe_to_topic("ipc_mqtt", LEADERBOARD_REQUEST_TOPIC)
+
+    log.info("All subscriptions active.")
+    log.info("Running main loop...")
+
+    # ==========================================================
+    # MAIN LOOP
+    # ==========================================================
+    # Greengrass stops components with SIGTERM; turn it into a clean exit so the
+    # Firehose buffer still gets flushed.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
 
-# ==========================================================
-# MAIN LOOP
-# ==========================================================
-try:
-    while True:
-        time.sleep(1)
-except KeyboardInterrupt:
-    log.info("Shutting down...")
+    try:
+        ticks = 0
+        while True:
+            time.sleep(1)
+            ticks += 1
+            default_handler.release_held()
+            if LEADERBOARD_EXPIRE_INTERVAL_S and ticks % LEADERBOARD_EXPIRE_INTERVAL_S == 0:
+                default_handler.expire_leaderboards()
+            if default_handler.pool and ticks % POOL_STATS_INTERVAL_S == 0:
+                log.info(f"Worker pool stats: {default_handler.pool.stats()}")
+    except (KeyboardInterrupt, SystemExit):
+        log.info("Shutting down...")
+    finally:
+        metrics_reporter.close()
+        shutdown(default_handler)
+
+
+def shutdown(handler):
+    """Drains the workers, then flushes results, checkpoint and Firehose, in that order."""
+    if ORDERING is not None:
+        handler.release_held(ORDERING.held_vehicles())
+    if handler.pool:
+        handler.pool.close()
+    if handler.quantile_reporter:
+        handler.quantile_reporter.close()
+    if handler.heatmap_reporter:
+        handler.heatmap_reporter.close()
+    handler.results.close()
+    if CHECKPOINTER:
+        CHECKPOINTER.close()
+    if FIREHOSE_SINK:
+        FIREHOSE_SINK.close()
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,247 @@
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+log = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the latency histogram buckets; +Inf is implicit
+LATENCY_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+)
+
+PREFIX = "emission_analyzer_"
+
+
+class _PerThread:
+    """Base for metrics whose hot-path writes go to a per-thread cell, so no lock is taken.
+
+    Readers sum the cells of every thread that ever wrote; a value may lag a
+    concurrent write by one update, which is fine for monitoring.
+    """
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._local = threading.local()
+        self._cells = []
+        self._cells_lock = threading.Lock()
+
+    def _new_cell(self):
+        raise NotImplementedError
+
+    def _cell(self):
+        try:
+            return self._local.cell
+        except AttributeError:
+            cell = self._local.cell = self._new_cell()
+            with self._cells_lock:
+                self._cells.append(cell)
+            return cell
+
+
+class Counter(_PerThread):
+    def _new_cell(self):
+        return [0]
+
+    def inc(self, n=1):
+        self._cell()[0] += n
+
+    def value(self):
+        return sum(c[0] for c in list(self._cells))
+
+
+class Histogram(_PerThread):
+    """Fixed-bucket histogram; each cell holds per-bucket counts followed by the sum."""
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(buckets)
+
+    def _new_cell(self):
+        return [0] * (len(self.buckets) + 1) + [0.0]
+
+    def observe(self, value):
+        cell = self._cell()
+        cell[bisect.bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    def time(self):
+        return _Timer(self)
+
+    def snapshot(self):
+        """Returns (per-bucket counts including +Inf, total count, sum)."""
+        counts = [0] * (len(self.buckets) + 1)
+        total = 0.0
+        for cell in list(self._cells):
+            for i in range(len(counts)):
+                counts[i] += cell[i]
+            total += cell[-1]
+        return counts, sum(counts), total
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding quantile q (None if empty)."""
+        counts, n, _ = self.snapshot()
+        if not n:
+            return None
+        rank = q * n
+        seen = 0
+        for bound, c in zip(self.buckets + (float("inf"),), counts):
+            seen += c
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class _Timer:
+    __slots__ = ("hist", "start")
+
+    def __init__(self, hist):
+        self.hist = hist
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.start)
+        return False
+
+
+class MetricsRegistry:
+    """Holds counters, histograms and callback-backed gauges/counters."""
+
+    def __init__(self, prefix=PREFIX):
+        self.prefix = prefix
+        self.counters = {}
+        self.histograms = {}
+        self.callbacks = {}     # name -> (type, help, fn)
+
+    def counter(self, name, help_text=""):
+        if name not in self.counters:
+            self.counters[name] = Counter(name, help_text)
+        return self.counters[name]
+
+    def histogram(self, name, help_text="", buckets=LATENCY_BUCKETS):
+        if name not in self.histograms:
+            self.histograms[name] = Histogram(name, help_text, buckets)
+        return self.histograms[name]
+
+    def gauge(self, name, fn, help_text=""):
+        """Registers a value read from fn() at scrape time (queue depth, state size, ...)."""
+        self.callbacks[name] = ("gauge", help_text, fn)
+
+    def counter_callback(self, name, fn, help_text=""):
+        """Registers a monotonic count kept elsewhere (e.g. FirehoseSink.records_failed)."""
+        self.callbacks[name] = ("counter", help_text, fn)
+
+    def _callback_values(self):
+        for name, (kind, help_text, fn) in list(self.callbacks.items()):
+            try:
+                yield name, kind, help_text, fn()
+            except Exception as e:
+                log.debug(f"Metric callback {name} failed: {e}")
+
+    def to_dict(self):
+        out = {name: c.value() for name, c in self.counters.items()}
+        for name, _, _, value in self._callback_values():
+            out[name] = value
+        for name, h in self.histograms.items():
+            _, n, total = h.snapshot()
+            out[name] = {
+                "count": n,
+                "mean": total / n if n else None,
+                "p50": h.quantile(0.5),
+                "p99": h.quantile(0.99),
+            }
+        return out
+
+    def render_prometheus(self):
+        lines = []
+        p = self.prefix
+        for name, c in self.counters.items():
+            lines += [f"# HELP {p}{name} {c.help}", f"# TYPE {p}{name} counter", f"{p}{name} {c.value()}"]
+        for name, kind, help_text, value in self._callback_values():
+            lines += [f"# HELP {p}{name} {help_text}", f"# TYPE {p}{name} {kind}", f"{p}{name} {value}"]
+        for name, h in self.histograms.items():
+            counts, n, total = h.snapshot()
+            lines += [f"# HELP {p}{name} {h.help}", f"# TYPE {p}{name} histogram"]
+            cumulative = 0
+            for bound, c in zip(h.buckets, counts):
+                cumulative += c
+                lines.append(f'{p}{name}_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f'{p}{name}_bucket{{le="+Inf"}} {n}')
+            lines += [f"{p}{name}_sum {total}", f"{p}{name}_count {n}"]
+        return "\n".join(lines) + "\n"
+
+
+def start_http_server(registry, port, host="127.0.0.1"):
+    """Serves registry.render_prometheus() on http://host:port/metrics from a daemon thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = registry.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, fmt, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, int(port)), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+class MetricsReporter:
+    """Periodically writes the metrics as JSON to a stats file and/or hands them to publish_fn."""
+
+    def __init__(self, registry, interval_s=10.0, stats_file=None, publish_fn=None):
+        self.registry = registry
+        self.interval_s = float(interval_s)
+        self.stats_file = stats_file
+        self.publish_fn = publish_fn
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None and (self.stats_file or self.publish_fn):
+            self._thread = threading.Thread(target=self._run, name="metrics-reporter", daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval_s):
+            self.report()
+
+    def report(self):
+        stats = self.registry.to_dict()
+        stats["timestamp"] = int(time.time())
+        if self.stats_file:
+            try:
+                tmp = self.stats_file + ".tmp"
+                with open(tmp, "w") as f:
+                    json.dump(stats, f, indent=1)
+                os.replace(tmp, self.stats_file)
+            except OSError as e:
+                log.error(f"Could not write stats file {self.stats_file}: {e}")
+        if self.publish_fn:
+            try:
+                self.publish_fn(stats)
+            except Exception as e:
+                log.error(f"Could not publish metrics: {e}")
@@ -0,0 +1,126 @@
+import time
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class ResultCoalescer:
+    """Coalesces result publishes per key (typically the result topic).
+
+    An update is published immediately when the key's last publish is at
+    least min_interval_s old, or when its value moved by more than min_delta
+    since the last published value (min_delta=None disables that bypass).
+    Anything else replaces the key's pending update, which is published once
+    the interval ends, so the latest value is never lost.
+    """
+
+    def __init__(self, publish_fn, min_interval_s=1.0, min_delta=None, tick_s=0.25):
+        self.publish_fn = publish_fn
+        self.min_interval_s = float(min_interval_s)
+        self.min_delta = None if min_delta is None else float(min_delta)
+        self.tick_s = float(tick_s)
+
+        self._lock = threading.Lock()
+        # key -> (monotonic time of last publish, last published value)
+        self._last = {}
+        # key -> (value, item) waiting for its interval to end
+        self._pending = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.published = 0
+        self.coalesced = 0
+        self.failed = 0
+
+    @classmethod
+    def from_config(cls, publish_fn, cfg):
+        """Builds a coalescer from the 'publish' section of the analyzer configuration."""
+        return cls(
+            publish_fn,
+            min_interval_s=cfg.get("min-interval-seconds", 1.0),
+            min_delta=cfg.get("min-delta"),
+            tick_s=cfg.get("tick-seconds", 0.25),
+        )
+
+    def start(self):
+        if self._thread is None and self.min_interval_s > 0:
+            self._thread = threading.Thread(target=self._run, name="result-coalescer", daemon=True)
+            self._thread.start()
+        return self
+
+    def pending(self):
+        return len(self._pending)
+
+    def offer(self, key, value, item):
+        """Publishes item now or parks it as key's pending update. value may be None."""
+        now = time.monotonic()
+        with self._lock:
+            last = self._last.get(key)
+            if last is None or now - last[0] >= self.min_interval_s or self._significant(last[1], value):
+                self._pending.pop(key, None)
+                self._last[key] = (now, value)
+                send = True
+            else:
+                if key in self._pending:
+                    self.coalesced += 1
+                self._pending[key] = (value, item)
+                send = False
+        if send:
+            self._publish(item)
+        return send
+
+    def _significant(self, last_value, value):
+        if self.min_delta is None or value is None or last_value is None:
+            return False
+        return abs(value - last_value) > self.min_delta
+
+    def flush_due(self):
+        """Publishes every pending update whose interval has ended."""
+        now = time.monotonic()
+        due = []
+        with self._lock:
+            for key, (value, item) in list(self._pending.items()):
+                if now - self._last[key][0] >= self.min_interval_s:
+                    del self._pending[key]
+                    self._last[key] = (now, value)
+                    due.append(item)
+        for item in due:
+            self._publish(item)
+        return len(due)
+
+    def flush_all(self):
+        """Publishes every pending update regardless of its interval (e.g. on shutdown)."""
+        now = time.monotonic()
+        with self._lock:
+            items = list(self._pending.items())
+            self._pending.clear()
+            for key, (value, _) in items:
+                self._last[key] = (now, value)
+        for _, (_, item) in items:
+            self._publish(item)
+        return len(items)
+
+    def forget(self, key):
+        with self._lock:
+            self._last.pop(key, None)
+            self._pending.pop(key, None)
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush_all()
+
+    def _run(self):
+        while not self._stop.wait(self.tick_s):
+            self.flush_due()
+
+    def _publish(self, item):
+        try:
+            self.publish_fn(item)
+            self.published += 1
+        except Exception as e:
+            self.failed += 1
+            log.error(f"Result publish failed: {e}", exc_info=True)
@@ -0,0 +1,301 @@
+import math
+import random
+import logging
+import threading
+from array import array
+
+log = logging.getLogger(__name__)
+
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99)
+
+# KLL compactor capacity parameter; about 3 * k doubles are retained per sketch
+# (k=128 is roughly 3 KB) and the rank error is about 1.7 / k.
+DEFAULT_K = 128
+
+# Capacity shrink factor between levels, from the KLL paper
+_C = 2.0 / 3.0
+
+
+# ==========================================================
+# SKETCH
+# ==========================================================
+class KLLSketch:
+    """KLL streaming quantile sketch (Karnin, Lang, Liberty 2016).
+
+    Level h holds items of weight 2**h in an array('d'). A level that reaches
+    its capacity is sorted and every other item, from a random offset, is
+    promoted to the next level. Memory stays bounded however long the stream
+    runs, and sketches of the same k merge into a sketch of the combined
+    stream.
+    """
+
+    __slots__ = ("k", "levels", "n", "_size", "_capacity", "min", "max")
+
+    def __init__(self, k=DEFAULT_K):
+        self.k = int(k)
+        self.levels = [array("d")]
+        self.n = 0
+        self._size = 0
+        self._capacity = self._level_capacity(0, 1)
+        self.min = math.inf
+        self.max = -math.inf
+
+    def _level_capacity(self, h, depth):
+        return max(2, int(math.ceil(self.k * _C ** (depth - 1 - h))))
+
+    def _max_size(self):
+        depth = len(self.levels)
+        return sum(self._level_capacity(h, depth) for h in range(depth))
+
+    def __len__(self):
+        return self.n
+
+    def update(self, v):
+        self.levels[0].append(v)
+        self.n += 1
+        self._size += 1
+        if v < self.min:
+            self.min = v
+        if v > self.max:
+            self.max = v
+        if self._size >= self._capacity:
+            self._compress()
+
+    def _compress(self):
+        depth = len(self.levels)
+        for h in range(depth):
+            level = self.levels[h]
+            if len(level) < self._level_capacity(h, depth):
+                continue
+            if h + 1 == len(self.levels):
+                self.levels.append(array("d"))
+            items = sorted(level)
+            # An odd item stays behind so the total weight is preserved
+            keep = array("d", items[-1:]) if len(items) % 2 else array("d")
+            if keep:
+                items = items[:-1]
+            self.levels[h + 1].extend(items[random.getrandbits(1)::2])
+            self.levels[h] = keep
+            # One compaction per call keeps update() cheap; the next overflow handles the rest
+            break
+        self._size = sum(len(level) for level in self.levels)
+        self._capacity = self._max_size()
+
+    def merge(self, other):
+        """Folds another sketch into this one."""
+        while len(self.levels) < len(other.levels):
+            self.levels.append(array("d"))
+        for h, level in enumerate(other.levels):
+            self.levels[h].extend(level)
+        self.n += other.n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._size = sum(len(level) for level in self.levels)
+        self._capacity = self._max_size()
+        while self._size >= self._capacity:
+            self._compress()
+        return self
+
+    def copy(self):
+        """Snapshot safe to read while the original keeps updating on another thread.
+
+        list() and array slicing are single C calls, so under the GIL each
+        level is copied whole.
+        """
+        clone = KLLSketch(self.k)
+        clone.levels = [level[:] for level in list(self.levels)]
+        clone.n = self.n
+        clone.min = self.min
+        clone.max = self.max
+        clone._size = sum(len(level) for level in clone.levels)
+        clone._capacity = clone._max_size()
+        return clone
+
+    def quantiles(self, qs=DEFAULT_QUANTILES):
+        """Returns [value at q for q in qs], or Nones if the sketch is empty."""
+        if not self.n:
+            return [None] * len(qs)
+        weighted = sorted(
+            (v, 1 << h) for h, level in enumerate(self.levels) for v in level
+        )
+        total = sum(w for _, w in weighted)
+        out = []
+        for q in qs:
+            if q <= 0:
+                out.append(self.min)
+                continue
+            if q >= 1:
+                out.append(self.max)
+                continue
+            rank = q * total
+            seen = 0
+            value = weighted[-1][0]
+            for v, w in weighted:
+                seen += w
+                if seen >= rank:
+                    value = v
+                    break
+            out.append(value)
+        return out
+
+    def memory_bytes(self):
+        return sum(level.buffer_info()[1] * level.itemsize for level in self.levels)
+
+
+# ==========================================================
+# TRACKER
+# ==========================================================
+class QuantileTracker:
+    """Per-vehicle and fleet-wide KLL sketches for a set of metrics.
+
+    A vehicle's sketches are only updated by the worker owning its shard.
+    Fleet sketches are kept per thread, so updates never contend, and are
+    merged when queried.
+    """
+
+    def __init__(self, metrics, k=DEFAULT_K, quantiles=DEFAULT_QUANTILES):
+        self.metrics = list(metrics)
+        self.k = int(k)
+        self.quantiles = tuple(quantiles)
+        # vehicle_id -> [KLLSketch per metric]
+        self.state = {}
+        # Vehicles updated since the last drain_dirty()
+        self._dirty = set()
+        self._local = threading.local()
+        self._fleet = []
+        self._fleet_lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, cfg, default_metrics):
+        """Builds a tracker from the 'quantiles' section of the analyzer configuration."""
+        return cls(
+            cfg.get("metrics") or default_metrics,
+            k=cfg.get("k", DEFAULT_K),
+            quantiles=cfg.get("quantiles", DEFAULT_QUANTILES),
+        )
+
+    def __len__(self):
+        return len(self.state)
+
+    def _fleet_sketches(self):
+        try:
+            return self._local.sketches
+        except AttributeError:
+            sketches = self._local.sketches = [KLLSketch(self.k) for _ in self.metrics]
+            with self._fleet_lock:
+                self._fleet.append(sketches)
+            return sketches
+
+    def update(self, vehicle_id, payload):
+        vehicle = self.state.get(vehicle_id)
+        if vehicle is None:
+            vehicle = self.state[vehicle_id] = [KLLSketch(self.k) for _ in self.metrics]
+        fleet = self._fleet_sketches()
+        for i, metric in enumerate(self.metrics):
+            raw = payload.get(metric)
+            if raw is None:
+                continue
+            try:
+                v = float(raw)
+            except (TypeError, ValueError):
+                continue
+            if v != v:  # NaN
+                continue
+            vehicle[i].update(v)
+            fleet[i].update(v)
+        self._dirty.add(vehicle_id)
+
+    def _summary(self, sketches):
+        return summarize(self.metrics, [sketch.copy() for sketch in sketches], self.quantiles)
+
+    def vehicle_quantiles(self, vehicle_id):
+        """Returns {metric: {"p50": .., "p90": .., "p99": .., "count": n}}, or None if unseen."""
+        vehicle = self.state.get(vehicle_id)
+        if vehicle is None:
+            return None
+        return self._summary(vehicle)
+
+    def fleet_sketches(self):
+        """Merged fleet-wide sketches, one per metric."""
+        merged = [KLLSketch(self.k) for _ in self.metrics]
+        with self._fleet_lock:
+            parts = list(self._fleet)
+        for sketches in parts:
+            for m, sketch in zip(merged, sketches):
+                m.merge(sketch.copy())
+        return merged
+
+    def fleet_quantiles(self):
+        return self._summary(self.fleet_sketches())
+
+    def drain_dirty(self):
+        # Workers may still add to the old set; list() copies it in one C call under the GIL
+        dirty, self._dirty = self._dirty, set()
+        return list(dirty)
+
+    def forget(self, vehicle_id):
+        self.state.pop(vehicle_id, None)
+        self._dirty.discard(vehicle_id)
+
+    def memory_bytes(self):
+        return sum(s.memory_bytes() for sketches in list(self.state.values()) for s in sketches)
+
+    def bytes_per_vehicle(self):
+        """Approximate size of one vehicle's sketches once full: about 3 * k doubles plus object overhead each."""
+        return len(self.metrics) * (3 * self.k * 8 + 1500)
+
+
+def summarize(metrics, sketches, quantiles=DEFAULT_QUANTILES):
+    """{metric: {"p50": .., "p90": .., "p99": .., "count": n}} for one sketch per metric."""
+    out = {}
+    for metric, sketch in zip(metrics, sketches):
+        summary = {_label(q): v for q, v in zip(quantiles, sketch.quantiles(quantiles))}
+        summary["count"] = sketch.n
+        out[metric] = summary
+    return out
+
+
+def _label(q):
+    """0.5 -> "p50", 0.99 -> "p99", 0.999 -> "p99.9"."""
+    return "p{:g}".format(q * 100)
+
+
+class QuantileReporter:
+    """Every interval_s, hands publish_fn the quantiles of vehicles updated since the last
+    report as (vehicle_id, summary), and the fleet-wide quantiles as (None, summary)."""
+
+    def __init__(self, tracker, publish_fn, interval_s=10.0):
+        self.tracker = tracker
+        self.publish_fn = publish_fn
+        self.interval_s = float(interval_s)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None and self.interval_s > 0:
+            self._thread = threading.Thread(target=self._run, name="quantile-reporter", daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval_s):
+            self.report()
+
+    def report(self):
+        for vehicle_id in self.tracker.drain_dirty():
+            summary = self.tracker.vehicle_quantiles(vehicle_id)
+            if summary is not None:
+                self._publish(vehicle_id, summary)
+        self._publish(None, self.tracker.fleet_quantiles())
+
+    def _publish(self, vehicle_id, summary):
+        try:
+            self.publish_fn(vehicle_id, summary)
+        except Exception as e:
+            log.error(f"Quantile publish failed for {vehicle_id or 'fleet'}: {e}", exc_info=True)
@@ -0,0 +1,249 @@
+import math
+import time
+import random
+import logging
+import threading
+from array import array
+
+log = logging.getLogger(__name__)
+
+# Rough per-vehicle overhead of the id -> slot interning dict entry plus the id string
+INTERN_OVERHEAD_BYTES = 120
+# Slots sampled when picking an approximate-LRU eviction victim
+LRU_SAMPLE_SIZE = 16
+# Slots inspected by the incremental TTL sweep on every touch
+TTL_SWEEP_STEP = 4
+
+NAN = float("nan")
+
+
+class VehicleStateStore:
+    """Bounded per-vehicle metric store with columnar storage.
+
+    Vehicle ids are interned to dense integer slots; each metric is an
+    array('d') column indexed by slot (NaN = unset), plus a last-seen column.
+    Capacity is max_vehicles, further limited by max_memory_bytes, which is
+    divided by the store's own per-vehicle cost plus extra_bytes_per_vehicle
+    (what other components keep for every tracked vehicle). When full,
+    the least recently seen of a random sample of slots is evicted
+    (approximate LRU); vehicles idle longer than ttl_s are evicted by an
+    incremental sweep. on_evict(vehicle_id) lets callers drop related state;
+    it is called after the store's lock is released, on the thread whose
+    write caused the eviction. Eviction only frees memory, so on_miss(vehicle_id) may return
+    {metric: value} to seed a vehicle that is not in memory (e.g. from its
+    checkpoint).
+    """
+
+    def __init__(self, metrics, max_vehicles=100000, max_memory_bytes=None, ttl_s=None, on_evict=None,
+                 on_miss=None, extra_bytes_per_vehicle=0):
+        self.metrics = list(metrics)
+        self._column_index = {m: i for i, m in enumerate(self.metrics)}
+
+        self.extra_bytes_per_vehicle = int(extra_bytes_per_vehicle)
+        self.bytes_per_vehicle = 8 * (len(self.metrics) + 1) + INTERN_OVERHEAD_BYTES + self.extra_bytes_per_vehicle
+        capacity = int(max_vehicles)
+        if max_memory_bytes:
+            capacity = min(capacity, int(max_memory_bytes) // self.bytes_per_vehicle)
+        if capacity < 1:
+            raise ValueError("State store capacity must allow at least one vehicle")
+        self.capacity = capacity
+        self.ttl_s = float(ttl_s) if ttl_s else None
+        self.on_evict = on_evict
+        self.on_miss = on_miss
+
+        self._slots = {}            # vehicle_id -> slot
+        self._ids = []              # slot -> vehicle_id (None when free)
+        self._free = []             # reusable slots
+        self._columns = [array("d") for _ in self.metrics]
+        self._last_seen = array("d")
+        self._sweep_cursor = 0
+        self._lock = threading.Lock()
+        # Vehicles evicted under the lock, notified once it is released
+        self._evicted = []
+
+        self.evictions = 0
+
+    @classmethod
+    def from_config(cls, metrics, cfg, on_evict=None, on_miss=None, extra_bytes_per_vehicle=0):
+        """Builds a store from the 'state' section of the analyzer configuration."""
+        return cls(
+            metrics,
+            max_vehicles=cfg.get("max-vehicles", 100000),
+            max_memory_bytes=cfg.get("max-memory-bytes"),
+            ttl_s=cfg.get("idle-ttl-seconds"),
+            on_evict=on_evict,
+            on_miss=on_miss,
+            extra_bytes_per_vehicle=extra_bytes_per_vehicle,
+        )
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, vehicle_id):
+        return vehicle_id in self._slots
+
+    def memory_bytes(self):
+        """Approximate bytes held by the columns, the interning table and the other components' per-vehicle state."""
+        return (len(self._ids) * 8 * (len(self.metrics) + 1)
+                + len(self._slots) * (INTERN_OVERHEAD_BYTES + self.extra_bytes_per_vehicle))
+
+    # ------------------------------------------------------------------
+    # Reads
+    # ------------------------------------------------------------------
+    def get(self, vehicle_id, metric, default=None):
+        with self._lock:
+            slot = self._slots.get(vehicle_id)
+            if slot is None:
+                return default
+            v = self._columns[self._column_index[metric]][slot]
+        return default if v != v else v
+
+    def items(self, metric):
+        """Yields (vehicle_id, value) for every vehicle with metric set."""
+        with self._lock:
+            column = self._columns[self._column_index[metric]]
+            pairs = [(vid, column[slot]) for vid, slot in self._slots.items()]
+        return [(vid, v) for vid, v in pairs if v == v]
+
+    def to_dict(self, metric):
+        return dict(self.items(metric))
+
+    # ------------------------------------------------------------------
+    # Writes
+    # ------------------------------------------------------------------
+    def set(self, vehicle_id, metric, value, now=None):
+        with self._lock:
+            slot = self._touch(vehicle_id, time.time() if now is None else now)
+            self._columns[self._column_index[metric]][slot] = value
+        if self._evicted:
+            self._notify_evicted()
+
+    def update_max(self, vehicle_id, metric, value, now=None):
+        """Atomically raises metric to value if larger. Returns (previous or None, updated)."""
+        with self._lock:
+            slot = self._touch(vehicle_id, time.time() if now is None else now)
+            column = self._columns[self._column_index[metric]]
+            prev = column[slot]
+            if prev != prev:
+                column[slot] = value
+                result = None, True
+            elif value > prev:
+                column[slot] = value
+                result = prev, True
+            else:
+                result = prev, False
+        if self._evicted:
+            self._notify_evicted()
+        return result
+
+    def load(self, metric, values, now=None):
+        """Bulk-loads {vehicle_id: value} (e.g. from a checkpoint) into one metric column."""
+        now = time.time() if now is None else now
+        for vehicle_id, value in values.items():
+            self.set(vehicle_id, metric, float(value), now)
+
+    def discard(self, vehicle_id):
+        with self._lock:
+            slot = self._slots.get(vehicle_id)
+            if slot is not None:
+                self._release(slot)
+
+    def evict_idle(self, now=None):
+        """Full TTL sweep; returns the vehicle ids evicted."""
+        if not self.ttl_s:
+            return []
+        cutoff = (time.time() if now is None else now) - self.ttl_s
+        with self._lock:
+            victims = [slot for vid, slot in self._slots.items() if self._last_seen[slot] < cutoff]
+            evicted = [self._ids[slot] for slot in victims]
+            for slot in victims:
+                self._release(slot)
+        self._notify(evicted)
+        return evicted
+
+    # ------------------------------------------------------------------
+    # Internals (caller holds the lock)
+    # ------------------------------------------------------------------
+    def _touch(self, vehicle_id, now):
+        slot = self._slots.get(vehicle_id)
+        if slot is None:
+            slot = self._allocate(vehicle_id)
+        self._last_seen[slot] = now
+        if self.ttl_s:
+            self._sweep(now)
+        return slot
+
+    def _allocate(self, vehicle_id):
+        if len(self._slots) >= self.capacity:
+            self._evict_lru()
+        if self._free:
+            slot = self._free.pop()
+            self._ids[slot] = vehicle_id
+        else:
+            slot = len(self._ids)
+            self._ids.append(vehicle_id)
+            for column in self._columns:
+                column.append(NAN)
+            self._last_seen.append(-math.inf)
+        self._slots[vehicle_id] = slot
+        if self.on_miss:
+            self._seed(vehicle_id, slot)
+        return slot
+
+    def _seed(self, vehicle_id, slot):
+        try:
+            values = self.on_miss(vehicle_id)
+        except Exception as e:
+            log.error(f"on_miss failed for {vehicle_id}: {e}")
+            return
+        for metric, value in (values or {}).items():
+            index = self._column_index.get(metric)
+            if index is not None and value is not None:
+                self._columns[index][slot] = float(value)
+
+    def _evict_lru(self):
+        occupied = len(self._ids)
+        victim = None
+        for _ in range(LRU_SAMPLE_SIZE):
+            slot = random.randrange(occupied)
+            if self._ids[slot] is None:
+                continue
+            if victim is None or self._last_seen[slot] < self._last_seen[victim]:
+                victim = slot
+        if victim is None:
+            victim = next(iter(self._slots.values()))
+        self._evicted.append(self._ids[victim])
+        self._release(victim)
+
+    def _sweep(self, now):
+        cutoff = now - self.ttl_s
+        size = len(self._ids)
+        for _ in range(min(TTL_SWEEP_STEP, size)):
+            slot = self._sweep_cursor = (self._sweep_cursor + 1) % size
+            vehicle_id = self._ids[slot]
+            if vehicle_id is not None and self._last_seen[slot] < cutoff:
+                self._evicted.append(vehicle_id)
+                self._release(slot)
+
+    def _release(self, slot):
+        del self._slots[self._ids[slot]]
+        self._ids[slot] = None
+        for column in self._columns:
+            column[slot] = NAN
+        self._last_seen[slot] = -math.inf
+        self._free.append(slot)
+        self.evictions += 1
+
+    def _notify_evicted(self):
+        with self._lock:
+            evicted, self._evicted = self._evicted, []
+        self._notify(evicted)
+
+    def _notify(self, vehicle_ids):
+        if not self.on_evict:
+            return
+        for vehicle_id in vehicle_ids:
+            try:
+                self.on_evict(vehicle_id)
+            except Exception as e:
+                log.error(f"on_evict failed for {vehicle_id}: {e}")
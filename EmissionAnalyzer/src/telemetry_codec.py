@@ -0,0 +1,98 @@
+# Wire formats of the "message" field of telemetry envelopes:
+#
+#   single row : {"timestep_time": 0.0, "vehicle_id": "veh0", ...}
+#   batch      : {"format": "columnar-v1",
+#                 "columns": ["timestep_time", "vehicle_id", ...],
+#                 "rows": [[0.0, "veh0", ...], [1.0, "veh0", ...]]}
+#
+# The batch layout sends the column names once per message instead of once
+# per row. The emulator side lives in payload_encoder.py.
+
+COLUMNAR_FORMAT = "columnar-v1"
+
+
+def is_batch(message):
+    return isinstance(message, dict) and message.get("format") == COLUMNAR_FORMAT
+
+
+def check_batch(message):
+    """Raises ValueError unless a columnar batch has a column list and rows of exactly that many values."""
+    columns = message.get("columns")
+    rows = message.get("rows")
+    if not isinstance(columns, list):
+        raise ValueError(f"Columnar batch has no column list: {columns!r}")
+    if not isinstance(rows, list):
+        raise ValueError(f"Columnar batch has no row list: {rows!r}")
+    width = len(columns)
+    for i, values in enumerate(rows):
+        if not isinstance(values, (list, tuple)) or len(values) != width:
+            raise ValueError(f"Columnar batch row {i} does not have {width} values: {values!r}")
+
+
+def decode_rows(message):
+    """Expands a telemetry message into a list of row dicts.
+
+    Accepts a single row dict, a columnar batch, or a list of either (as the
+    Lambda runtime hands over batched events). Anything else is returned as a
+    one-element list so the caller can report it; a malformed batch raises
+    ValueError (see check_batch).
+    """
+    if isinstance(message, list):
+        rows = []
+        for item in message:
+            rows.extend(decode_rows(item))
+        return rows
+    if is_batch(message):
+        check_batch(message)
+        columns = message["columns"]
+        return [dict(zip(columns, values)) for values in message["rows"]]
+    return [message]
+
+
+def encode_columnar(rows, columns=None):
+    """Packs row dicts into a columnar batch (the inverse of decode_rows)."""
+    if columns is None:
+        columns = list(rows[0]) if rows else []
+    return {
+        "format": COLUMNAR_FORMAT,
+        "columns": list(columns),
+        "rows": [[row.get(c) for c in columns] for row in rows],
+    }
+
+
+def split_by_vehicle(message, key="vehicle_id"):
+    """Splits a message into [(vehicle_id, sub_message)] without decoding rows.
+
+    All rows of a vehicle go into one piece, in their original order, so
+    per-vehicle order is preserved when the pieces are dispatched separately
+    and each vehicle sees the batch's envelope fields (boot, seq, sent_at)
+    exactly once. Messages without a usable vehicle_id, and malformed
+    batches, are keyed "unknown" and left whole for decode_rows to reject.
+    """
+    if isinstance(message, list):
+        parts = []
+        for item in message:
+            parts.extend(split_by_vehicle(item, key))
+        return parts
+    if is_batch(message):
+        try:
+            check_batch(message)
+        except ValueError:
+            return [("unknown", message)]
+        columns = message["columns"]
+        if key not in columns:
+            return [("unknown", message)]
+        idx = columns.index(key)
+        envelope = {k: v for k, v in message.items() if k not in ("columns", "rows")}
+        # vehicle_id -> piece, in order of first appearance
+        parts = {}
+        for values in message["rows"]:
+            vehicle_id = str(values[idx])
+            part = parts.get(vehicle_id)
+            if part is None:
+                part = parts[vehicle_id] = dict(envelope, columns=columns, rows=[])
+            part["rows"].append(values)
+        return list(parts.items())
+    if isinstance(message, dict):
+        return [(str(message.get(key, "unknown")), message)]
+    return [("unknown", message)]
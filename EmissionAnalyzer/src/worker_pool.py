@@ -0,0 +1,106 @@
+import zlib
+import queue
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+BACKPRESSURE_POLICIES = ("block", "drop")
+
+_STOP = object()
+
+
+class ShardedWorkerPool:
+    """Runs handler(*args) on a pool of worker threads, sharded by key.
+
+    Every key (vehicle id) always maps to the same worker, so work for one
+    vehicle is processed in submission order while different vehicles run in
+    parallel. Each worker has a bounded queue; when it is full submit() either
+    blocks the caller for up to block_timeout_s (backpressure) or drops the item.
+    """
+
+    def __init__(self, handler, num_workers=4, queue_size=1000,
+                 backpressure="block", block_timeout_s=1.0):
+        if backpressure not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Unknown backpressure policy '{backpressure}', expected one of {BACKPRESSURE_POLICIES}")
+        self.handler = handler
+        self.num_workers = max(1, int(num_workers))
+        self.backpressure = backpressure
+        self.block_timeout_s = float(block_timeout_s)
+        self._queues = [queue.Queue(maxsize=int(queue_size)) for _ in range(self.num_workers)]
+        self._threads = []
+
+        self.submitted = 0
+        self.dropped = 0
+        # Per-worker counters so workers never contend on a shared one
+        self.processed = [0] * self.num_workers
+        self.failed = [0] * self.num_workers
+
+    @classmethod
+    def from_config(cls, handler, cfg):
+        """Builds a pool from the 'workers' section of the analyzer configuration."""
+        return cls(
+            handler,
+            num_workers=cfg.get("num-workers", 4),
+            queue_size=cfg.get("queue-size", 1000),
+            backpressure=cfg.get("backpressure", "block"),
+            block_timeout_s=cfg.get("block-timeout-seconds", 1.0),
+        )
+
+    def start(self):
+        if not self._threads:
+            for i, q in enumerate(self._queues):
+                t = threading.Thread(target=self._run, args=(i, q), name=f"emission-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+        return self
+
+    def shard(self, key):
+        # crc32 rather than hash(): stable across processes and restarts
+        return zlib.crc32(key.encode("utf-8")) % self.num_workers
+
+    def submit(self, key, *args):
+        """Enqueues work for key. Returns False if it was dropped."""
+        q = self._queues[self.shard(key)]
+        try:
+            if self.backpressure == "block":
+                q.put(args, timeout=self.block_timeout_s)
+            else:
+                q.put_nowait(args)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self.submitted += 1
+        return True
+
+    def queue_depths(self):
+        return [q.qsize() for q in self._queues]
+
+    def stats(self):
+        return {
+            "submitted": self.submitted,
+            "dropped": self.dropped,
+            "failed": sum(self.failed),
+            "processed": sum(self.processed),
+            "queue_depths": self.queue_depths(),
+        }
+
+    def close(self):
+        """Lets the workers drain their queues, then stops them."""
+        for q in self._queues:
+            q.put(_STOP)
+        for t in self._threads:
+            t.join()
+        self._threads = []
+
+    def _run(self, index, q):
+        while True:
+            args = q.get()
+            if args is _STOP:
+                return
+            try:
+                self.handler(*args)
+            except Exception as e:
+                self.failed[index] += 1
+                log.error(f"Worker {index} failed to process message: {e}", exc_info=True)
+            self.processed[index] += 1
@@ -0,0 +1,287 @@
+"""Offline backfill: recomputes the EmissionAnalyzer's results for historical traces.
+
+Runs the component's own EmissionHandler.process_message over CSV files
+instead of replaying them through MQTT in real time. Vehicles are
+partitioned across a process pool by the same crc32 shard function as the
+analyzer's worker pool. A file holding a single vehicle (like
+data/vehicle*.csv) is read only by the process owning that vehicle; files
+mixing vehicles are streamed by every process, each keeping its own
+vehicles. Inputs are read in chunks, so memory is bounded by the chunk size
+and the per-vehicle state.
+
+    python backfill.py "data/vehicle*.csv" --processes 8 --output backfill_out
+
+Per partition the output directory gets firehose.<k>.jsonl (the records the
+streaming path puts to Firehose, or they go to --firehose-stream) and
+vehicles.<k>.jsonl (final per-vehicle max, aggregates and quantiles), plus
+one fleet.json (merged leaderboards and fleet quantiles) and heatmap.json.
+
+Per-vehicle results and Firehose records equal the streaming path's apart
+from wall-clock timestamps. Fleet-wide heatmap sums can differ in the last
+bit, because rows of different vehicles are added in another order, and
+quantile sketches compact randomly.
+"""
+import os
+import sys
+import glob
+import json
+import time
+import zlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+ANALYZER_SRC = os.path.join(ROOT, "EmissionAnalyzer", "src")
+RECIPE_PATH = os.path.join(ROOT, "EmissionAnalyzer", "recipe.json")
+sys.path.insert(0, ANALYZER_SRC)
+
+import pandas as pd
+
+from local_pubsub import LocalMessageFormatter, LocalPubSubClient
+from sketches import KLLSketch, summarize, DEFAULT_K, DEFAULT_QUANTILES
+from heatmap import merge_snapshots
+
+TOPIC = "vehicle/emission/data"
+DEFAULT_CHUNK_ROWS = 50000
+
+
+def load_analyzer_config(path=None):
+    """AnalyzerConfig from a JSON file, or the recipe's default configuration."""
+    if path:
+        with open(path) as f:
+            return json.load(f)
+    with open(RECIPE_PATH) as f:
+        return json.load(f)["ComponentConfiguration"]["DefaultConfiguration"]["AnalyzerConfig"]
+
+
+def backfill_config(analyzer_config):
+    """The analyzer configuration with everything tied to a live deployment turned off.
+
+    Processing runs inline (one process is one shard), nothing is checkpointed
+    or served, and per-row aggregate publishes are replaced by the final
+    per-vehicle snapshot in vehicles.<k>.jsonl. The state store is unbounded:
+    an evicted vehicle would drop out of the results without a trace.
+    """
+    cfg = json.loads(json.dumps(analyzer_config))
+    cfg["workers"] = dict(cfg.get("workers", {}), **{"num-workers": 0})
+    cfg["state"] = dict(cfg.get("state", {}), **{
+        "max-vehicles": sys.maxsize, "max-memory-bytes": None, "idle-ttl-seconds": None,
+    })
+    cfg["checkpoint"] = dict(cfg.get("checkpoint", {}), enabled=False)
+    cfg["logging"] = dict(cfg.get("logging", {}), level="WARNING")
+    cfg["aggregation"] = dict(cfg.get("aggregation", {}), **{"publish-topic-format": None})
+    return cfg
+
+
+def partition_of(vehicle_id, partitions):
+    # Same as ShardedWorkerPool.shard()
+    return zlib.crc32(vehicle_id.encode("utf-8")) % partitions
+
+
+def file_owners(paths, partitions, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """{path: partition} for the files whose rows all belong to one vehicle.
+
+    Only the vehicle_id column is parsed, once, in the parent process.
+    """
+    owners = {}
+    for path in paths:
+        try:
+            reader = pd.read_csv(path, usecols=["vehicle_id"], chunksize=chunk_rows)
+        except ValueError:
+            # No vehicle_id column: every row is reported as "unknown"
+            owners[path] = partition_of("unknown", partitions)
+            continue
+        ids = set()
+        for chunk in reader:
+            ids.update(chunk["vehicle_id"].astype(str).unique())
+            if len(ids) > 1:
+                break
+        if len(ids) == 1:
+            owners[path] = partition_of(ids.pop(), partitions)
+    return owners
+
+
+def read_partition(paths, index, partitions, chunk_rows=DEFAULT_CHUNK_ROWS, owners=None):
+    """Yields lists of row dicts of the vehicles in partition index, chunk by chunk, in file order.
+
+    Files in owners (see file_owners) are read only by their partition and
+    need no filtering. Rows go through pandas like the emulator's trace
+    loader, so values are parsed exactly as the streaming path receives them.
+    """
+    owners = owners or {}
+    shards = {}
+    for path in paths:
+        if path in owners:
+            if owners[path] == index:
+                for chunk in pd.read_csv(path, chunksize=chunk_rows):
+                    yield chunk.to_dict("records")
+            continue
+        for chunk in pd.read_csv(path, chunksize=chunk_rows):
+            if "vehicle_id" in chunk.columns:
+                ids = chunk["vehicle_id"].astype(str)
+            else:
+                ids = pd.Series("unknown", index=chunk.index)
+            for vid in ids.unique():
+                if vid not in shards:
+                    shards[vid] = partition_of(vid, partitions)
+            mine = chunk[ids.map(shards).to_numpy() == index]
+            if len(mine):
+                yield mine.to_dict("records")
+
+
+class JsonLinesSink:
+    """Stands in for FirehoseSink (put/close) and appends each record to a JSON-lines file."""
+
+    def __init__(self, path):
+        self._file = open(path, "w")
+        self.records_sent = 0
+
+    def put(self, record):
+        self._file.write(json.dumps(record) + "\n")
+        self.records_sent += 1
+        return True
+
+    def depth(self):
+        return 0
+
+    def close(self):
+        self._file.close()
+
+
+def open_firehose_sink(stream_name, firehose_config):
+    import boto3
+    from firehose_sink import FirehoseSink
+    client = boto3.client("firehose", region_name=os.environ.get("AWS_REGION", "us-east-2"))
+    # A backfill would rather wait for Firehose than drop records
+    cfg = dict(firehose_config, **{"overflow-policy": "block"})
+    return FirehoseSink.from_config(client, stream_name, cfg).start()
+
+
+def run_partition(index, partitions, paths, analyzer_config, output_dir,
+                  chunk_rows=DEFAULT_CHUNK_ROWS, firehose_stream=None, owners=None):
+    """Processes one vehicle partition in this (fresh) process; returns its summary."""
+    sys.argv = [os.path.join(ANALYZER_SRC, "main.py"), json.dumps({}), json.dumps(analyzer_config)]
+    import main
+
+    if firehose_stream:
+        sink = open_firehose_sink(firehose_stream, analyzer_config.get("firehose", {}))
+    else:
+        sink = JsonLinesSink(os.path.join(output_dir, "firehose.{}.jsonl".format(index)))
+    main.FIREHOSE_SINK = sink
+
+    handler = main.EmissionHandler(LocalPubSubClient(), LocalMessageFormatter())
+    rows = 0
+    for records in read_partition(paths, index, partitions, chunk_rows, owners):
+        handler.process_message("ipc_mqtt", TOPIC, None, 200, None, records)
+        rows += len(records)
+        if main.HEATMAP is not None:
+            # Applies the chunk's buffered rows so the buffers stay chunk-sized
+            main.HEATMAP.flush()
+    if main.ORDERING is not None:
+        handler.release_held(main.ORDERING.held_vehicles())
+    handler.results.close()
+    sink.close()
+
+    with open(os.path.join(output_dir, "vehicles.{}.jsonl".format(index)), "w") as f:
+        for vehicle_id in sorted(main.AGGREGATOR.state):
+            f.write(json.dumps({
+                "vehicle_id": vehicle_id,
+                main.MAX_CO2_METRIC: main.MAX_CO2_STATE.get(vehicle_id, main.MAX_CO2_METRIC),
+                "aggregates": main.AGGREGATOR.snapshot(vehicle_id),
+                "quantiles": main.QUANTILES.vehicle_quantiles(vehicle_id) if main.QUANTILES is not None else None,
+            }) + "\n")
+
+    return {
+        "partition": index,
+        "rows": rows,
+        "vehicles": len(main.AGGREGATOR),
+        "evicted": main.MAX_CO2_STATE.evictions,
+        "firehose_records": sink.records_sent,
+        "errors": main.PROCESSING_ERRORS.value(),
+        # Partitions hold disjoint vehicles, so the fleet top K is among the partitions' top K
+        "leaderboards": {name: board.top() for name, board in main.LEADERBOARDS.boards.items()},
+        "fleet_sketches": main.QUANTILES.fleet_sketches() if main.QUANTILES is not None else None,
+        "heatmap": main.HEATMAP.snapshot() if main.HEATMAP is not None else None,
+    }
+
+
+def merge_leaderboards(parts, k):
+    merged = {}
+    for name in parts[0]["leaderboards"]:
+        entries = sorted(
+            (e for p in parts for e in p["leaderboards"][name]),
+            key=lambda e: (-e["value"], e["vehicle_id"]),
+        )[:k]
+        merged[name] = [dict(e, rank=rank) for rank, e in enumerate(entries, 1)]
+    return merged
+
+
+def merge_fleet_quantiles(parts, quantiles_config):
+    if parts[0]["fleet_sketches"] is None:
+        return None
+    metrics = quantiles_config.get("metrics") or ["vehicle_CO2"]
+    merged = [KLLSketch(quantiles_config.get("k", DEFAULT_K)) for _ in metrics]
+    for p in parts:
+        for m, sketch in zip(merged, p["fleet_sketches"]):
+            m.merge(sketch)
+    return summarize(metrics, merged, quantiles_config.get("quantiles", DEFAULT_QUANTILES))
+
+
+def run(args):
+    paths = sorted({p for pattern in args.inputs for p in glob.glob(pattern)})
+    if not paths:
+        raise SystemExit("No input files matched {}".format(args.inputs))
+    analyzer_config = backfill_config(load_analyzer_config(args.config))
+    os.makedirs(args.output, exist_ok=True)
+
+    start = time.perf_counter()
+    owners = file_owners(paths, args.processes, args.chunk_rows)
+    # One fresh process per partition: main.py keeps its state in module globals
+    with ProcessPoolExecutor(max_workers=args.processes, max_tasks_per_child=1) as pool:
+        futures = [
+            pool.submit(run_partition, k, args.processes, paths, analyzer_config, args.output,
+                        args.chunk_rows, args.firehose_stream, owners)
+            for k in range(args.processes)
+        ]
+        parts = [f.result() for f in futures]
+    elapsed = time.perf_counter() - start
+
+    fleet = {
+        "leaderboards": merge_leaderboards(parts, analyzer_config.get("leaderboard", {}).get("k", 10)),
+        "quantiles": merge_fleet_quantiles(parts, analyzer_config.get("quantiles", {})),
+    }
+    with open(os.path.join(args.output, "fleet.json"), "w") as f:
+        json.dump(fleet, f, indent=1)
+    if parts[0]["heatmap"] is not None:
+        with open(os.path.join(args.output, "heatmap.json"), "w") as f:
+            json.dump(merge_snapshots([p["heatmap"] for p in parts]), f)
+
+    rows = sum(p["rows"] for p in parts)
+    return {
+        "inputs": len(paths),
+        "single_vehicle_inputs": len(owners),
+        "processes": args.processes,
+        "rows": rows,
+        "vehicles": sum(p["vehicles"] for p in parts),
+        "evicted": sum(p["evicted"] for p in parts),
+        "firehose_records": sum(p["firehose_records"] for p in parts),
+        "errors": sum(p["errors"] for p in parts),
+        "elapsed_s": round(elapsed, 3),
+        "rows_per_s": round(rows / elapsed, 1) if elapsed else None,
+        "output": args.output,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="+", help="CSV files or globs (e.g. 'data/vehicle*.csv')")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="vehicle partitions / worker processes")
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS, help="rows read per chunk")
+    parser.add_argument("--output", default="backfill_out", help="directory for the result files")
+    parser.add_argument("--config", help="AnalyzerConfig JSON file (default: the recipe's default configuration)")
+    parser.add_argument("--firehose-stream", help="send records to this Firehose stream instead of firehose.<k>.jsonl")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(parse_args())))
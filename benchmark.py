@@ -0,0 +1,177 @@
+"""End-to-end throughput/latency benchmark for the EmissionAnalyzer hot path.
+
+Replays data/vehicle*.csv, scaled synthetically to N vehicles, through the
+emulator's payload encoding and an in-process stand-in for the Greengrass
+PubSub client into EmissionHandler. No AWS resources are needed.
+
+    python benchmark.py --vehicles 500 --rate 5000 --output bench_results.jsonl
+
+Each run prints (and optionally appends) one JSON line tagged with the git
+commit, so results can be compared across commits.
+"""
+import os
+import sys
+import json
+import glob
+import time
+import argparse
+import resource
+import subprocess
+import threading
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+ANALYZER_SRC = os.path.join(ROOT, "EmissionAnalyzer", "src")
+RECIPE_PATH = os.path.join(ROOT, "EmissionAnalyzer", "recipe.json")
+
+from payload_encoder import EncodedTrace, TIME_COLUMN
+from publish_scheduler import TokenBucket
+from trace_cache import load_trace
+from local_pubsub import LocalBroker, LocalMessageFormatter, LocalPubSubClient
+
+TOPIC = "vehicle/emission/data"
+
+
+def build_fleet(n_vehicles, batch_size, data_glob):
+    """Encodes one trace per synthetic vehicle; vehicle k replays source trace k % len(sources)."""
+    sources = [load_trace(p).records() for p in sorted(glob.glob(data_glob))]
+    if not sources:
+        raise SystemExit("No traces matched {}".format(data_glob))
+    fleet = []
+    for k in range(n_vehicles):
+        vehicle_id = "veh{}".format(k)
+        records = [dict(rec, vehicle_id=vehicle_id) for rec in sources[k % len(sources)]]
+        timesteps = [rec[TIME_COLUMN] for rec in records]
+        fleet.append(EncodedTrace(TOPIC, records, timesteps, batch_size))
+    return fleet
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark_config(workers, publish_interval):
+    """The recipe's default AnalyzerConfig with only what ties it to a live deployment overridden.
+
+    Every per-row feature stays as deployed; the benchmark sets the worker
+    and coalescing parameters under test, and turns off checkpointing, the
+    metrics endpoint and INFO logging. Firehose is not initialized.
+    """
+    with open(RECIPE_PATH) as f:
+        cfg = json.load(f)["ComponentConfiguration"]["DefaultConfiguration"]["AnalyzerConfig"]
+    cfg["workers"] = dict(cfg.get("workers", {}), **{"num-workers": workers, "queue-size": 10000, "backpressure": "block"})
+    cfg["publish"] = dict(cfg.get("publish", {}), **{"min-interval-seconds": publish_interval})
+    cfg["checkpoint"] = dict(cfg.get("checkpoint", {}), enabled=False)
+    cfg["metrics"] = dict(cfg.get("metrics", {}), **{"http-port": None})
+    cfg["logging"] = dict(cfg.get("logging", {}), level="WARNING")
+    return cfg
+
+
+def load_analyzer(workers, publish_interval):
+    """Imports the component module with the benchmark configuration."""
+    analyzer_config = benchmark_config(workers, publish_interval)
+    sys.path.insert(0, ANALYZER_SRC)
+    sys.argv = [os.path.join(ANALYZER_SRC, "main.py"), json.dumps({}), json.dumps(analyzer_config)]
+    import main
+    return main
+
+
+def run(args):
+    fleet = build_fleet(args.vehicles, args.batch_size, args.data)
+    main = load_analyzer(args.workers, args.publish_interval)
+
+    sent_at = {}
+    latencies = []
+    lat_lock = threading.Lock()
+
+    class TimedHandler(main.EmissionHandler):
+        def process_message(self, protocol, topic, message_id, status, route, message):
+            super().process_message(protocol, topic, message_id, status, route, message)
+            done = time.perf_counter()
+            with lat_lock:
+                latencies.append(done - sent_at[message_id])
+
+    results = LocalPubSubClient()
+    handler = TimedHandler(results, LocalMessageFormatter())
+    handler.results.start()
+    if handler.pool:
+        handler.pool.start()
+    broker = LocalBroker(handler.on_message)
+
+    # Round-robin over vehicles so rows of the whole fleet interleave as they would live
+    longest = max(len(t) for t in fleet)
+    schedule = [(trace, i) for i in range(longest) for trace in fleet if i < len(trace)]
+    bucket = TokenBucket(args.rate, burst=max(1, args.rate // 100)) if args.rate else None
+
+    usage_before = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    for seq, (trace, i) in enumerate(schedule):
+        if bucket:
+            bucket.acquire()
+        message_id = str(seq)
+        payload = trace.payload(i, message_id)
+        sent_at[message_id] = time.perf_counter()
+        broker.publish(TOPIC, payload)
+    if handler.pool:
+        handler.pool.close()
+    elapsed = time.perf_counter() - start
+    handler.results.close()
+    usage_after = resource.getrusage(resource.RUSAGE_SELF)
+
+    cpu = (usage_after.ru_utime - usage_before.ru_utime) + (usage_after.ru_stime - usage_before.ru_stime)
+    rows = sum(t.rows for t in fleet)
+    latencies.sort()
+    return {
+        "commit": git_commit(),
+        "timestamp": int(time.time()),
+        "params": {
+            "vehicles": args.vehicles,
+            "rate": args.rate,
+            "batch_size": args.batch_size,
+            "workers": args.workers,
+            "publish_interval": args.publish_interval,
+        },
+        "messages": len(schedule),
+        "rows": rows,
+        "elapsed_s": round(elapsed, 3),
+        "messages_per_s": round(len(schedule) / elapsed, 1),
+        "rows_per_s": round(rows / elapsed, 1),
+        "latency_p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "latency_p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "cpu_s": round(cpu, 3),
+        "cpu_utilization": round(cpu / elapsed, 3),
+        # ru_maxrss is reported in kilobytes on Linux
+        "peak_rss_mb": round(usage_after.ru_maxrss / 1024, 1),
+        "results_published": results.published,
+        "errors": results.errors,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vehicles", type=int, default=50, help="synthetic vehicles to replay")
+    parser.add_argument("--rate", type=int, default=0, help="offered messages/s (0 = as fast as possible)")
+    parser.add_argument("--batch-size", type=int, default=1, help="rows per message")
+    parser.add_argument("--workers", type=int, default=4, help="analyzer worker threads (0 = inline)")
+    parser.add_argument("--publish-interval", type=float, default=1.0, help="result coalescing interval (s)")
+    parser.add_argument("--data", default=os.path.join(ROOT, "data", "vehicle*.csv"), help="glob of source traces")
+    parser.add_argument("--output", help="append the result as a JSON line to this file")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    result = run(args)
+    line = json.dumps(result)
+    print(line)
+    if args.output:
+        with open(args.output, "a") as f:
+            f.write(line + "\n")
@@ -0,0 +1,79 @@
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ConnectReport:
+    """Outcome of bringing up a fleet: connected clients, failures and connect latencies."""
+
+    def __init__(self):
+        self.clients = {}       # device_id -> connected client
+        self.failures = {}      # device_id -> last exception
+        self.latencies = {}     # device_id -> seconds spent in the successful attempt
+        self.attempts = {}      # device_id -> attempts used
+        self.elapsed = 0.0
+
+    def connected(self):
+        """Connected clients in device id order."""
+        return [self.clients[d] for d in sorted(self.clients)]
+
+    def summary(self):
+        lat = sorted(self.latencies.values())
+        lines = ["Connected {}/{} devices in {:.1f}s".format(
+            len(self.clients), len(self.clients) + len(self.failures), self.elapsed)]
+        if lat:
+            lines.append("Connect latency: min {:.2f}s  p50 {:.2f}s  p99 {:.2f}s  max {:.2f}s".format(
+                lat[0], lat[len(lat) // 2], lat[min(len(lat) - 1, int(len(lat) * 0.99))], lat[-1]))
+        for device_id in sorted(self.failures):
+            lines.append("  FAILED device {} after {} attempts: {}".format(
+                device_id, self.attempts[device_id], self.failures[device_id]))
+        return "\n".join(lines)
+
+
+def connect_fleet(device_ids, connect_fn, max_concurrency=32, max_attempts=3,
+                  base_backoff_s=0.5, max_backoff_s=10.0, stagger_s=1.0, progress=None):
+    """Runs connect_fn(device_id) for every device concurrently.
+
+    connect_fn must create, connect and subscribe one client and return it,
+    raising on failure after disconnecting the client it created (a retry
+    reuses the client ID, and the broker drops the older connection). At most max_concurrency connects run at once; each
+    device first waits a random 0..stagger_s so connects don't arrive in
+    lockstep, and failed attempts are retried with full-jitter exponential
+    backoff. A device that still fails is reported, not raised, so the rest of
+    the fleet comes up. progress(device_id, ok) is called after each device.
+    """
+    report = ConnectReport()
+    lock = threading.Lock()
+
+    def bring_up(device_id):
+        if stagger_s:
+            time.sleep(random.uniform(0, stagger_s))
+        error = None
+        for attempt in range(1, max_attempts + 1):
+            start = time.monotonic()
+            try:
+                client = connect_fn(device_id)
+            except Exception as e:
+                error = e
+                if attempt < max_attempts:
+                    time.sleep(random.uniform(0, min(max_backoff_s, base_backoff_s * 2 ** (attempt - 1))))
+                continue
+            with lock:
+                report.clients[device_id] = client
+                report.latencies[device_id] = time.monotonic() - start
+                report.attempts[device_id] = attempt
+            if progress:
+                progress(device_id, True)
+            return
+        with lock:
+            report.failures[device_id] = error
+            report.attempts[device_id] = max_attempts
+        if progress:
+            progress(device_id, False)
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="connector") as pool:
+        list(pool.map(bring_up, device_ids))
+    report.elapsed = time.monotonic() - start
+    return report
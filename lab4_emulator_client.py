@@ -1,10 +1,13 @@
 # Import SDK packages
 from AWSIoTPythonSDK.MQTTLib import AWSIoTMQTTClient
+import os
 import time
-import json
-import pandas as pd
-import numpy as np
 import sys
+from payload_encoder import load_encoded
+from publish_scheduler import PublishScheduler, fixed_interval_pacer
+from connection_manager import connect_fleet
+from trace_cache import load_trace
+from result_collector import ResultCollector
 
 
 #TODO 1: modify the following parameters
@@ -20,12 +23,34 @@ data_path = "data/vehicle{}.csv"
 certificate_formatter = "thing-private/MyThing-{}-certificate.pem.crt"
 key_formatter = "thing-private/MyThing-{}-private.pem.key"
 
+#Send schedule: all devices publish concurrently
+send_rate = None        # target aggregate messages/second across all devices (None = 5 ms per device row)
+replay_mode = False     # space each vehicle's rows by its timestep_time deltas
+replay_speedup = 1.0    # replay time compression factor (10.0 = 10x faster than simulated time)
+batch_size = 1          # rows per MQTT message; >1 sends columnar batches (column names sent once)
+
+#Fleet startup: connections are opened concurrently
+connect_concurrency = 32    # max connects in flight
+connect_attempts = 3        # attempts per device before giving up on it
+connect_stagger = 1.0       # random 0..N s delay before each device's first connect
+
+#Result tracking: round-trip latency and loss are summarized instead of printing every result
+results_summary_interval = 10   # seconds between result summaries
+results_late_after = 5.0        # round trips slower than this (s) count as late
+print_results = False           # also print every result message (slow with many devices)
+
+results = ResultCollector(late_after_s=results_late_after)
+
 
 class MQTTClient:
     def __init__(self, device_id, cert, key):
         # For certificate based connection
         self.device_id = str(device_id)
         self.state = 0
+        # Per-device telemetry sequence number, echoed back by the analyzer with the send time.
+        # The boot nonce tells the analyzer's dedupe a restarted emulator from a redelivery.
+        self.seq = 0
+        self.boot = os.urandom(4).hex()
         self.client = AWSIoTMQTTClient(self.device_id)
         
         # The unique topic this device will listen for results on
@@ -49,6 +74,9 @@ class MQTTClient:
         
         # Enhanced message output for debugging
         if "vehicle/results" in topic:
+            results.record(self.device_id, payload)
+            if not print_results:
+                return
             print("\n=======================================================")
             print("RESULT RECEIVED! (Client: {})".format(self.device_id))
             print("Topic: {}".format(topic))
@@ -70,35 +98,28 @@ class MQTTClient:
         pass
 
 
-    def publish(self, topic="vehicle/emission/data"):
-    # Load the vehicle's emission data
+    def publish(self, topic="vehicle/emission/data", pace=None):
+    # Load the vehicle's emission data, pre-encoded once and cached across send cycles
         try:
-            # Load data from the device-specific file path
-            df = pd.read_csv(data_path.format(self.device_id))
+            trace = load_encoded(data_path.format(self.device_id), topic, batch_size)
         except FileNotFoundError:
             print(f"ERROR: Data file not found for device {self.device_id} at {data_path.format(self.device_id)}", file=sys.stderr)
-            return
+            return 0
         
-        for index, row in df.iterrows():
-            raw_data = row.to_dict()
-            msg_id = str(int(time.time() * 1000)) 
-            
-            formatted_message_dict = {
-                "sdk_version": "0.1.4", 
-                "message_id": msg_id,
-                "status": 200,      
-                "route": topic,  
-                "message": raw_data   
-            }
-
-            payload = json.dumps(formatted_message_dict)
+        # pace(i, trace) blocks until message i may be sent (see publish_scheduler)
+        pace = pace or fixed_interval_pacer()
+        for i in range(len(trace)):
+            pace(i, trace)
+            now = time.time()
+            self.seq += 1
+            # Unique per device and run, unlike wall-clock milliseconds
+            msg_id = "{}-{}-{}".format(self.device_id, self.boot, self.seq)
             
-            # Publish the structured payload
-            print(f"Publishing: {payload} to {topic}")
-            self.client.publish(topic, payload, 1)
-            
-            # Sleep to simulate real-time data publishing
-            time.sleep(0.005)
+            # Only message_id, boot, seq and sent_at are stamped here; the rest of the payload is ready-made bytes
+            self.client.publish(topic, trace.payload(i, msg_id, self.seq, now, self.boot), 1)
+
+        print(f"Client {self.device_id} published {trace.rows} rows in {len(trace)} messages to {topic}")
+        return len(trace)
 
             
             
@@ -111,16 +132,12 @@ print("Loading vehicle data...")
 data = []
 for i in range(5):
     try:
-        a = pd.read_csv(data_path.format(i))
+        a = load_trace(data_path.format(i)).to_frame()
         data.append(a)
     except FileNotFoundError:
         print(f"Warning: Could not load data/vehicle{i}.csv")
 
-print("Initializing MQTTClients...")
-clients = []
-for device_id in range(device_st, device_end):
-    print("CLIENT ", device_id, end=" ")
-    
+def bring_up_client(device_id):
     # 1. Initialize the client (connect() is NOT called in __init__)
     client = MQTTClient(
         device_id,
@@ -128,22 +145,45 @@ for device_id in range(device_st, device_end):
         key_formatter.format(device_id)
     )
     
-    # 2. Connect the client
-    client.client.connect() 
-    
-    # 3. Subscribe the client to its unique results topic
-    print("Subscribing to results topic: {}".format(client.results_topic))
-    # QoS 1 ensures reliable delivery of results
-    client.client.subscribe(client.results_topic, 1, client.customSubackCallback)
-    
-    clients.append(client)
-    if device_id % 30 == 0:
-        time.sleep(1) # small pause to ease network load
-    else:
-        sys.stdout.write(".")
-        sys.stdout.flush()
+    try:
+        # 2. Connect the client
+        if not client.client.connect():
+            raise RuntimeError("connect() returned False")
+
+        # 3. Subscribe the client to its unique results topic
+        # QoS 1 ensures reliable delivery of results
+        client.client.subscribe(client.results_topic, 1, client.customSubackCallback)
+    except Exception:
+        # The retry reuses this client ID: a half-connected client (or a connect that
+        # completes late) would keep knocking the new one off the broker
+        try:
+            client.client.disconnect()
+        except Exception:
+            pass
+        raise
+    return client
 
-print("\n--- All clients initialized and subscribed. Ready to send data. ---")
+
+def show_progress(device_id, ok):
+    sys.stdout.write("." if ok else "x")
+    sys.stdout.flush()
+
+
+print("Initializing MQTTClients...")
+report = connect_fleet(
+    range(device_st, device_end),
+    bring_up_client,
+    max_concurrency=connect_concurrency,
+    max_attempts=connect_attempts,
+    stagger_s=connect_stagger,
+    progress=show_progress,
+)
+clients = report.connected()
+
+print()
+print(report.summary())
+print("\n--- {} clients initialized and subscribed. Ready to send data. ---".format(len(clients)))
+results.start(results_summary_interval)
 
 while True:
     print("send now? (s: send data, d: disconnect and exit)")
@@ -151,13 +191,16 @@ while True:
     
     if x == "s":
         print("Starting data publication for all clients...")
-        for i,c in enumerate(clients):
-            c.publish()
-        print("--- All clients finished publishing data for this cycle. ---")
+        scheduler = PublishScheduler(clients, rate=send_rate, replay=replay_mode, speedup=replay_speedup)
+        sent, elapsed = scheduler.run()
+        print("--- All clients finished publishing data for this cycle: {} messages in {:.1f}s ({:.0f} msg/s). ---".format(
+            sent, elapsed, sent / elapsed if elapsed else 0))
 
     elif x == "d":
         for c in clients:
             c.client.disconnect()
+        results.close()
+        print(results.summary(reset=False))
         print("All devices disconnected")
         exit()
     else:
@@ -0,0 +1,62 @@
+import json
+import time
+import threading
+
+# In-process stand-in for the Greengrass PubSub SDK pieces EmissionHandler
+# touches, so the analyzer can be driven without AWS (benchmarks, backfills).
+
+SDK_VERSION = "0.1.4"
+
+
+class LocalMessageFormatter:
+    """Builds the same envelope as awsgreengrasspubsubsdk's PubSubMessageFormatter."""
+
+    def get_message(self, message_id=None, status=200, route="", message=None):
+        return {
+            "sdk_version": SDK_VERSION,
+            "message_id": message_id if message_id is not None else str(int(time.time() * 1000)),
+            "status": status,
+            "route": route,
+            "message": message if message is not None else {},
+        }
+
+
+class LocalPubSubClient:
+    """Collects what the analyzer publishes; on_publish(topic, message) is called for each result."""
+
+    def __init__(self, on_publish=None):
+        self.on_publish = on_publish
+        self.published = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def publish_message(self, protocol, topic, message):
+        with self._lock:
+            self.published += 1
+        if self.on_publish:
+            self.on_publish(topic, message)
+
+    def publish_error(self, protocol, err):
+        with self._lock:
+            self.errors += 1
+
+
+class LocalBroker:
+    """Delivers emulator payload bytes to a handler the way the SDK does.
+
+    publish() decodes the JSON envelope and invokes
+    on_message(protocol, topic, message_id, status, route, message) inline on
+    the calling thread, like the SDK's subscription callback.
+    """
+
+    def __init__(self, on_message, protocol="ipc_mqtt"):
+        self.on_message = on_message
+        self.protocol = protocol
+
+    def publish(self, topic, payload, qos=1):
+        envelope = json.loads(payload)
+        self.on_message(
+            self.protocol, topic,
+            envelope.get("message_id"), envelope.get("status"), envelope.get("route"),
+            envelope.get("message"),
+        )
@@ -0,0 +1,91 @@
+import os
+import json
+from trace_cache import load_trace
+
+# Envelope expected by the EmissionAnalyzer's PubSub SDK
+SDK_VERSION = "0.1.4"
+
+TIME_COLUMN = "timestep_time"
+
+# Multi-row message layout, decoded by EmissionAnalyzer/src/telemetry_codec.py
+COLUMNAR_FORMAT = "columnar-v1"
+
+# (csv path, mtime, topic, batch size) -> EncodedTrace
+_CACHE = {}
+
+
+class EncodedTrace:
+    """A vehicle trace pre-encoded into ready-to-send MQTT payloads.
+
+    Every message is split around the message_id field and the opening brace
+    of its "message" object, so stamping a message is a single bytes
+    concatenation: prefix + message_id + middle [+ boot/seq/sent_at fields] + bodies[i].
+    With batch_size > 1 each message carries up to batch_size rows in the
+    columnar layout instead of one row.
+    """
+
+    __slots__ = ("topic", "prefix", "middle", "bodies", "timesteps", "rows")
+
+    def __init__(self, topic, records, timesteps=None, batch_size=1):
+        self.topic = topic
+        self.rows = len(records)
+        head = json.dumps({"sdk_version": SDK_VERSION, "message_id": ""})
+        # Everything up to (and including) the opening quote of message_id
+        self.prefix = head[:-2].encode("utf-8")
+        route = json.dumps(topic)
+        if batch_size > 1:
+            messages = [_columnar(records[i:i + batch_size]) for i in range(0, len(records), batch_size)]
+            # Simulation time of each message's first row, used for faithful replay pacing
+            self.timesteps = timesteps[::batch_size] if timesteps is not None else None
+        else:
+            messages = records
+            self.timesteps = timesteps
+        self.middle = '", "status": 200, "route": {}, "message": {{'.format(route).encode("utf-8")
+        # Each message object without its opening brace, plus the envelope's closing brace
+        self.bodies = [(json.dumps(msg)[1:] + "}").encode("utf-8") for msg in messages]
+
+    def __len__(self):
+        return len(self.bodies)
+
+    def payload(self, i, message_id, seq=None, sent_at=None, boot=None):
+        """Payload of message i; seq/sent_at (epoch seconds) and the sender's boot nonce are
+        stamped into the message when given."""
+        head = self.prefix + message_id.encode("utf-8") + self.middle
+        if seq is None:
+            return head + self.bodies[i]
+        if boot is not None:
+            head += b'"boot": "%s", ' % boot.encode("ascii")
+        return head + b'"seq": %d, "sent_at": %.6f, ' % (seq, sent_at) + self.bodies[i]
+
+
+def _columnar(records):
+    columns = list(records[0])
+    return {
+        "format": COLUMNAR_FORMAT,
+        "columns": columns,
+        "rows": [[rec[c] for c in columns] for rec in records],
+    }
+
+
+def encode_frame(df, topic, batch_size=1):
+    """Encodes a whole DataFrame in one pass (to_dict('records') yields native Python values)."""
+    timesteps = df[TIME_COLUMN].astype(float).tolist() if TIME_COLUMN in df.columns else None
+    return EncodedTrace(topic, df.to_dict("records"), timesteps, batch_size)
+
+
+def encode_trace(trace, topic, batch_size=1):
+    """Encodes a columnar-cache Trace without going through pandas."""
+    timesteps = trace.column(TIME_COLUMN) if TIME_COLUMN in trace.columns else None
+    return EncodedTrace(topic, trace.records(), timesteps, batch_size)
+
+
+def load_encoded(path, topic, batch_size=1):
+    """Returns the cached EncodedTrace for a CSV, re-encoding it only when the file changed."""
+    mtime = os.path.getmtime(path)
+    key = (path, mtime, topic, batch_size)
+    trace = _CACHE.get(key)
+    if trace is None:
+        for old in [k for k in _CACHE if k[0] == path and k[2] == topic and k[3] == batch_size]:
+            del _CACHE[old]
+        trace = _CACHE[key] = encode_trace(load_trace(path), topic, batch_size)
+    return trace
@@ -1,9 +1,17 @@
 import json
 import logging
+import os
 import sys
 import greengrasssdk
 import time
 
+# Shared analyzer building blocks live next to the Greengrass v2 component
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "EmissionAnalyzer", "src"))
+from result_coalescer import ResultCoalescer
+from checkpoint import StateCheckpointer
+from state_store import VehicleStateStore
+from batch_engine import max_by_vehicle, merge_max
+
 # --- Configuration and State ---
 # Logging setup
 logger = logging.getLogger(__name__)
@@ -15,61 +23,80 @@ logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
 client = greengrasssdk.client("iot-data")
 
 # Global state to track the maximum CO2 value seen for each vehicle ID.
-# This persists across multiple Lambda invocations as long as the Lambda container stays active.
-MAX_CO2_STATE = {}
+# It lives in memory across invocations in a bounded store (idle vehicles are
+# evicted) and is checkpointed to local disk (snapshot + update log) so a
+# redeployed container starts from the last state.
+#
+# A containerized Greengrass v1 Lambda loses /tmp on every redeploy, so the
+# checkpoint only survives one when EMISSION_STATE_DIR is the destination path
+# of a local volume resource attached to this function with read-write access
+# (e.g. source /greengrass/emission_state, destination /emission_state).
+STATE_DIR = os.environ.get("EMISSION_STATE_DIR")
+if not STATE_DIR:
+    STATE_DIR = "/tmp/emission_state"
+    logger.warning("EMISSION_STATE_DIR is not set; checkpointing to {}, which a redeploy wipes".format(STATE_DIR))
+STATE_CHECKPOINTER = StateCheckpointer(
+    STATE_DIR,
+    snapshot_interval_s=float(os.environ.get("STATE_SNAPSHOT_INTERVAL_SECONDS", "60")),
+)
+MAX_CO2_METRIC = "max_CO2"
+MAX_CO2_STATE = VehicleStateStore(
+    [MAX_CO2_METRIC],
+    max_vehicles=int(os.environ.get("STATE_MAX_VEHICLES", "100000")),
+    ttl_s=float(os.environ.get("STATE_IDLE_TTL_SECONDS", "3600")),
+    # Eviction only frees memory; a returning vehicle resumes from its checkpointed max
+    on_miss=lambda vehicle_id: {MAX_CO2_METRIC: STATE_CHECKPOINTER.get(vehicle_id)},
+)
+MAX_CO2_STATE.load(MAX_CO2_METRIC, STATE_CHECKPOINTER.load())
+STATE_CHECKPOINTER.start()
 
 # --- Topic Configuration ---
 # Topic where the clients subscribe to receive the calculated MAX CO2 value.
 # The {vehicle_id} ensures only the correct device receives the result.
 RESULTS_TOPIC_FORMAT = "vehicle/results/{}/max_co2"
 
+# --- Result Coalescing ---
+# At most one result per vehicle per interval (unless the max jumps by more than
+# the delta); held-back results are flushed by a background thread once the
+# interval ends, which works because the pinned Lambda container stays alive.
+RESULT_MIN_INTERVAL_S = float(os.environ.get("RESULT_MIN_INTERVAL_SECONDS", "1.0"))
+RESULT_MIN_DELTA = os.environ.get("RESULT_MIN_DELTA")
+
 # --- Handler Function ---
 def lambda_handler(event, context):
-    logger.info("Lambda Handler Invoked. Processing {} records.".format(len(event)))
-    
-    # Check if the event is a list (typical for batched messages)
-    if not isinstance(event, list):
-        event = [event] # Handle single message case
+    # The whole invocation is handled as one batch: the event may be a single
+    # message, a list of messages (typical for batched invocations) or
+    # columnar multi-row messages; only vehicle_id and vehicle_CO2 are read.
+    # 1. Per-vehicle max over the batch in one group-by pass
+    batch_max, skipped = max_by_vehicle(event)
+    if skipped:
+        logger.warning("Skipped {} records without a usable vehicle_id/vehicle_CO2.".format(skipped))
 
-    # Use a set to track which vehicles were updated in this batch
-    updated_vehicles = set()
+    # 2. Merge into the running state; new vehicles count as a new max
+    changed = merge_max(MAX_CO2_STATE, MAX_CO2_METRIC, batch_max)
+    for vehicle_id, co2_val in changed:
+        STATE_CHECKPOINTER.record(vehicle_id, co2_val)
 
-    for record in event:
-        try:
-            # The client simulator publishes a JSON payload, which the Lambda runtime
-            # might have already deserialized into a dictionary.
-            data = record # Assuming the incoming message is the dictionary payload
+    # 3. Publish the result back to the devices (Part 2.2) in one step,
+    # only for vehicles whose maximum changed in this batch.
+    publish_max_co2_batch(changed)
 
-            vehicle_id = str(data.get('vehicle_id'))
-            co2_val = float(data.get('CO2')) # Assuming the CO2 column header is 'CO2' in your data
-            
-            if not vehicle_id:
-                logger.warn("Skipping record: vehicle_id not found.")
-                continue
-
-            # 1. Get current max, defaulting to the received value if the vehicle is new
-            current_max = MAX_CO2_STATE.get(vehicle_id, co2_val)
-            
-            # 2. Check if the new reading is the maximum
-            if co2_val > current_max:
-                MAX_CO2_STATE[vehicle_id] = co2_val
-                updated_vehicles.add(vehicle_id)
-                logger.info("New max CO2 recorded for Vehicle {}: {}".format(vehicle_id, co2_val))
-            
-        except Exception as e:
-            logger.error("Error processing record: {} - {}".format(record, e))
-            
-    # 3. Publish the result back to the device (Part 2.2)
-    # We only publish the final maximum for vehicles that had an updated max in this batch.
-    for vehicle_id in updated_vehicles:
-        publish_max_co2(vehicle_id, MAX_CO2_STATE[vehicle_id])
-    
-    logger.info("Processing complete. Current max state: {}".format(json.dumps(MAX_CO2_STATE)))
+    logger.info("Processing complete. {} vehicles in batch, {} new maxima, {} vehicles tracked.".format(
+        len(batch_max), len(changed), len(MAX_CO2_STATE)))
     return
 
+def publish_max_co2_batch(changed):
+    """Queues the results for every (vehicle_id, max) pair of a batch."""
+    for vehicle_id, max_co2_value in changed:
+        publish_max_co2(vehicle_id, max_co2_value)
+
 def publish_max_co2(vehicle_id, max_co2_value):
+    """Queues the max CO2 result for the vehicle; it is sent now or when its publish interval ends."""
+    RESULT_COALESCER.offer(vehicle_id, max_co2_value, (vehicle_id, max_co2_value))
+
+def _send_max_co2(item):
     """Publishes the max CO2 result to the unique topic for the specific vehicle."""
-    
+    vehicle_id, max_co2_value = item
     target_topic = RESULTS_TOPIC_FORMAT.format(vehicle_id)
     payload_data = {
         "vehicle_id": vehicle_id,
@@ -86,4 +113,10 @@ def publish_max_co2(vehicle_id, max_co2_value):
         )
         logger.info("Published result for Vehicle {} to {}: {}".format(vehicle_id, target_topic, payload_json))
     except Exception as e:
-        logger.error("Failed to publish result to {}: {}".format(target_topic, e))
\ No newline at end of file
+        logger.error("Failed to publish result to {}: {}".format(target_topic, e))
+
+RESULT_COALESCER = ResultCoalescer(
+    _send_max_co2,
+    min_interval_s=RESULT_MIN_INTERVAL_S,
+    min_delta=float(RESULT_MIN_DELTA) if RESULT_MIN_DELTA else None,
+).start()
@@ -0,0 +1,350 @@
+import os
+import json
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Error codes AWS IoT returns when we call it too fast
+THROTTLE_CODES = ("ThrottlingException", "TooManyRequestsException", "LimitExceededException", "RequestLimitExceeded")
+
+STEPS = ("create_thing", "create_certificate", "attach_policy", "attach_principal", "add_to_group")
+
+
+def _error_code(exc):
+    response = getattr(exc, "response", None) or {}
+    return response.get("Error", {}).get("Code", "")
+
+
+class AdaptiveRateLimiter:
+    """Shared request pacing that halves its rate on throttling and creeps back up on success (AIMD)."""
+
+    def __init__(self, rate=10.0, min_rate=0.5, max_rate=50.0, increase=0.5):
+        self.rate = float(rate)
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate)
+        self.increase = float(increase)
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + 1.0 / self.rate
+        if slot > now:
+            time.sleep(slot - now)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def on_throttle(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+
+
+class Manifest:
+    """Local record of which provisioning steps each thing has completed.
+
+    Every completed step is appended as one JSON line, so recording a step
+    costs the same however many things the manifest holds. Loading replays
+    the lines; a rerun skips work that already happened and picks up things
+    that failed halfway.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.things = {}
+        if os.path.exists(path):
+            good = 0
+            with open(path, "rb") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        break
+                    self._apply(rec.pop("thing"), rec.pop("step"), rec)
+                    good += len(line)
+            # Cuts off a torn final line from an interrupted run, so new lines start clean
+            with open(path, "r+b") as f:
+                f.truncate(good)
+        self._file = open(path, "a")
+
+    def _apply(self, thing_name, step, fields):
+        entry = self.things.setdefault(thing_name, {"steps": []})
+        if step not in entry["steps"]:
+            entry["steps"].append(step)
+        entry.update(fields)
+
+    def get(self, thing_name):
+        with self._lock:
+            return dict(self.things.get(thing_name, {}))
+
+    def done(self, thing_name, step):
+        return step in self.get(thing_name).get("steps", [])
+
+    def complete(self, thing_name, step, **fields):
+        line = json.dumps(dict(fields, thing=thing_name, step=step)) + "\n"
+        with self._lock:
+            self._apply(thing_name, step, fields)
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class Provisioner:
+    """Creates things, certificates and their attachments on a bounded thread pool.
+
+    Every IoT call goes through a shared AdaptiveRateLimiter and is retried
+    with jittered backoff when throttled. Progress is kept in a Manifest, and
+    "already exists" answers are treated as success, so reruns resume where a
+    previous run stopped.
+    """
+
+    def __init__(self, iot, manifest, policy_name, thing_group, cert_dir=".",
+                 max_workers=8, limiter=None, max_retries=6):
+        self.iot = iot
+        self.manifest = manifest
+        self.policy_name = policy_name
+        self.thing_group = thing_group
+        self.cert_dir = cert_dir
+        self.max_workers = max_workers
+        self.limiter = limiter or AdaptiveRateLimiter()
+        self.max_retries = max_retries
+
+    def call(self, fn, **kwargs):
+        """Calls an IoT API with rate limiting and backoff on throttling."""
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            try:
+                result = fn(**kwargs)
+            except Exception as e:
+                if _error_code(e) not in THROTTLE_CODES or attempt == self.max_retries:
+                    raise
+                self.limiter.on_throttle()
+                time.sleep(random.uniform(0, min(10.0, 0.2 * 2 ** attempt)))
+                continue
+            self.limiter.on_success()
+            return result
+
+    def ensure_thing_group(self):
+        try:
+            self.call(self.iot.create_thing_group, thingGroupName=self.thing_group)
+            print(f"Created thing group: {self.thing_group}")
+        except self.iot.exceptions.ResourceAlreadyExistsException:
+            print(f"Thing group '{self.thing_group}' already exists.")
+
+    def provision(self, thing_name):
+        """Runs the steps of one thing that the manifest does not mark as done."""
+        m = self.manifest
+        if not m.done(thing_name, "create_thing"):
+            try:
+                self.call(self.iot.create_thing, thingName=thing_name)
+            except self.iot.exceptions.ResourceAlreadyExistsException:
+                pass
+            m.complete(thing_name, "create_thing")
+
+        if not m.done(thing_name, "create_certificate"):
+            cert = self.call(self.iot.create_keys_and_certificate, setAsActive=True)
+            with open(os.path.join(self.cert_dir, f"{thing_name}-certificate.pem.crt"), "w") as f:
+                f.write(cert["certificatePem"])
+            with open(os.path.join(self.cert_dir, f"{thing_name}-private.pem.key"), "w") as f:
+                f.write(cert["keyPair"]["PrivateKey"])
+            m.complete(thing_name, "create_certificate",
+                       certificate_arn=cert["certificateArn"], certificate_id=cert["certificateId"])
+        cert_arn = m.get(thing_name)["certificate_arn"]
+
+        if not m.done(thing_name, "attach_policy"):
+            self.call(self.iot.attach_policy, policyName=self.policy_name, target=cert_arn)
+            m.complete(thing_name, "attach_policy")
+
+        if not m.done(thing_name, "attach_principal"):
+            self.call(self.iot.attach_thing_principal, thingName=thing_name, principal=cert_arn)
+            m.complete(thing_name, "attach_principal")
+
+        if not m.done(thing_name, "add_to_group"):
+            self.call(self.iot.add_thing_to_thing_group, thingGroupName=self.thing_group, thingName=thing_name)
+            m.complete(thing_name, "add_to_group")
+
+    def run(self, thing_names):
+        """Provisions every thing; returns {thing_name: exception} for those that failed."""
+        failures = {}
+        lock = threading.Lock()
+
+        def one(thing_name):
+            try:
+                self.provision(thing_name)
+                print(f" - {thing_name} ready")
+            except Exception as e:
+                with lock:
+                    failures[thing_name] = e
+                print(f" - {thing_name} FAILED: {e}")
+
+        todo = self.pending(thing_names)
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="provision") as pool:
+            list(pool.map(one, todo))
+        return failures
+
+    def pending(self, thing_names):
+        """The things the manifest does not mark as fully provisioned."""
+        todo = [t for t in thing_names if not all(self.manifest.done(t, s) for s in STEPS)]
+        print(f"{len(thing_names) - len(todo)} things already provisioned, {len(todo)} to go.")
+        return todo
+
+    def run_bulk(self, thing_names, s3, bucket, key, role_arn, poll_s=5.0):
+        """Provisions the pending things with one bulk registration task, then fetches their certificates.
+
+        A thing's CSR is kept in the manifest, so a rerun reuses it (and the
+        private key already on disk) instead of generating a new key.
+        Returns {thing_name: exception} like run().
+        """
+        todo = self.pending(thing_names)
+        if not todo:
+            return {}
+        body = bulk_registration_lines(todo, self.csr_for, self.policy_name, self.thing_group)
+        task_id = start_bulk_registration(self.iot, s3, bucket, key, role_arn, body)
+        task = wait_for_bulk_registration(self.iot, task_id, poll_s)
+        print(f"Bulk registration {task['status']}: {task.get('successCount', 0)} succeeded, "
+              f"{task.get('failureCount', 0)} failed")
+        return self.fetch_certificates(todo)
+
+    def csr_for(self, thing_name):
+        csr = self.manifest.get(thing_name).get("csr")
+        if csr is None:
+            csr = make_csr(thing_name, self.cert_dir)
+            self.manifest.complete(thing_name, "make_csr", csr=csr)
+        return csr
+
+    def fetch_certificates(self, thing_names):
+        """Writes the certificate of every bulk-registered thing and marks it provisioned."""
+        failures = {}
+        lock = threading.Lock()
+
+        def one(thing_name):
+            try:
+                principals = self.call(self.iot.list_thing_principals, thingName=thing_name)["principals"]
+                cert_arns = [p for p in principals if ":cert/" in p]
+                if not cert_arns:
+                    raise RuntimeError("no certificate attached after bulk registration")
+                cert_id = cert_arns[0].rsplit("/", 1)[-1]
+                cert = self.call(self.iot.describe_certificate, certificateId=cert_id)["certificateDescription"]
+                with open(os.path.join(self.cert_dir, f"{thing_name}-certificate.pem.crt"), "w") as f:
+                    f.write(cert["certificatePem"])
+                # The registration template created the thing and its certificate, policy and group links
+                for step in STEPS:
+                    fields = {"certificate_arn": cert_arns[0], "certificate_id": cert_id} if step == "create_certificate" else {}
+                    self.manifest.complete(thing_name, step, **fields)
+                print(f" - {thing_name} ready")
+            except Exception as e:
+                with lock:
+                    failures[thing_name] = e
+                print(f" - {thing_name} FAILED: {e}")
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="provision") as pool:
+            list(pool.map(one, thing_names))
+        return failures
+
+
+# ==========================================================
+# BULK MODE
+# ==========================================================
+# Registration template for start_thing_registration_task: one template
+# instance per input line, creating the thing, attaching the certificate
+# (created up front from the line's CSR) and applying the policy.
+BULK_TEMPLATE = {
+    "Parameters": {
+        "ThingName": {"Type": "String"},
+        "CSR": {"Type": "String"},
+        "ThingGroupName": {"Type": "String"},
+        "PolicyName": {"Type": "String"},
+    },
+    "Resources": {
+        "thing": {
+            "Type": "AWS::IoT::Thing",
+            "Properties": {
+                "ThingName": {"Ref": "ThingName"},
+                "ThingGroups": [{"Ref": "ThingGroupName"}],
+            },
+        },
+        "certificate": {
+            "Type": "AWS::IoT::Certificate",
+            "Properties": {"CertificateSigningRequest": {"Ref": "CSR"}, "Status": "ACTIVE"},
+        },
+        "policy": {
+            "Type": "AWS::IoT::Policy",
+            "Properties": {"PolicyName": {"Ref": "PolicyName"}},
+        },
+    },
+}
+
+
+def make_csr(thing_name, cert_dir="."):
+    """Writes a new private key for thing_name and returns a PEM CSR for it (needs 'cryptography').
+
+    Provisioner.csr_for() calls this once per thing and keeps the CSR in the
+    manifest, so existing keys are not overwritten on reruns.
+    """
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    with open(os.path.join(cert_dir, f"{thing_name}-private.pem.key"), "wb") as f:
+        f.write(key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.TraditionalOpenSSL,
+            serialization.NoEncryption(),
+        ))
+    csr = (
+        x509.CertificateSigningRequestBuilder()
+        .subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, thing_name)]))
+        .sign(key, hashes.SHA256())
+    )
+    return csr.public_bytes(serialization.Encoding.PEM).decode("utf-8")
+
+
+def bulk_registration_lines(thing_names, csr_for, policy_name, thing_group):
+    """JSON-lines input file body for start_thing_registration_task.
+
+    csr_for(thing_name) must return a PEM certificate signing request (see
+    Provisioner.csr_for); the private keys stay local, so they are generated
+    outside AWS. Certificates are fetched afterwards with describe_certificate
+    (see Provisioner.fetch_certificates).
+    """
+    return "\n".join(
+        json.dumps({
+            "ThingName": name,
+            "CSR": csr_for(name),
+            "ThingGroupName": thing_group,
+            "PolicyName": policy_name,
+        })
+        for name in thing_names
+    ) + "\n"
+
+
+def start_bulk_registration(iot, s3, bucket, key, role_arn, body):
+    """Uploads the input file and starts a bulk registration task; returns its task id."""
+    s3.put_object(Bucket=bucket, Key=key, Body=body.encode("utf-8"))
+    response = iot.start_thing_registration_task(
+        templateBody=json.dumps(BULK_TEMPLATE),
+        inputFileBucket=bucket,
+        inputFileKey=key,
+        roleArn=role_arn,
+    )
+    return response["taskId"]
+
+
+def wait_for_bulk_registration(iot, task_id, poll_s=5.0):
+    """Polls a registration task until it finishes; returns its final description."""
+    while True:
+        task = iot.describe_thing_registration_task(taskId=task_id)
+        if task["status"] in ("Completed", "Failed", "Cancelled"):
+            return task
+        print(f"Bulk registration {task_id}: {task['status']} ({task.get('successCount', 0)} done)")
+        time.sleep(poll_s)
@@ -0,0 +1,97 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Legacy spacing between rows of one device when no schedule is configured
+DEFAULT_ROW_INTERVAL_S = 0.005
+
+
+class TokenBucket:
+    """Thread-safe token bucket: acquire() blocks until a token is available."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst if burst is not None else max(1.0, self.rate / 10))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, n=1):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= n:
+                    self.tokens -= n
+                    return
+                wait = (n - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def fixed_interval_pacer(interval_s=DEFAULT_ROW_INTERVAL_S):
+    """Sleeps a fixed interval between rows (the emulator's original behaviour)."""
+    def pace(i, trace):
+        if i:
+            time.sleep(interval_s)
+    return pace
+
+
+def rate_pacer(bucket):
+    """Draws one token per row from a bucket shared by every device."""
+    def pace(i, trace):
+        bucket.acquire()
+    return pace
+
+
+def replay_pacer(speedup=1.0, bucket=None):
+    """Spaces rows by the trace's timestep_time deltas divided by speedup.
+
+    If bucket is given, the aggregate rate cap is applied on top of the replay schedule.
+    """
+    state = {}
+
+    def pace(i, trace):
+        if trace.timesteps is not None:
+            if i == 0:
+                state["t0"] = time.monotonic()
+                state["ts0"] = trace.timesteps[0]
+            else:
+                target = state["t0"] + (trace.timesteps[i] - state["ts0"]) / speedup
+                delay = target - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+        if bucket is not None:
+            bucket.acquire()
+    return pace
+
+
+class PublishScheduler:
+    """Drives MQTTClient.publish() for many devices at once on a thread pool.
+
+    rate: target aggregate messages/second across all devices (None = unlimited).
+    replay: space each vehicle's rows by its timestep_time deltas / speedup.
+    Without rate or replay, each device keeps the fixed 5 ms row spacing.
+    """
+
+    def __init__(self, clients, rate=None, burst=None, replay=False, speedup=1.0, max_workers=None):
+        self.clients = list(clients)
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.replay = replay
+        self.speedup = float(speedup)
+        self.max_workers = max_workers or max(1, len(self.clients))
+
+    def _pacer(self):
+        if self.replay:
+            return replay_pacer(self.speedup, self.bucket)
+        if self.bucket is not None:
+            return rate_pacer(self.bucket)
+        return fixed_interval_pacer()
+
+    def run(self, topic="vehicle/emission/data"):
+        """Publishes every client's trace once; returns (messages sent, elapsed seconds)."""
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="publisher") as pool:
+            futures = [pool.submit(c.publish, topic, self._pacer()) for c in self.clients]
+            sent = sum(f.result() or 0 for f in futures)
+        return sent, time.monotonic() - start
@@ -0,0 +1,123 @@
+import json
+import time
+import bisect
+import threading
+
+# Round-trip latency histogram bucket upper bounds, in milliseconds
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+class _DeviceStats:
+    __slots__ = ("results", "interval_results", "last_result_seq", "lost", "out_of_order", "late")
+
+    def __init__(self):
+        self.results = 0
+        self.interval_results = 0
+        self.last_result_seq = 0
+        self.lost = 0
+        self.out_of_order = 0
+        self.late = 0
+
+
+class ResultCollector:
+    """Aggregates the analyzer's result messages instead of printing each one.
+
+    Results echo the telemetry's sent_at stamp, giving the round-trip latency,
+    and carry a per-topic result_seq: a jump in result_seq counts the skipped
+    results as lost, a result_seq at or below the last one seen counts as out
+    of order, and a round trip over late_after_s counts as late.
+    """
+
+    def __init__(self, late_after_s=5.0, buckets_ms=LATENCY_BUCKETS_MS):
+        self.late_after_s = float(late_after_s)
+        self.buckets_ms = tuple(buckets_ms)
+        self._lock = threading.Lock()
+        self._devices = {}
+        self._reset_interval()
+        self.total = 0
+        self.unparsable = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _reset_interval(self):
+        self._hist = [0] * (len(self.buckets_ms) + 1)
+        self._latencies_ms = []
+        self._interval_start = time.monotonic()
+
+    def record(self, device_id, payload, received_at=None):
+        received_at = time.time() if received_at is None else received_at
+        try:
+            data = json.loads(payload)
+            result = data.get("message", data)
+        except (ValueError, AttributeError):
+            with self._lock:
+                self.unparsable += 1
+            return
+
+        sent_at = result.get("sent_at") if isinstance(result, dict) else None
+        result_seq = result.get("result_seq") if isinstance(result, dict) else None
+        latency_ms = (received_at - float(sent_at)) * 1000 if sent_at is not None else None
+
+        with self._lock:
+            self.total += 1
+            stats = self._devices.get(device_id)
+            if stats is None:
+                stats = self._devices[device_id] = _DeviceStats()
+            stats.results += 1
+            stats.interval_results += 1
+            if result_seq is not None:
+                if result_seq <= stats.last_result_seq:
+                    stats.out_of_order += 1
+                else:
+                    stats.lost += result_seq - stats.last_result_seq - 1 if stats.last_result_seq else 0
+                    stats.last_result_seq = result_seq
+            if latency_ms is not None:
+                self._hist[bisect.bisect_left(self.buckets_ms, latency_ms)] += 1
+                self._latencies_ms.append(latency_ms)
+                if latency_ms > self.late_after_s * 1000:
+                    stats.late += 1
+
+    def summary(self, reset=True):
+        """One-paragraph summary of the interval since the last reset."""
+        with self._lock:
+            elapsed = max(time.monotonic() - self._interval_start, 1e-9)
+            lat = sorted(self._latencies_ms)
+            rates = [s.interval_results / elapsed for s in self._devices.values()]
+            interval_results = sum(s.interval_results for s in self._devices.values())
+            lost = sum(s.lost for s in self._devices.values())
+            out_of_order = sum(s.out_of_order for s in self._devices.values())
+            late = sum(s.late for s in self._devices.values())
+            hist = list(self._hist)
+            if reset:
+                for s in self._devices.values():
+                    s.interval_results = 0
+                self._reset_interval()
+
+        lines = ["[results] {} in last {:.0f}s ({:.1f}/s), {} total from {} devices; lost {}, out-of-order {}, late {}".format(
+            interval_results, elapsed, interval_results / elapsed, self.total, len(rates), lost, out_of_order, late)]
+        if lat:
+            pick = lambda q: lat[min(len(lat) - 1, int(q * len(lat)))]
+            lines.append("[results] round trip ms: p50 {:.1f}  p90 {:.1f}  p99 {:.1f}  max {:.1f}".format(
+                pick(0.5), pick(0.9), pick(0.99), lat[-1]))
+            labels = ["<={}".format(b) for b in self.buckets_ms] + [">{}".format(self.buckets_ms[-1])]
+            lines.append("[results] histogram: " + " ".join(
+                "{}:{}".format(label, n) for label, n in zip(labels, hist) if n))
+        if rates:
+            lines.append("[results] per-device rate/s: min {:.2f}  mean {:.2f}  max {:.2f}".format(
+                min(rates), sum(rates) / len(rates), max(rates)))
+        return "\n".join(lines)
+
+    def start(self, interval_s=10.0, printer=print):
+        """Prints summary() every interval_s from a daemon thread."""
+        def loop():
+            while not self._stop.wait(interval_s):
+                printer(self.summary())
+        self._thread = threading.Thread(target=loop, name="result-collector", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,10 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ANALYZER_SRC = os.path.join(ROOT, "EmissionAnalyzer", "src")
+
+# The scripts live in the repository root and the component's modules in EmissionAnalyzer/src
+for path in (ROOT, ANALYZER_SRC):
+    if path not in sys.path:
+        sys.path.insert(0, path)
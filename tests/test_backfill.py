@@ -0,0 +1,171 @@
+import os
+import sys
+import glob
+import json
+import subprocess
+
+import pytest
+
+pytest.importorskip("pandas")
+
+import backfill
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_GLOB = os.path.join(ROOT, "data", "vehicle*.csv")
+
+# Replays the traces through the component's MQTT callback, one row per
+# message like the emulator, in a fresh interpreter because main.py keeps
+# its state in module globals.
+STREAMING_SCRIPT = r"""
+import sys, json
+import backfill
+from local_pubsub import LocalBroker, LocalMessageFormatter, LocalPubSubClient
+from payload_encoder import load_encoded
+
+paths = json.loads(sys.argv[1])
+cfg = backfill.backfill_config(backfill.load_analyzer_config())
+sys.argv = ["main.py", json.dumps({}), json.dumps(cfg)]
+import main
+
+
+class ListSink:
+    def __init__(self):
+        self.records = []
+
+    def put(self, record):
+        self.records.append(record)
+        return True
+
+    def depth(self):
+        return 0
+
+    def close(self):
+        pass
+
+
+main.FIREHOSE_SINK = sink = ListSink()
+handler = main.EmissionHandler(LocalPubSubClient(), LocalMessageFormatter())
+broker = LocalBroker(handler.on_message)
+for n, path in enumerate(paths):
+    trace = load_encoded(path, backfill.TOPIC)
+    for i in range(len(trace)):
+        broker.publish(backfill.TOPIC, trace.payload(i, "{}-{}".format(n, i)))
+if main.ORDERING is not None:
+    handler.release_held(main.ORDERING.held_vehicles())
+handler.results.close()
+
+print(json.dumps({
+    "vehicles": {
+        vehicle_id: {
+            main.MAX_CO2_METRIC: main.MAX_CO2_STATE.get(vehicle_id, main.MAX_CO2_METRIC),
+            "aggregates": main.AGGREGATOR.snapshot(vehicle_id),
+        }
+        for vehicle_id in main.AGGREGATOR.state
+    },
+    "firehose": sink.records,
+    "leaderboards": {name: board.top() for name, board in main.LEADERBOARDS.boards.items()},
+}))
+"""
+
+
+def _without_timestamp(records):
+    return [{k: v for k, v in r.items() if k != "timestamp"} for r in records]
+
+
+def _by_vehicle(records):
+    grouped = {}
+    for r in records:
+        grouped.setdefault(r.get("vehicle_id"), []).append(r)
+    return grouped
+
+
+@pytest.fixture(scope="module")
+def streaming():
+    paths = sorted(glob.glob(DATA_GLOB))
+    out = subprocess.run(
+        [sys.executable, "-c", STREAMING_SCRIPT, json.dumps(paths)],
+        cwd=ROOT, env=dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT, backfill.ANALYZER_SRC])),
+        capture_output=True, text=True, check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+@pytest.fixture(scope="module")
+def backfilled(tmp_path_factory):
+    out = tmp_path_factory.mktemp("backfill")
+    summary = backfill.run(backfill.parse_args([DATA_GLOB, "--processes", "2", "--output", str(out)]))
+    vehicles = {}
+    firehose = []
+    for k in range(2):
+        with open(out / "vehicles.{}.jsonl".format(k)) as f:
+            for line in f:
+                v = json.loads(line)
+                vehicles[v.pop("vehicle_id")] = v
+        with open(out / "firehose.{}.jsonl".format(k)) as f:
+            firehose.extend(json.loads(line) for line in f)
+    with open(out / "fleet.json") as f:
+        fleet = json.load(f)
+    return summary, vehicles, firehose, fleet
+
+
+def test_backfill_reads_every_row_once(backfilled):
+    summary, vehicles, _, _ = backfilled
+    assert summary["errors"] == 0
+    assert summary["single_vehicle_inputs"] == summary["inputs"]
+    assert summary["vehicles"] == len(vehicles)
+
+
+def test_backfill_matches_streaming_per_vehicle_results(streaming, backfilled):
+    _, vehicles, _, _ = backfilled
+    assert set(vehicles) == set(streaming["vehicles"])
+    for vehicle_id, expected in streaming["vehicles"].items():
+        # Quantile sketches compact randomly, so only the deterministic results are compared
+        got = {k: v for k, v in vehicles[vehicle_id].items() if k != "quantiles"}
+        assert got == expected, vehicle_id
+
+
+def test_backfill_matches_streaming_firehose_records(streaming, backfilled):
+    _, _, firehose, _ = backfilled
+    expected = _by_vehicle(_without_timestamp(streaming["firehose"]))
+    assert expected
+    # Partitions interleave vehicles differently; each vehicle's records keep their order
+    assert _by_vehicle(_without_timestamp(firehose)) == expected
+
+
+def test_backfill_matches_streaming_leaderboards(streaming, backfilled):
+    _, _, _, fleet = backfilled
+    assert fleet["leaderboards"] == streaming["leaderboards"]
+
+
+def test_backfill_keeps_vehicles_beyond_the_state_store_capacity(tmp_path):
+    # 60 vehicles, 3 rows each, against a live configuration that holds only 10
+    header = open(sorted(glob.glob(DATA_GLOB))[0]).readline().strip().split(",")
+    rows = []
+    for t in range(3):
+        for v in range(60):
+            row = dict.fromkeys(header, "0.0")
+            row.update(timestep_time=str(float(t)), vehicle_id="veh{}".format(v), vehicle_CO2=str(float(v + t)),
+                       vehicle_x=str(100.0 * v), vehicle_y="50.0")
+            rows.append(",".join(row[c] for c in header))
+    csv_path = tmp_path / "fleet.csv"
+    csv_path.write_text(",".join(header) + "\n" + "\n".join(rows) + "\n")
+    config = backfill.load_analyzer_config()
+    config["state"] = dict(config.get("state", {}), **{"max-vehicles": 10, "idle-ttl-seconds": 1})
+    config_path = tmp_path / "config.json"
+    config_path.write_text(json.dumps(config))
+
+    out = tmp_path / "out"
+    summary = backfill.run(backfill.parse_args([str(csv_path), "--processes", "2", "--output", str(out),
+                                                "--config", str(config_path)]))
+    assert summary["vehicles"] == 60
+    assert summary["evicted"] == 0
+    results = {}
+    for k in range(2):
+        with open(out / "vehicles.{}.jsonl".format(k)) as f:
+            for line in f:
+                v = json.loads(line)
+                results[v["vehicle_id"]] = v["max_CO2"]
+    assert results == {"veh{}".format(v): float(v + 2) for v in range(60)}
+    with open(out / "fleet.json") as f:
+        top = json.load(f)["leaderboards"]["max_co2"]
+    assert [e["vehicle_id"] for e in top] == ["veh{}".format(v) for v in range(59, 59 - len(top), -1)]
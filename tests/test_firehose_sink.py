@@ -0,0 +1,66 @@
+import json
+
+import firehose_sink
+from firehose_sink import FirehoseSink
+
+
+class FakeFirehose:
+    def __init__(self):
+        self.batches = []
+
+    def put_record_batch(self, DeliveryStreamName, Records):
+        self.batches.append([json.loads(r["Data"]) for r in Records])
+        return {"FailedPutCount": 0}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_records_left_after_a_partial_batch_keep_their_age(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(firehose_sink, "time", clock)
+    client = FakeFirehose()
+    sink = FirehoseSink(client, "stream", max_batch_records=2, max_age_s=1.0)
+    for n in range(3):
+        sink.put({"n": n})
+    # The flusher only gets to the full batch 0.9 s later
+    clock.now += 0.9
+    sink._flush_once()
+    assert client.batches == [[{"n": 0}, {"n": 1}]]
+    assert not sink._batch_due()
+    # {"n": 2} is due max_age_s after it was added, not after the batch was taken
+    clock.now += 0.1
+    assert sink._batch_due()
+
+
+def test_byte_limit_triggers_a_flush():
+    client = FakeFirehose()
+    sink = FirehoseSink(client, "stream", max_batch_bytes=40, max_age_s=60.0)
+    sink.put({"pad": "x" * 10})
+    assert not sink._batch_due()
+    sink.put({"pad": "x" * 10})
+    assert sink._batch_due()
+    sink.close()
+    assert [len(b) for b in client.batches] == [1, 1]
+    assert sink.records_sent == 2
+
+
+def test_drop_oldest_moves_the_age_to_the_next_record(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(firehose_sink, "time", clock)
+    sink = FirehoseSink(FakeFirehose(), "stream", max_buffered=2, max_age_s=1.0)
+    sink.put({"n": 0})
+    clock.now += 0.5
+    sink.put({"n": 1})
+    clock.now += 0.3
+    sink.put({"n": 2})
+    assert sink.records_dropped == 1
+    assert sink._oldest_ts == 100.5
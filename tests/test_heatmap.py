@@ -0,0 +1,51 @@
+import pytest
+
+from heatmap import SpatialHeatmap
+
+
+def _row(x, y, co2=1.0, lane="lane0"):
+    return {"vehicle_x": x, "vehicle_y": y, "vehicle_CO2": co2, "vehicle_lane": lane}
+
+
+@pytest.fixture(params=["dense", "sparse"])
+def heatmap(request):
+    if request.param == "dense":
+        pytest.importorskip("numpy")
+    return SpatialHeatmap(cell_size=10.0, width=4, height=4, mode=request.param)
+
+
+@pytest.mark.parametrize("x, y", [("inf", 5.0), (5.0, "-inf"), ("nan", 5.0)])
+def test_non_finite_positions_are_rejected(heatmap, x, y):
+    assert heatmap.process_row("veh0", _row(x, y)) is False
+    assert heatmap.snapshot() == {"cells": [], "lanes": {}}
+
+
+def test_non_finite_values_are_rejected(heatmap):
+    assert heatmap.process_row("veh0", _row(5.0, 5.0, co2="inf")) is False
+
+
+def test_huge_positions_do_not_raise():
+    pytest.importorskip("numpy")
+    dense = SpatialHeatmap(cell_size=10.0, width=4, height=4)
+    assert dense.process_row("veh0", _row(1e30, 5.0)) is True
+    assert dense.process_row("veh1", _row(5.0, -1e300)) is True
+    snap = dense.snapshot()
+    assert dense.out_of_bounds == 2
+    assert snap["cells"] == []
+    # Lanes have no bounds
+    assert snap["lanes"] == {"lane0": [2.0, 1.0, 2, 2]}
+
+    sparse = SpatialHeatmap(cell_size=10.0, mode="sparse")
+    assert sparse.process_row("veh0", _row(1e30, 5.0)) is False
+    assert sparse.process_row("veh0", _row(-25.0, 5.0)) is True
+    assert sparse.snapshot()["cells"] == [[-3, 0, 1.0, 1.0, 1, 1]]
+
+
+def test_leaving_the_grid_frees_the_cell():
+    pytest.importorskip("numpy")
+    heatmap = SpatialHeatmap(cell_size=10.0, width=4, height=4)
+    heatmap.process_row("veh0", _row(15.0, 5.0))
+    heatmap.process_row("veh0", _row(95.0, 5.0))
+    heatmap.process_row("veh0", _row(1e30, 5.0))
+    assert heatmap.snapshot()["cells"] == [[1, 0, 1.0, 1.0, 1, 0]]
+    assert heatmap.out_of_bounds == 2
@@ -0,0 +1,43 @@
+import random
+
+from leaderboard import Leaderboard, _SortedEntries
+
+
+def test_sorted_entries_match_a_sorted_list():
+    rng = random.Random(3)
+    entries = _SortedEntries(load=4)
+    expected = []
+    for _ in range(5000):
+        if expected and rng.random() < 0.45:
+            entry = expected.pop(rng.randrange(len(expected)))
+            entries.remove(entry)
+        else:
+            entry = (-rng.randrange(100), "veh{}".format(rng.randrange(10 ** 6)))
+            if entry in expected:
+                continue
+            expected.append(entry)
+            entries.add(entry)
+        expected.sort()
+        assert entries.head(len(expected) + 1) == expected
+    for position, entry in enumerate(expected):
+        assert entries.index(entry) == position
+
+
+def test_scores_move_both_ways():
+    board = Leaderboard("max_co2", k=3)
+    for i in range(20):
+        board.update("veh{}".format(i), float(i))
+    assert [e["vehicle_id"] for e in board.top()] == ["veh19", "veh18", "veh17"]
+    # A window dropping its peak moves the vehicle down; ties rank by vehicle id
+    board.update("veh19", 1.0)
+    assert board.top() == [
+        {"rank": 1, "vehicle_id": "veh18", "value": 18.0},
+        {"rank": 2, "vehicle_id": "veh17", "value": 17.0},
+        {"rank": 3, "vehicle_id": "veh16", "value": 16.0},
+    ]
+    assert board.rank("veh19") == 19
+    assert board.rank("veh1") == 18
+    board.forget("veh18")
+    assert len(board) == 19
+    assert board.rank("veh18") is None
+    assert board.top(1) == [{"rank": 1, "vehicle_id": "veh17", "value": 17.0}]
@@ -0,0 +1,102 @@
+import os
+
+import pytest
+
+moto = pytest.importorskip("moto")
+boto3 = pytest.importorskip("boto3")
+from botocore.exceptions import ClientError
+
+from provisioning import AdaptiveRateLimiter, Manifest, Provisioner, STEPS
+
+REGION = "us-east-2"
+POLICY = "iotea_policy"
+GROUP = "iotea_goon_squad"
+
+# moto 5 mocks every service with mock_aws; older releases have one decorator per service
+mock_aws = getattr(moto, "mock_aws", None) or moto.mock_iot
+
+
+class FlakyIoT:
+    """Wraps an IoT client; failures maps an API name to (error code, times it fails before passing through)."""
+
+    def __init__(self, iot, failures):
+        self._iot = iot
+        self._failures = {name: list(f) for name, f in failures.items()}
+        self.calls = {}
+
+    def __getattr__(self, name):
+        fn = getattr(self._iot, name)
+        if not callable(fn):
+            return fn
+
+        def call(**kwargs):
+            self.calls[name] = self.calls.get(name, 0) + 1
+            failure = self._failures.get(name)
+            if failure and failure[1] > 0:
+                failure[1] -= 1
+                raise ClientError({"Error": {"Code": failure[0], "Message": failure[0]}}, name)
+            return fn(**kwargs)
+
+        return call
+
+
+@pytest.fixture
+def iot():
+    with mock_aws():
+        client = boto3.client("iot", region_name=REGION)
+        client.create_policy(policyName=POLICY, policyDocument='{"Version": "2012-10-17", "Statement": []}')
+        yield client
+
+
+def provisioner(iot, tmp_path, **kwargs):
+    return Provisioner(
+        iot, Manifest(str(tmp_path / "manifest.jsonl")), POLICY, GROUP, cert_dir=str(tmp_path),
+        limiter=AdaptiveRateLimiter(rate=1000, max_rate=1000), **kwargs,
+    )
+
+
+def test_provisions_every_thing(iot, tmp_path):
+    names = [f"MyThing-{i}" for i in range(1, 6)]
+    p = provisioner(iot, tmp_path, max_workers=4)
+    p.ensure_thing_group()
+
+    assert p.run(names) == {}
+
+    assert sorted(t["thingName"] for t in iot.list_things()["things"]) == names
+    assert sorted(iot.list_things_in_thing_group(thingGroupName=GROUP)["things"]) == names
+    assert len(iot.list_certificates()["certificates"]) == len(names)
+    for name in names:
+        assert all(p.manifest.done(name, step) for step in STEPS)
+        assert len(iot.list_thing_principals(thingName=name)["principals"]) == 1
+        assert os.path.exists(tmp_path / f"{name}-certificate.pem.crt")
+        assert os.path.exists(tmp_path / f"{name}-private.pem.key")
+
+
+def test_rerun_resumes_without_recreating_certificates(iot, tmp_path):
+    names = ["MyThing-1", "MyThing-2"]
+    # The first run stops after the certificates were created
+    flaky = FlakyIoT(iot, {"attach_thing_principal": ("InternalFailureException", 2)})
+    p = provisioner(flaky, tmp_path, max_workers=1)
+    p.ensure_thing_group()
+    assert set(p.run(names)) == set(names)
+    p.manifest.close()
+
+    # A new run reads the manifest back from disk and only finishes the missing steps
+    p = provisioner(FlakyIoT(iot, {}), tmp_path)
+    assert p.run(names) == {}
+    assert "create_keys_and_certificate" not in p.iot.calls
+    assert "create_thing" not in p.iot.calls
+    assert len(iot.list_certificates()["certificates"]) == len(names)
+    for name in names:
+        assert len(iot.list_thing_principals(thingName=name)["principals"]) == 1
+
+
+def test_throttling_is_retried_and_slows_down(iot, tmp_path):
+    flaky = FlakyIoT(iot, {"create_thing": ("ThrottlingException", 3)})
+    p = provisioner(flaky, tmp_path, max_workers=1)
+    p.ensure_thing_group()
+    rate = p.limiter.rate
+
+    assert p.run(["MyThing-1"]) == {}
+    assert flaky.calls["create_thing"] == 4
+    assert p.limiter.rate < rate
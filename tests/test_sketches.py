@@ -0,0 +1,79 @@
+import random
+
+import pytest
+
+from sketches import KLLSketch, DEFAULT_K
+
+PERCENTILES = [i / 100 for i in range(1, 100)]
+# Documented rank error is about 1.7 / k; allow a little slack over it
+MAX_RANK_ERROR = 2.0 / DEFAULT_K
+
+
+def _shuffled(n, seed):
+    values = list(range(n))
+    random.Random(seed).shuffle(values)
+    return values
+
+
+def _rank_error(sketch, n):
+    # Values are 0..n-1, so a value's rank is the value itself
+    return max(abs(v / n - q) for v, q in zip(sketch.quantiles(PERCENTILES), PERCENTILES))
+
+
+def _sketch(values):
+    sketch = KLLSketch()
+    for v in values:
+        sketch.update(v)
+    return sketch
+
+
+@pytest.fixture(autouse=True)
+def _seeded():
+    # Compaction offsets come from the random module
+    state = random.getstate()
+    random.seed(1)
+    yield
+    random.setstate(state)
+
+
+def test_empty_sketch():
+    assert KLLSketch().quantiles((0.5, 0.9)) == [None, None]
+
+
+def test_small_stream_is_exact():
+    sketch = _sketch(_shuffled(DEFAULT_K // 2, seed=0))
+    assert sketch.quantiles((0.0, 0.5, 1.0)) == [0, 31, 63]
+
+
+def test_accuracy_and_memory_at_one_million_samples():
+    n = 1_000_000
+    sketch = _sketch(_shuffled(n, seed=0))
+    assert sketch.n == n
+    assert (sketch.min, sketch.max) == (0, n - 1)
+    assert _rank_error(sketch, n) < MAX_RANK_ERROR
+    # About 3 * k doubles
+    assert sketch.memory_bytes() <= 4 * 1024
+
+
+def test_merged_sketch_summarizes_the_combined_stream():
+    n = 200_000
+    values = _shuffled(n, seed=2)
+    parts = [_sketch(values[i::4]) for i in range(4)]
+    merged = KLLSketch()
+    for part in parts:
+        merged.merge(part)
+    assert merged.n == n
+    assert (merged.min, merged.max) == (0, n - 1)
+    assert _rank_error(merged, n) < MAX_RANK_ERROR
+    assert merged.memory_bytes() <= 4 * 1024
+
+
+def test_merge_leaves_the_other_sketch_alone():
+    a = _sketch(range(1000))
+    b = _sketch(range(1000, 3000))
+    before = b.copy()
+    a.merge(b).merge(KLLSketch())
+    assert a.n == 3000
+    assert (a.min, a.max) == (0, 2999)
+    assert [list(level) for level in b.levels] == [list(level) for level in before.levels]
+    assert b.n == before.n
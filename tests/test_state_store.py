@@ -0,0 +1,35 @@
+from state_store import VehicleStateStore
+
+
+def test_eviction_callback_runs_after_the_lock_is_released():
+    seen = []
+
+    def on_evict(vehicle_id):
+        # Cleanup that reads the store, or waits on a worker that does, must not run under its lock
+        seen.append((vehicle_id, vehicle_id in store, len(store), store._lock.locked()))
+
+    store = VehicleStateStore(["max_CO2"], max_vehicles=2, on_evict=on_evict)
+    store.update_max("veh0", "max_CO2", 1.0, now=0.0)
+    store.update_max("veh1", "max_CO2", 2.0, now=1.0)
+    assert store.update_max("veh2", "max_CO2", 3.0, now=2.0) == (None, True)
+    assert len(seen) == 1
+    evicted, present, size, locked = seen[0]
+    assert evicted in ("veh0", "veh1")
+    assert (present, size, locked) == (False, 2, False)
+    assert store.evictions == 1
+
+
+def test_idle_vehicles_are_swept_and_notified():
+    evicted = []
+    store = VehicleStateStore(["max_CO2"], ttl_s=10.0, on_evict=evicted.append)
+    store.set("veh0", "max_CO2", 1.0, now=0.0)
+    store.set("veh1", "max_CO2", 2.0, now=5.0)
+    store.set("veh1", "max_CO2", 2.0, now=20.0)
+    assert evicted == ["veh0"]
+    assert store.to_dict("max_CO2") == {"veh1": 2.0}
+
+
+def test_on_miss_seeds_a_returning_vehicle():
+    store = VehicleStateStore(["max_CO2"], max_vehicles=1, on_miss=lambda vehicle_id: {"max_CO2": 5.0})
+    assert store.update_max("veh0", "max_CO2", 4.0) == (5.0, False)
+    assert store.update_max("veh0", "max_CO2", 6.0) == (5.0, True)
@@ -0,0 +1,39 @@
+import pytest
+
+from telemetry_codec import COLUMNAR_FORMAT, decode_rows, encode_columnar, split_by_vehicle
+
+ROWS = [
+    {"vehicle_id": "veh0", "vehicle_CO2": 1.0},
+    {"vehicle_id": "veh1", "vehicle_CO2": 2.0},
+    {"vehicle_id": "veh0", "vehicle_CO2": 3.0},
+]
+
+MALFORMED = [
+    {"format": COLUMNAR_FORMAT, "columns": ["vehicle_id", "vehicle_CO2"]},
+    {"format": COLUMNAR_FORMAT, "rows": [["veh1", 1.0]]},
+    {"format": COLUMNAR_FORMAT, "columns": ["vehicle_id", "vehicle_CO2"], "rows": [["veh1", 1.0], ["veh1"]]},
+    {"format": COLUMNAR_FORMAT, "columns": ["vehicle_id", "vehicle_CO2"], "rows": [["veh1", 1.0, 5.0]]},
+    {"format": COLUMNAR_FORMAT, "columns": ["vehicle_id", "vehicle_CO2"], "rows": ["veh1"]},
+]
+
+
+def test_batch_round_trip():
+    batch = encode_columnar(ROWS)
+    assert decode_rows(batch) == ROWS
+    assert decode_rows([batch, ROWS[0]]) == ROWS + ROWS[:1]
+
+
+def test_split_keeps_each_vehicles_rows_in_order():
+    batch = dict(encode_columnar(ROWS), seq=7)
+    parts = split_by_vehicle(batch)
+    assert [vehicle_id for vehicle_id, _ in parts] == ["veh0", "veh1"]
+    assert decode_rows(parts[0][1]) == [ROWS[0], ROWS[2]]
+    assert all(part["seq"] == 7 for _, part in parts)
+
+
+@pytest.mark.parametrize("batch", MALFORMED)
+def test_malformed_batches_are_rejected(batch):
+    with pytest.raises(ValueError):
+        decode_rows(batch)
+    # Left whole, so the worker that decodes it reports the error
+    assert split_by_vehicle(batch) == [("unknown", batch)]
@@ -1,5 +1,7 @@
+import os
+import sys
 import boto3
-import json
+from provisioning import Manifest, Provisioner, AdaptiveRateLimiter
 
 # Initialize IoT client (region must match your IoT Core region)
 iot = boto3.client('iot', region_name='us-east-2')
@@ -9,48 +11,38 @@ THING_GROUP = "iotea_goon_squad"
 POLICY_NAME = "iotea_policy"
 NUM_THINGS = 499
 
-# === CREATE THING GROUP (only once) ===
-try:
-    iot.create_thing_group(thingGroupName=THING_GROUP)
-    print(f"Created thing group: {THING_GROUP}")
-except iot.exceptions.ResourceAlreadyExistsException:
-    print(f"Thing group '{THING_GROUP}' already exists.")
-
-# === CREATE MULTIPLE THINGS ===
-for i in range(1, NUM_THINGS + 1):
-    thing_name = f"MyThing-{i}"
-    print(f"\nCreating {thing_name}...")
-
-    iot.create_thing(thingName=thing_name)
-    print(f" - Thing created: {thing_name}")
-
-    cert_response = iot.create_keys_and_certificate(setAsActive=True)
-    cert_arn = cert_response['certificateArn']
-    cert_id = cert_response['certificateId']
-    cert_pem = cert_response['certificatePem']
-    private_key = cert_response['keyPair']['PrivateKey']
-
-    print(f" - Certificate ARN: {cert_arn}")
-
-    with open(f"{thing_name}-certificate.pem.crt", "w") as f:
-        f.write(cert_pem)
-    with open(f"{thing_name}-private.pem.key", "w") as f:
-        f.write(private_key)
-
-    iot.attach_policy(
-        policyName=POLICY_NAME,
-        target=cert_arn
-    )
-    print(f" - Attached policy: {POLICY_NAME}")
-
-    iot.attach_thing_principal(
-        thingName=thing_name,
-        principal=cert_arn
-    )
-
-    iot.add_thing_to_thing_group(
-        thingGroupName=THING_GROUP,
-        thingName=thing_name
-    )
+MAX_WORKERS = 8                 # concurrent API calls
+START_RATE = 10                 # initial requests/s; halved on throttling, raised again on success
+MAX_RATE = 50                   # IoT control-plane limits are per-API, roughly 10-100 TPS
+MANIFEST_PATH = "provisioning_manifest.jsonl"  # rerun the script to resume a partial run
+
+# Bulk mode: one start_thing_registration_task for the whole fleet (needs 'cryptography' for CSRs)
+BULK_MODE = "--bulk" in sys.argv
+BULK_BUCKET = os.environ.get("PROVISION_BUCKET", "")
+BULK_ROLE_ARN = os.environ.get("PROVISION_ROLE_ARN", "")
+
+thing_names = [f"MyThing-{i}" for i in range(1, NUM_THINGS + 1)]
 
+provisioner = Provisioner(
+    iot,
+    Manifest(MANIFEST_PATH),
+    POLICY_NAME,
+    THING_GROUP,
+    max_workers=MAX_WORKERS,
+    limiter=AdaptiveRateLimiter(rate=START_RATE, max_rate=MAX_RATE),
+)
+
+# === CREATE THING GROUP (only once) ===
+provisioner.ensure_thing_group()
+
+if BULK_MODE:
+    # === BULK REGISTRATION (then certificates are fetched per thing) ===
+    failures = provisioner.run_bulk(thing_names, boto3.client('s3'), BULK_BUCKET, "things.jsonl", BULK_ROLE_ARN)
+else:
+    # === CREATE MULTIPLE THINGS ===
+    failures = provisioner.run(thing_names)
+
+if failures:
+    print(f"\n{len(failures)} things failed; rerun to resume: {', '.join(sorted(failures))}")
+    sys.exit(1)
 print("\nAll things created successfully!")
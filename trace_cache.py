@@ -0,0 +1,130 @@
+import os
+import json
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+
+# Cached traces live next to the CSVs: <csv dir>/.trace_cache/<csv name>.<mtime_ns>/
+CACHE_DIR_NAME = ".trace_cache"
+META_FILE = "meta.json"
+FORMAT_VERSION = 1
+
+
+class Trace:
+    """A vehicle trace loaded from the columnar cache.
+
+    Numeric columns are read-only memory-mapped NumPy arrays, so every process
+    loading the same trace shares the page cache. String columns are
+    dictionary-encoded: an int32 code array plus the list of distinct values
+    (code -1 = missing).
+    """
+
+    def __init__(self, columns, arrays, dictionaries):
+        self.columns = columns
+        self.arrays = arrays
+        self.dictionaries = dictionaries
+
+    def __len__(self):
+        return len(self.arrays[self.columns[0]]) if self.columns else 0
+
+    def column(self, name):
+        """Decoded values of one column as a list of Python objects."""
+        values = self.arrays[name].tolist()
+        dictionary = self.dictionaries.get(name)
+        if dictionary is None:
+            return values
+        return [dictionary[c] if c >= 0 else float("nan") for c in values]
+
+    def records(self):
+        """Rows as dicts, equivalent to pd.read_csv(path).to_dict('records')."""
+        columns = self.columns
+        return [dict(zip(columns, row)) for row in zip(*(self.column(c) for c in columns))]
+
+    def to_frame(self):
+        data = {}
+        for name in self.columns:
+            dictionary = self.dictionaries.get(name)
+            if dictionary is None:
+                data[name] = np.asarray(self.arrays[name])
+            else:
+                data[name] = pd.Categorical.from_codes(np.asarray(self.arrays[name]), dictionary).astype(object)
+        return pd.DataFrame(data, columns=self.columns)
+
+
+def _cache_root(path):
+    return os.path.join(os.path.dirname(os.path.abspath(path)), CACHE_DIR_NAME)
+
+
+def _cache_dir(path, mtime_ns):
+    return os.path.join(_cache_root(path), "{}.{}".format(os.path.basename(path), mtime_ns))
+
+
+def build_cache(path):
+    """Converts one CSV into the columnar cache and returns its directory."""
+    mtime_ns = os.stat(path).st_mtime_ns
+    target = _cache_dir(path, mtime_ns)
+    if os.path.isdir(target):
+        return target
+
+    df = pd.read_csv(path)
+    root = _cache_root(path)
+    os.makedirs(root, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=root, prefix=".build-")
+    try:
+        dictionaries = {}
+        for i, name in enumerate(df.columns):
+            series = df[name]
+            if not pd.api.types.is_numeric_dtype(series):
+                codes, uniques = pd.factorize(series)
+                np.save(os.path.join(tmp, "{}.npy".format(i)), codes.astype(np.int32))
+                dictionaries[name] = [str(u) for u in uniques]
+            else:
+                np.save(os.path.join(tmp, "{}.npy".format(i)), series.to_numpy())
+        with open(os.path.join(tmp, META_FILE), "w") as f:
+            json.dump({
+                "version": FORMAT_VERSION,
+                "source": os.path.basename(path),
+                "mtime_ns": mtime_ns,
+                "rows": len(df),
+                "columns": list(df.columns),
+                "dictionaries": dictionaries,
+            }, f)
+        try:
+            os.rename(tmp, target)
+        except OSError:
+            # Another process finished the same build first
+            shutil.rmtree(tmp, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+    # Drop caches built from older versions of this CSV
+    prefix = os.path.basename(path) + "."
+    for name in os.listdir(root):
+        stale = os.path.join(root, name)
+        if name.startswith(prefix) and stale != target:
+            shutil.rmtree(stale, ignore_errors=True)
+    return target
+
+
+def load_trace(path):
+    """Loads a CSV through the columnar cache, (re)building it if the CSV's mtime changed."""
+    directory = build_cache(path)
+    with open(os.path.join(directory, META_FILE)) as f:
+        meta = json.load(f)
+    if meta.get("version") != FORMAT_VERSION:
+        shutil.rmtree(directory, ignore_errors=True)
+        return load_trace(path)
+    arrays = {
+        name: np.load(os.path.join(directory, "{}.npy".format(i)), mmap_mode="r")
+        for i, name in enumerate(meta["columns"])
+    }
+    return Trace(meta["columns"], arrays, meta["dictionaries"])
+
+
+if __name__ == "__main__":
+    # Pre-build the cache: python trace_cache.py data/vehicle*.csv
+    import sys
+    for csv_path in sys.argv[1:]:
+        print("{} -> {}".format(csv_path, build_cache(csv_path)))